@@ -0,0 +1,197 @@
+# 制御のホットパスのベンチマーク（ロボット・スマホ・can0 なしで動く）
+#   python bench/bench_hot_paths.py [-n 20000] [--budget-us 50]
+# area.py の中の time.sleep だけを何もしないものに差し替え、CANは python-can の virtual インターフェースに送る
+# 送信キューは計測中に捨てることがない大きさにする（最後に送り終わるのを待ってから送信数を表示する）
+# 1回あたりの時間と、tracemalloc で測った1回あたりのメモリ確保量・残ったブロック数を表示する. --budget-us を超えたものには "OVER" を付ける
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import types
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import can
+import area
+from area import Area, AreaState, SeedlingHandPosition, SeedlingHandState
+from client_data import ClientController, ControllerSnapshotDiffer, WheelDataFromClient
+from main import BINARY_ACTUATORS, CAN_TX_PRIORITY, R1CANLister, R1MainController, build_frame_table
+from can_list import CAN
+from actuator_shadow import ActuatorShadow
+from NHK2024_Raspi_Library import OneStateButtonHandler, TwoStateButton, TwoStateButtonHandler
+from can_tx import CANTransmitter
+from can_waiter import CANResponseWaiter
+from latency import LatencyProbe
+from wheel_control import WheelController
+from sequence import SequenceRunner
+
+class NullLogSystem:
+    def write(self, text):
+        pass
+
+    def update_error_log(self, text):
+        pass
+
+    def update_received_can_log(self, msg):
+        pass
+
+    def update_send_can_log(self, msg):
+        pass
+
+def no_sleep(seconds):
+    pass
+
+def no_write_can_bus(can_id, data):
+    pass
+
+CONTROLLER_DATA = {
+    "btn_a": 1, "btn_b": 0, "btn_x": 1, "btn_y": 0, "btn_rb": 0,
+    "seedling_hand_pos": SeedlingHandPosition.PICKUP.value, "area_state": Area.SEEDLING.value
+}
+
+# MainController.__init__（UDP・can0 を開く）を通さずに、parse_to_can_message に必要な所だけ用意する
+# tx_queue_size: CANTransmitter の送信キューの大きさ
+def make_controller(bus: can.BusABC, tx_queue_size: int = 256) -> R1MainController:
+    controller = R1MainController.__new__(R1MainController)
+    controller.log_system = NullLogSystem()
+    controller.bus = bus
+    controller.latency = LatencyProbe(enabled=False)
+    controller.can_transmitter = CANTransmitter(bus=bus, priority_of=CAN_TX_PRIORITY, maxsize=tx_queue_size, min_interval=0, frame_table=build_frame_table())
+    controller.can_transmitter.start()
+    controller.response_waiter = CANResponseWaiter()
+    controller.actuator_shadow = ActuatorShadow([message.can_id for message in BINARY_ACTUATORS] + [CAN.SEEDLING_HAND_POSITION.can_id])
+    controller.btn_a_state = TwoStateButtonHandler(state=TwoStateButton.WAIT_1)
+    controller.btn_b_state = TwoStateButtonHandler(state=TwoStateButton.WAIT_1)
+    controller.btn_x_state = TwoStateButtonHandler(state=TwoStateButton.WAIT_1)
+    controller.btn_y_state = TwoStateButtonHandler(state=TwoStateButton.WAIT_1)
+    controller.btn_rb_state = OneStateButtonHandler()
+    controller.seedling_hand_state = SeedlingHandState(SeedlingHandPosition.PICKUP)
+    controller.two_state_button_table = controller.build_two_state_button_table()
+    controller.input_differ = ControllerSnapshotDiffer(full_interval=float("inf"))
+    controller.checkpoint = None
+    controller.sequence_runner = SequenceRunner()
+    controller.area_state = AreaState(
+        initialize_seedling_state=lambda: None,
+        initialize_ball_state=lambda: None,
+        initialize_start_state=lambda: None,
+        state=Area.SEEDLING
+    )
+    return controller
+
+# 送信スレッドが送り終わる（送信数が増えなくなる）まで待つ
+def wait_sent(transmitter: CANTransmitter, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    sent = -1
+    while time.monotonic() < deadline and transmitter.stats()["sent"] != sent:
+        sent = transmitter.stats()["sent"]
+        time.sleep(0.2)
+
+def measure(fn: Callable[[int], None], number: int) -> Tuple[float, float, float]:
+    # warm up
+    for i in range(min(number, 1000)):
+        fn(i)
+
+    start = time.perf_counter_ns()
+    for i in range(number):
+        fn(i)
+    elapsed = time.perf_counter_ns() - start
+
+    # 1回の呼び出しの中で一時的に確保されたメモリ（tracemalloc の peak）の平均と、呼び出し後に残ったブロック数
+    samples = min(number, 2000)
+    peak_total = 0
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    for i in range(samples):
+        tracemalloc.reset_peak()
+        (before, _) = tracemalloc.get_traced_memory()
+        fn(i)
+        (_, peak) = tracemalloc.get_traced_memory()
+        peak_total += peak - before
+    blocks_after = sys.getallocatedblocks()
+    tracemalloc.stop()
+
+    return (elapsed / number / 1000, peak_total / samples, (blocks_after - blocks_before) / samples)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=20000)
+    parser.add_argument("--budget-us", type=float, default=None, help="1回あたりの上限（ラズパイのCPUで許される時間）")
+    args = parser.parse_args()
+
+    # area.py が参照している time だけを差し替える（CANTransmitter・SequenceRunner の time.sleep はそのまま）
+    area.time = types.SimpleNamespace(sleep=no_sleep)
+
+    bus = can.Bus(interface="virtual", channel="bench", receive_own_messages=False)
+    sink = can.Bus(interface="virtual", channel="bench")
+    # 1回の呼び出しで送るフレームは数個まで. warm up と tracemalloc の分も入る大きさにする
+    controller = make_controller(bus, tx_queue_size=(args.number + 3000) * 4)
+
+    lister = R1CANLister()
+    lister.init_write_fnc(no_write_can_bus, no_write_can_bus, no_write_can_bus, no_write_can_bus)
+    lister.init_write_can_bus_func(no_write_can_bus)
+    lister.register_handler(CAN.ARM_STATE.can_id, controller.on_arm_state)
+    lister.register_handler(CAN.RESPONSE_SEEDLING_MECHANISM.can_id, lambda data, msg: controller.response_waiter.dispatch(msg))
+    arm_state_msg = can.Message(arbitration_id=CAN.ARM_STATE.can_id, data=[0], is_extended_id=False)
+    response_msg = can.Message(arbitration_id=CAN.RESPONSE_SEEDLING_MECHANISM.can_id, data=[], is_extended_id=False)
+    unhandled_msg = can.Message(arbitration_id=0x7FF, data=[1, 2, 3], is_extended_id=False)
+
+    hand_state = SeedlingHandState(SeedlingHandPosition.PICKUP)
+    area_state = AreaState(lambda: None, lambda: None, lambda: None)
+    areas = (Area.SEEDLING, Area.BALL)
+    hand_positions = (SeedlingHandPosition.PICKUP.value, SeedlingHandPosition.PUTINSIDE.value)
+
+    packets: List[ClientController] = []
+    for (btn_a, btn_y) in ((0, 0), (1, 0), (1, 1), (0, 1)):
+        data = dict(CONTROLLER_DATA, btn_a=btn_a, btn_y=btn_y)
+        packets.append(ClientController(data))
+
+    # スマホのパケットが 4 tick ごとに届く
+    wheel_samples = [(127 + (i % 64), 200 - (i % 64), 127, i * 0.04) for i in range(64)]
+    wheel_controller = WheelController(lambda: wheel_samples[(wheel_tick[0] >> 2) & 63])
+    wheel_tick = [0]
+    def step_wheel(i):
+        wheel_tick[0] = i
+        wheel_controller.step(((i >> 2) & 63) * 0.04 + (i & 3) * 0.01)
+
+    benchmarks = [
+        ("ClientController(dict)", lambda i: ClientController(CONTROLLER_DATA)),
+        ("WheelDataFromClient(dict)", lambda i: WheelDataFromClient({"v_x": 127, "v_y": 200, "omega": 30})),
+        ("parse_to_can_message (buttons toggle)", lambda i: controller.parse_to_can_message(packets[i & 3])),
+        ("parse_to_can_message (same packet)", lambda i: controller.parse_to_can_message(packets[0])),
+        ("SeedlingHandState.update_state (same)", lambda i: hand_state.update_state(SeedlingHandPosition.PICKUP.value, no_write_can_bus)),
+        ("SeedlingHandState.update_state (change)", lambda i: hand_state.update_state(hand_positions[i & 1], no_write_can_bus)),
+        ("SeedlingHandState.set_btn_y_handler", lambda i: hand_state.set_btn_y_handler(no_write_can_bus)),
+        ("AreaState.set_state (same)", lambda i: area_state.set_state(Area.START)),
+        ("AreaState.set_state (change)", lambda i: area_state.set_state(areas[i & 1])),
+        ("WheelController.step", step_wheel),
+        ("R1CANLister.on_message_received (ARM_STATE)", lambda i: lister.on_message_received(arm_state_msg)),
+        ("R1CANLister.on_message_received (RESPONSE)", lambda i: lister.on_message_received(response_msg)),
+        ("R1CANLister.on_message_received (unhandled)", lambda i: lister.on_message_received(unhandled_msg)),
+    ]
+
+    # update_state などの print は計測の邪魔なので捨てる
+    stdout = sys.stdout
+    results = []
+    for (name, fn) in benchmarks:
+        sys.stdout = open(os.devnull, "w")
+        try:
+            results.append((name, measure(fn, args.number)))
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    print(f"{'benchmark':<46} {'us/call':>9} {'peak B/call':>12} {'blocks/call':>12}")
+    for (name, (us, peak_bytes, blocks)) in results:
+        over = " OVER" if args.budget_us is not None and us > args.budget_us else ""
+        print(f"{name:<46} {us:9.2f} {peak_bytes:12.1f} {blocks:12.2f}{over}")
+    wait_sent(controller.can_transmitter)
+    print(f"CAN frames sent: {controller.can_transmitter.stats()}")
+
+    controller.can_transmitter.stop()
+    sink.shutdown()
+    bus.shutdown()
+
+if __name__ == "__main__":
+    main()
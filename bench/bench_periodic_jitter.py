@@ -0,0 +1,126 @@
+# 周期送信の間隔のばらつきを、Python のループで送る場合とカーネル(BCM)に任せる場合で比べる
+#   sudo ip link add dev vcan0 type vcan && sudo ip link set vcan0 up
+#   python bench/bench_periodic_jitter.py --channel vcan0 --period 0.02 --duration 10
+#   python bench/bench_periodic_jitter.py --channel vcan0 --load 4 --stall-ms 50   # CPU負荷・インタプリタの停止を入れる
+# 受信側は同じチャンネルの別ソケットで、カーネルの受信時刻(msg.timestamp)から間隔を計算する
+# 送信は別プロセスで行うので、プロセスをまたげない python-can の virtual インターフェースでは測れない（vcan を使う）
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import can
+from periodic_tx import BCMPeriodicFrame
+
+CAN_ID = 0x10B # ROBOT_VEL
+DATA = bytes([127, 127, 127])
+
+def busy_loop():
+    while True:
+        pass
+
+def stall(stall_ms: float, stall_every: float, last_stall: List[float]):
+    # GC や重い処理で Python が止まったときの代わり
+    now = time.monotonic()
+    if stall_ms > 0 and now - last_stall[0] >= stall_every:
+        last_stall[0] = now
+        time.sleep(stall_ms / 1000)
+
+# sendWheelDataRegularly と同じ、次の送信時刻を基準に待つループ
+def python_sender(channel: str, interface: str, period: float, stall_ms: float, stall_every: float):
+    bus = can.Bus(channel=channel, interface=interface)
+    msg = can.Message(arbitration_id=CAN_ID, data=DATA, is_extended_id=False)
+    last_stall = [time.monotonic()]
+    next_time = time.monotonic()
+    while True:
+        bus.send(msg)
+        stall(stall_ms, stall_every, last_stall)
+        next_time += period
+        delay = next_time - time.monotonic()
+        if delay < 0:
+            next_time = time.monotonic()
+            delay = 0
+        time.sleep(delay)
+
+# 送信はカーネル. Python は tick ごとに renew するだけ（main.py の --periodic bcm と同じ）
+def bcm_sender(channel: str, interface: str, period: float, stall_ms: float, stall_every: float, lease: float, tick: float):
+    bus = can.Bus(channel=channel, interface=interface)
+    frame = BCMPeriodicFrame(bus, CAN_ID, DATA, period=period, lease=lease)
+    frame.start()
+    last_stall = [time.monotonic()]
+    while True:
+        frame.renew()
+        stall(stall_ms, stall_every, last_stall)
+        time.sleep(tick)
+
+def measure(target, args, channel: str, interface: str, duration: float, period: float) -> Dict[str, float]:
+    receiver = can.Bus(channel=channel, interface=interface, can_filters=[{"can_id": CAN_ID, "can_mask": 0x7FF}])
+    sender = multiprocessing.Process(target=target, args=args, daemon=True)
+    sender.start()
+
+    timestamps: List[float] = []
+    # 最初の1秒は捨てる
+    start = time.monotonic() + 1.0
+    end = start + duration
+    while time.monotonic() < end:
+        msg = receiver.recv(timeout=0.1)
+        if msg is not None and msg.arbitration_id == CAN_ID and time.monotonic() >= start:
+            timestamps.append(msg.timestamp)
+
+    sender.terminate()
+    sender.join()
+    receiver.shutdown()
+
+    intervals = sorted(b - a for (a, b) in zip(timestamps, timestamps[1:]))
+    if len(intervals) == 0:
+        return {"frames": len(timestamps)}
+    deviations = sorted(abs(interval - period) for interval in intervals)
+    mean = sum(intervals) / len(intervals)
+    return {
+        "frames": len(timestamps),
+        "mean_ms": mean * 1000,
+        "std_ms": (sum((interval - mean) ** 2 for interval in intervals) / len(intervals)) ** 0.5 * 1000,
+        "p99_dev_ms": deviations[min(int(len(deviations) * 0.99), len(deviations) - 1)] * 1000,
+        "max_gap_ms": intervals[-1] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channel", default="vcan0")
+    parser.add_argument("--interface", default="socketcan")
+    parser.add_argument("--period", type=float, default=0.02)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--load", type=int, default=0, help="CPUを使い切るプロセスの数")
+    parser.add_argument("--stall-ms", type=float, default=0.0, help="送信側のプロセスを stall-every 秒ごとにこの時間止める")
+    parser.add_argument("--stall-every", type=float, default=1.0)
+    parser.add_argument("--lease", type=float, default=0.5)
+    parser.add_argument("--tick", type=float, default=0.01, help="BCMモードで renew を呼ぶ間隔")
+    args = parser.parse_args()
+
+    load = [multiprocessing.Process(target=busy_loop, daemon=True) for _ in range(args.load)]
+    for process in load:
+        process.start()
+
+    modes = [
+        ("python loop", python_sender, (args.channel, args.interface, args.period, args.stall_ms, args.stall_every)),
+        ("bcm", bcm_sender, (args.channel, args.interface, args.period, args.stall_ms, args.stall_every, 0.0, args.tick)),
+        (f"bcm lease={args.lease:g}s", bcm_sender, (args.channel, args.interface, args.period, args.stall_ms, args.stall_every, args.lease, args.tick)),
+    ]
+    print(f"period={args.period * 1000:g}ms duration={args.duration:g}s load={args.load} stall={args.stall_ms:g}ms/{args.stall_every:g}s interface={args.interface}")
+    print(f"{'mode':<18} {'frames':>7} {'mean ms':>8} {'std ms':>7} {'p99 |dev| ms':>13} {'max gap ms':>11}")
+    for (name, target, target_args) in modes:
+        result = measure(target, target_args, args.channel, args.interface, args.duration, args.period)
+        if "mean_ms" not in result:
+            print(f"{name:<18} {result['frames']:>7}")
+            continue
+        print(f"{name:<18} {result['frames']:>7} {result['mean_ms']:8.3f} {result['std_ms']:7.3f} {result['p99_dev_ms']:13.3f} {result['max_gap_ms']:11.3f}")
+
+    for process in load:
+        process.terminate()
+
+if __name__ == "__main__":
+    main()
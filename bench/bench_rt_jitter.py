@@ -0,0 +1,141 @@
+# 周期送信（ROBOT_VEL 50ms, CHECK_IS_ACTIVED 100ms）の間隔のばらつきを、スケジューリング・GC の設定ごとに比べる（ラズパイ上で実行する）
+#   python bench/bench_rt_jitter.py --duration 10 --load 4 --garbage 2000
+#   sudo python bench/bench_rt_jitter.py --duration 10 --load 4 --garbage 2000   # SCHED_FIFO は root が必要
+#   python bench/bench_rt_jitter.py --interface socketcan --channel vcan0      # 実際にCANにも送る
+# 送信するプロセスは main.py の sendWheelDataRegularly と同じ「次の送信時刻を基準に待つ」ループで、
+# tick ごとに循環参照のゴミ（--garbage 個）を作って GC を起こす. --load 個の CPU を使い切るプロセスと CPU を取り合う
+# 間隔は送信した時刻（time.monotonic）から計算する（--interface を指定してもカーネルの送信時刻ではない）
+import argparse
+import ctypes
+import multiprocessing
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import can
+from can_list import CAN
+from rt_sched import GC_DEFAULT, GC_FREEZE, GC_OFF, RealtimeScheduler, parse_layout
+
+# (CAN ID, 周期)
+FRAMES = ((CAN.ROBOT_VEL.can_id, 0.05), (CAN.CHECK_IS_ACTIVED.can_id, 0.1))
+MAX_SAMPLES = 100000
+
+class Node:
+    def __init__(self):
+        self.other = self
+
+def busy_loop():
+    while True:
+        pass
+
+def sender(
+        layout: str,
+        gc_mode: str,
+        duration: float,
+        garbage: int,
+        interface: Optional[str],
+        channel: str,
+        timestamps,
+        counts
+    ):
+    RealtimeScheduler(parse_layout(layout), gc_mode=gc_mode, write=lambda text: None).apply_process("wheel_control")
+    bus = can.Bus(channel=channel, interface=interface) if interface is not None else None
+    messages = [can.Message(arbitration_id=can_id, data=b"\x00", is_extended_id=False) for (can_id, _) in FRAMES]
+
+    start = time.monotonic()
+    next_times = [start] * len(FRAMES)
+    period = min(period for (_, period) in FRAMES)
+    next_tick = start
+    while time.monotonic() - start < duration:
+        now = time.monotonic()
+        for (i, (_, frame_period)) in enumerate(FRAMES):
+            if now >= next_times[i]:
+                if bus is not None:
+                    bus.send(messages[i])
+                index = i * MAX_SAMPLES + counts[i]
+                if counts[i] < MAX_SAMPLES:
+                    timestamps[index] = time.monotonic()
+                    counts[i] += 1
+                next_times[i] += frame_period
+        # 制御ループで作られるゴミの代わり
+        [Node() for _ in range(garbage)]
+
+        next_tick += period
+        delay = next_tick - time.monotonic()
+        if delay < 0:
+            next_tick = time.monotonic()
+            delay = 0
+        time.sleep(delay)
+    if bus is not None:
+        bus.shutdown()
+
+def intervals_of(timestamps, counts, i: int) -> List[float]:
+    samples = [timestamps[i * MAX_SAMPLES + j] for j in range(counts[i])]
+    # 最初の1秒は捨てる
+    samples = [t for t in samples if t - samples[0] >= 1.0] if len(samples) > 0 else []
+    return [b - a for (a, b) in zip(samples, samples[1:])]
+
+def summarize(intervals: List[float], period: float) -> Dict[str, float]:
+    if len(intervals) == 0:
+        return {"frames": 0}
+    mean = sum(intervals) / len(intervals)
+    deviations = sorted(abs(interval - period) for interval in intervals)
+    return {
+        "frames": len(intervals) + 1,
+        "std_ms": (sum((interval - mean) ** 2 for interval in intervals) / len(intervals)) ** 0.5 * 1000,
+        "p99_dev_ms": deviations[min(int(len(deviations) * 0.99), len(deviations) - 1)] * 1000,
+        "max_gap_ms": max(intervals) * 1000,
+    }
+
+def run(layout: str, gc_mode: str, args) -> List[Dict[str, float]]:
+    timestamps = multiprocessing.RawArray(ctypes.c_double, MAX_SAMPLES * len(FRAMES))
+    counts = multiprocessing.RawArray(ctypes.c_int, len(FRAMES))
+    process = multiprocessing.Process(
+        target=sender,
+        args=(layout, gc_mode, args.duration + 1.0, args.garbage, args.interface, args.channel, timestamps, counts),
+        daemon=True
+    )
+    process.start()
+    process.join()
+    return [summarize(intervals_of(timestamps, counts, i), period) for (i, (_, period)) in enumerate(FRAMES)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--load", type=int, default=0, help="CPUを使い切るプロセスの数")
+    parser.add_argument("--garbage", type=int, default=1000, help="tick ごとに作る循環参照のオブジェクトの数")
+    parser.add_argument("--rt", default="wheel_control=3:fifo=50", help="RT のときの設定（main.py の --rt と同じ形式）")
+    parser.add_argument("--interface", default=None)
+    parser.add_argument("--channel", default="vcan0")
+    args = parser.parse_args()
+
+    load = [multiprocessing.Process(target=busy_loop, daemon=True) for _ in range(args.load)]
+    for process in load:
+        process.start()
+
+    modes: List[Tuple[str, str, str]] = [
+        ("default", "", GC_DEFAULT),
+        ("gc freeze", "", GC_FREEZE),
+        ("gc off", "", GC_OFF),
+        ("rt", args.rt, GC_DEFAULT),
+        ("rt + gc off", args.rt, GC_OFF),
+    ]
+    print(f"duration={args.duration:g}s load={args.load} garbage={args.garbage}/tick rt={args.rt}")
+    print(f"{'mode':<14} {'frame':<8} {'frames':>7} {'std ms':>7} {'p99 |dev| ms':>13} {'max gap ms':>11}")
+    for (name, layout, gc_mode) in modes:
+        results = run(layout, gc_mode, args)
+        for ((can_id, period), result) in zip(FRAMES, results):
+            frame = f"{can_id:03X}/{period * 1000:g}"
+            if result["frames"] == 0:
+                print(f"{name:<14} {frame:<8} {0:>7}")
+                continue
+            print(f"{name:<14} {frame:<8} {result['frames']:>7} {result['std_ms']:7.3f} {result['p99_dev_ms']:13.3f} {result['max_gap_ms']:11.3f}")
+
+    for process in load:
+        process.terminate()
+
+if __name__ == "__main__":
+    main()
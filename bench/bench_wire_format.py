@@ -0,0 +1,80 @@
+# JSONとバイナリ形式のデコード時間を比べる
+#   python bench/bench_wire_format.py [-n 200000]
+# 最初に、数値でない "seq" のパケットが受信ループを止めないことを確かめる（check_sequence_keys）
+import argparse
+import json
+import os
+import socket
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from client_data import ClientController, WheelDataFromClient
+from udp_ingest import LatestDatagramReceiver
+from wire_format import ControllerPacketDecoder, WheelPacketDecoder, TelemetryEncoder, encode_controller_packet, encode_wheel_packet
+
+def bench(label: str, fn, number: int):
+    total = min(timeit.repeat(fn, number=number, repeat=5))
+    print(f"{label:<40} {total / number * 1e9:8.0f} ns/packet")
+
+# main.py と同じ LatestDatagramReceiver + decoder に、"seq" が文字列のパケットのあとに数値のパケットを送る
+def check_sequence_keys():
+    controller = {"btn_a": 0, "btn_b": 0, "btn_x": 0, "btn_y": 0, "btn_rb": 0, "seedling_hand_pos": 0, "area_state": 2}
+    wheel = {"v_x": 127, "v_y": 127, "omega": 127}
+    for (decoder, data) in ((ControllerPacketDecoder(), controller), (WheelPacketDecoder(), wheel)):
+        receiver_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver_sock.bind(("127.0.0.1", 0))
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver = LatestDatagramReceiver(receiver_sock, parse=decoder.parse, build=decoder.build)
+        for seq in ("7", 8, "9", 10):
+            sender.sendto(json.dumps(dict(data, seq=seq)).encode(), receiver_sock.getsockname())
+            if receiver.receive(timeout=1.0) is None:
+                raise AssertionError(f"{type(decoder).__name__}: packet seq={seq!r} was not received")
+        sender.close()
+        receiver_sock.close()
+    print("sequence key check: ok")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=200000)
+    args = parser.parse_args()
+
+    check_sequence_keys()
+
+    controller_json = json.dumps({
+        "btn_a": 1, "btn_b": 0, "btn_x": 1, "btn_y": 0, "btn_rb": 0,
+        "seedling_hand_pos": 0, "area_state": 1
+    }).encode()
+    controller_bin = encode_controller_packet(1, 1, 0, 1, 0, 0, 0, 1)
+    wheel_json = json.dumps({"v_x": 127, "v_y": 200, "omega": 30}).encode()
+    wheel_bin = encode_wheel_packet(1, 127, 200, 30)
+
+    controller_decoder = ControllerPacketDecoder()
+    wheel_decoder = WheelPacketDecoder()
+
+    print(f"controller packet: json {len(controller_json)} bytes, binary {len(controller_bin)} bytes")
+    bench("controller json (before)", lambda: ClientController(json.loads(controller_json)), args.number)
+    bench("controller json (decoder)", lambda: controller_decoder.build(controller_decoder.parse(controller_json)[1]), args.number)
+    bench("controller binary (decoder)", lambda: controller_decoder.build(controller_decoder.parse(controller_bin)[1]), args.number)
+
+    print(f"wheel packet: json {len(wheel_json)} bytes, binary {len(wheel_bin)} bytes")
+    bench("wheel json (before)", lambda: WheelDataFromClient(json.loads(wheel_json)), args.number)
+    bench("wheel json (decoder)", lambda: wheel_decoder.build(wheel_decoder.parse(wheel_json)[1]), args.number)
+    bench("wheel binary (decoder)", lambda: wheel_decoder.build(wheel_decoder.parse(wheel_bin)[1]), args.number)
+
+    # 状態通知はTelemetryUplinkのスレッドで作るので main() のループには入らないが、1回のコストを見ておく
+    encoder = TelemetryEncoder()
+    telemetry = [(0, 0, 0, 120, 0, 0, 0, 0), (0, 0, 1, 120, 0, 0, 0, 0)]
+    full_packet = encoder.encode(telemetry[0], full=True)
+    tick = [0]
+    def encode_changed():
+        tick[0] ^= 1
+        encoder.encode(telemetry[tick[0]])
+    print(f"telemetry packet: full {len(full_packet)} bytes, 1 field {len(encoder.encode(telemetry[1]))} bytes")
+    bench("telemetry full", lambda: encoder.encode(telemetry[0], full=True), args.number)
+    bench("telemetry 1 field changed", encode_changed, args.number)
+    bench("telemetry unchanged", lambda: encoder.encode(telemetry[tick[0]]), args.number)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# main.py をプロセスモードと asyncio モードで起動して、メモリ・CPU・起動時間を比べる（ラズパイ上で実行する）
+#   python bench/measure_footprint.py --duration 30 -- --runtime process
+#   python bench/measure_footprint.py --duration 30 -- --runtime asyncio
+# 子プロセスを含めたプロセスツリー全体の PSS/RSS と、計測期間中の CPU 使用率を表示する
+# 終わるときは Ctrl+C と同じく SIGINT を送り（main.py の stop() が子プロセスを止める）、プロセスツリー全体が終わるまで待つ
+# 終わらなければプロセスグループごと SIGKILL する（続けて別の設定で計測したときに、残ったプロセスが UDP のポートを持ったままにならないように）
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List
+
+MAIN_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "main.py")
+READY_LINE = "Start R1Controller main"
+STOP_TIMEOUT = 10.0
+
+def process_tree(pid: int) -> List[int]:
+    pids = [pid]
+    try:
+        tids = os.listdir(f"/proc/{pid}/task")
+    except FileNotFoundError:
+        return []
+    for tid in tids:
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                for child in f.read().split():
+                    pids.extend(process_tree(int(child)))
+        except FileNotFoundError:
+            pass
+    return pids
+
+def memory_kb(pid: int) -> Dict[str, int]:
+    result = {"Rss": 0, "Pss": 0}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key = line.split(":")[0]
+            if key in result:
+                result[key] = int(line.split()[1])
+    return result
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime, stime
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def is_alive(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # ゾンビは終わったものとする
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+# 出力を読み続ける（パイプが一杯になって main.py が止まらないように）
+def drain(stream, ready: threading.Event):
+    for line in stream:
+        if READY_LINE in line:
+            ready.set()
+    ready.set()
+
+def stop(proc: subprocess.Popen) -> float:
+    pids = process_tree(proc.pid)
+    started = time.monotonic()
+    proc.send_signal(signal.SIGINT)
+    deadline = started + STOP_TIMEOUT
+    while time.monotonic() < deadline and any(is_alive(pid) for pid in pids if pid != proc.pid):
+        time.sleep(0.05)
+    try:
+        proc.wait(timeout=max(deadline - time.monotonic(), 0))
+    except subprocess.TimeoutExpired:
+        pass
+    left = [pid for pid in pids if is_alive(pid)]
+    if len(left) > 0:
+        print(f"killed {len(left)} process(es) left after SIGINT: {left}")
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    return time.monotonic() - started
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("main_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    main_args = [a for a in args.main_args if a != "--"]
+
+    started = time.monotonic()
+    # 新しいプロセスグループで起動する（残ったプロセスをまとめて止められるように）
+    proc = subprocess.Popen([sys.executable, "-u", MAIN_PY] + main_args, stdout=subprocess.PIPE, text=True, start_new_session=True)
+    ready = threading.Event()
+    threading.Thread(target=drain, args=(proc.stdout, ready), daemon=True).start()
+    ready.wait()
+    startup = time.monotonic() - started
+    if proc.poll() is not None:
+        print(f"main.py exited with {proc.returncode} before \"{READY_LINE}\"")
+        sys.exit(1)
+
+    pids = process_tree(proc.pid)
+    cpu_before = sum(cpu_seconds(pid) for pid in pids)
+    time.sleep(args.duration)
+    pids = process_tree(proc.pid)
+    cpu_after = sum(cpu_seconds(pid) for pid in pids)
+    memory = [memory_kb(pid) for pid in pids]
+
+    shutdown = stop(proc)
+
+    print(f"args: {' '.join(main_args)}")
+    print(f"processes: {len(pids)}")
+    print(f"startup: {startup * 1000:.0f} ms")
+    print(f"rss total: {sum(m['Rss'] for m in memory) / 1024:.1f} MiB")
+    print(f"pss total: {sum(m['Pss'] for m in memory) / 1024:.1f} MiB")
+    print(f"cpu: {(cpu_after - cpu_before) / args.duration * 100:.1f} % of one core")
+    print(f"shutdown: {shutdown * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    main()
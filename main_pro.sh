@@ -2,8 +2,8 @@
 
 cd /home/pi/NHK2024/NHK2024_R1_Raspi
 . ./env/bin/activate
-rm -rf logs
-mkdir logs
+# CANのログはサイズでローテーションするので消さなくてよい
+mkdir -p logs
 chmod 777 logs
 nohup python -u src/main.py
 
@@ -0,0 +1,70 @@
+import threading
+from typing import Dict, Iterable, Optional
+
+# アクチュエータ指令のCAN IDごとに「最後に送った値」と「マイコンが応答で確認した値」を持つ
+#   - 最後に送った値と同じものは送らない（force=True なら送る）
+#   - RESPONSE_* が届いたら、その機構のIDの「送った値」を「確認済みの値」にする
+#   - 応答が来なかったとき・CANTransmitter がフレームを捨てたときは invalidate して、次は必ず送る（マイコンの状態がわからないので）
+# 送信は メインスレッド・シーケンスのスレッド・CAN受信スレッド から呼ばれるのでロックを取る
+class ActuatorShadow:
+    def __init__(self, can_ids: Iterable[int]):
+        self.__lock = threading.Lock()
+        self.__commanded: Dict[int, Optional[bytes]] = {can_id: None for can_id in can_ids}
+        self.__acknowledged: Dict[int, Optional[bytes]] = dict(self.__commanded)
+        self.sent = 0
+        self.suppressed = 0
+
+    def tracks(self, can_id: int) -> bool:
+        return can_id in self.__commanded
+
+    # 送るべきなら True を返し、送った値として記録する（記録していないIDは常に True）
+    def should_send(self, can_id: int, data: bytes, force: bool = False) -> bool:
+        with self.__lock:
+            last = self.__commanded.get(can_id, False)
+            if last is False:
+                return True
+            if not force and last == data:
+                self.suppressed += 1
+                return False
+            self.__commanded[can_id] = bytes(data)
+            self.sent += 1
+            return True
+
+    def acknowledge(self, can_ids: Iterable[int]):
+        with self.__lock:
+            for can_id in can_ids:
+                self.__acknowledged[can_id] = self.__commanded[can_id]
+
+    def invalidate(self, can_ids: Optional[Iterable[int]] = None):
+        with self.__lock:
+            for can_id in (can_ids if can_ids is not None else list(self.__commanded)):
+                self.__commanded[can_id] = None
+
+    # 再起動したときに、保存していた値を送った値・確認済みの値にする（checkpoint.py）
+    def restore(self, values: Dict[int, Optional[bytes]]):
+        with self.__lock:
+            for (can_id, data) in values.items():
+                if can_id in self.__commanded:
+                    self.__commanded[can_id] = data
+                    self.__acknowledged[can_id] = data
+
+    def commanded(self, can_id: int) -> Optional[bytes]:
+        return self.__commanded[can_id]
+
+    def acknowledged(self, can_id: int) -> Optional[bytes]:
+        return self.__acknowledged[can_id]
+
+    # 表示用 {"0x104": "01/01", ...}（送った値/確認済みの値, 不明は "-"）
+    def snapshot(self) -> Dict[str, str]:
+        with self.__lock:
+            return {
+                hex(can_id): f"{self.__format(data)}/{self.__format(self.__acknowledged[can_id])}"
+                for (can_id, data) in sorted(self.__commanded.items())
+            }
+
+    def stats(self) -> Dict[str, int]:
+        return {"sent": self.sent, "suppressed": self.suppressed}
+
+    @staticmethod
+    def __format(data: Optional[bytes]) -> str:
+        return "-" if data is None else data.hex()
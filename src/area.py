@@ -1,6 +1,6 @@
 from enum import Enum
-from typing import Callable, Tuple
-from can_list import CANList
+from typing import Callable, Dict, Iterator, Optional, Tuple
+from can_list import CAN
 import time
 
 class Area(Enum):
@@ -63,75 +63,98 @@ class SeedlingHandPosition(Enum):
     PUTOUTSIDE = 1
     PUTINSIDE = 2
     RESET = 3
+
+# SEEDLING_HAND_POSITION で送るデータ
+SEEDLING_HAND_POSITION_DATA = {position: CAN.SEEDLING_HAND_POSITION.encode(position.value) for position in SeedlingHandPosition}
+
+def _no_action():
+    pass
     
 class SeedlingHandState:
     def __init__(self, state = None):
         self.state = state
+        self.__reset_requested = False
+        # ハンドの位置 -> ボタンYの (action_send_0, action_send_1)（最初に set_btn_y_handler を呼んだときに作る）
+        self.__btn_y_handlers: Optional[Dict[Optional[SeedlingHandPosition], Tuple[Callable[[], None], Callable[[], None]]]] = None
     
-    def update_state(self, new_state: int, write_can_bus: Callable[[int, bytearray], None]):
+    # start_sequence を渡すと、RESET の待ち時間をシーケンス（SequenceRunner.start）で行う
+    # 渡さなければこれまで通りこの中で待つ
+    def update_state(
+            self,
+            new_state: int,
+            write_can_bus: Callable[[int, bytearray], None],
+            start_sequence: Optional[Callable[[str, Callable[[], Iterator[float]]], None]] = None
+        ):
         try:
             new_pos = SeedlingHandPosition(new_state)
         except ValueError as e:
             print(f"Error at SeedlingHandState.update_state {e}")
             return
 
-        print(f"self.state = {self.state} and new_pos = {new_pos}")
+        if new_pos != SeedlingHandPosition.RESET:
+            self.__reset_requested = False
 
         if self.state == new_pos:
             return
 
         if new_pos == SeedlingHandPosition.RESET:
-            write_can_bus(CANList.SEEDLING_HAND_POSITION.value, bytearray([SeedlingHandPosition.RESET.value]))
-            time.sleep(3)
-            write_can_bus(CANList.SEEDLING_HAND_POSITION.value, bytearray(self.state.value))
+            # RESET が続けて届いても、リセットは1回だけ
+            if self.__reset_requested:
+                return
+            self.__reset_requested = True
+            previous = self.state
+            sequence = lambda: self.reset_sequence(previous, write_can_bus)
+            if start_sequence is not None:
+                start_sequence("reset_seedling_hand", sequence)
+            else:
+                for delay in sequence():
+                    time.sleep(delay)
             return
 
-        if new_pos == SeedlingHandPosition.PICKUP:
-            write_can_bus(CANList.SEEDLING_HAND_POSITION.value, bytearray([SeedlingHandPosition.PICKUP.value]))
-        elif new_pos == SeedlingHandPosition.PUTINSIDE:
-            write_can_bus(CANList.SEEDLING_HAND_POSITION.value, bytearray([SeedlingHandPosition.PUTINSIDE.value]))
-        elif new_pos == SeedlingHandPosition.PUTOUTSIDE:
-            write_can_bus(CANList.SEEDLING_HAND_POSITION.value, bytearray([SeedlingHandPosition.PUTOUTSIDE.value]))
+        # PICKUP, PUTINSIDE, PUTOUTSIDE
+        write_can_bus(CAN.SEEDLING_HAND_POSITION.can_id, SEEDLING_HAND_POSITION_DATA[new_pos])
             
         self.state = new_pos
         
+    # RESET を送って、3秒後に元の位置に戻す（元の位置がわからなければ戻さない）
+    def reset_sequence(self, previous: Optional[SeedlingHandPosition], write_can_bus: Callable[[int, bytearray], None]) -> Iterator[float]:
+        write_can_bus(CAN.SEEDLING_HAND_POSITION.can_id, SEEDLING_HAND_POSITION_DATA[SeedlingHandPosition.RESET])
+        yield 3
+        if previous is not None and previous != SeedlingHandPosition.RESET:
+            write_can_bus(CAN.SEEDLING_HAND_POSITION.can_id, SEEDLING_HAND_POSITION_DATA[previous])
+    
+    # 返す関数はハンドの位置ごとに1回だけ作る（パケットごとに関数を作らない）
     def set_btn_y_handler(self, write_can_bus: Callable[[int, bytearray], None]) -> Tuple[Callable[[], None], Callable[[], None]]:
-        if self.state == SeedlingHandPosition.RESET:
-            def action_send_0():
-                pass
-            def action_send_1():
-                pass
-        
-        if self.state == SeedlingHandPosition.PICKUP:
-            def action_send_0():
-                write_can_bus(CANList.SEEDLING_INSIDE_HAND_OPEN.value, bytearray([0]))
-                time.sleep(0.01)
-                write_can_bus(CANList.SEEDLING_OUTSIDE_HAND_OPEN.value, bytearray([0]))
-            
-            def action_send_1():
-                write_can_bus(CANList.SEEDLING_INSIDE_HAND_OPEN.value, bytearray([1]))
-                time.sleep(0.01)
-                write_can_bus(CANList.SEEDLING_OUTSIDE_HAND_OPEN.value, bytearray([1]))
-            
-            return (action_send_0, action_send_1)
+        if self.__btn_y_handlers is None:
+            self.__btn_y_handlers = self.__build_btn_y_handlers(write_can_bus)
+        return self.__btn_y_handlers[self.state]
+    
+    def __build_btn_y_handlers(self, write_can_bus: Callable[[int, bytearray], None]) -> Dict[Optional[SeedlingHandPosition], Tuple[Callable[[], None], Callable[[], None]]]:
+        inside = CAN.SEEDLING_INSIDE_HAND_OPEN.can_id
+        outside = CAN.SEEDLING_OUTSIDE_HAND_OPEN.can_id
+        (data_close, data_open) = (CAN.SEEDLING_INSIDE_HAND_OPEN.encode(0), CAN.SEEDLING_INSIDE_HAND_OPEN.encode(1))
         
-        if self.state == SeedlingHandPosition.PUTINSIDE:
-            def action_send_0():
-                write_can_bus(CANList.SEEDLING_INSIDE_HAND_OPEN.value, bytearray([0]))
-            
-            def action_send_1():
-                write_can_bus(CANList.SEEDLING_INSIDE_HAND_OPEN.value, bytearray([1]))
-                
-            return (action_send_0, action_send_1)
+        def send_both(data: bytes):
+            write_can_bus(inside, data)
+            write_can_bus(outside, data)
         
-        if self.state == SeedlingHandPosition.PUTOUTSIDE:
-            def action_send_0():
-                write_can_bus(CANList.SEEDLING_OUTSIDE_HAND_OPEN.value, bytearray([0]))
-            
-            def action_send_1():
-                write_can_bus(CANList.SEEDLING_OUTSIDE_HAND_OPEN.value, bytearray([1]))
-            
-            return (action_send_0, action_send_1)
+        return {
+            # 位置が決まっていないとき・RESET中は何もしない
+            None: (_no_action, _no_action),
+            SeedlingHandPosition.RESET: (_no_action, _no_action),
+            SeedlingHandPosition.PICKUP: (
+                lambda: send_both(data_close),
+                lambda: send_both(data_open),
+            ),
+            SeedlingHandPosition.PUTINSIDE: (
+                lambda: write_can_bus(inside, data_close),
+                lambda: write_can_bus(inside, data_open),
+            ),
+            SeedlingHandPosition.PUTOUTSIDE: (
+                lambda: write_can_bus(outside, data_close),
+                lambda: write_can_bus(outside, data_open),
+            ),
+        }
 
     def reset_state(self, new_state: int):
         self.state = SeedlingHandPosition(new_state)
\ No newline at end of file
@@ -0,0 +1,60 @@
+import asyncio
+from typing import Callable
+import can
+
+# R1MainController(runtime="asyncio") のときの実行環境
+# UDPの2つのソケット・定期送信・CANの受信を、子プロセスを作らずに1つのイベントループで動かす
+class AsyncR1Runtime:
+    def __init__(self, controller, is_active_period: float = 0.1):
+        self.controller = controller
+        self.wheel_clock = controller.wheel_clock
+        self.is_active_period = is_active_period
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        controller = self.controller
+
+        # socketcan は fileno があるので、受信もイベントループの add_reader で処理される
+        notifier = can.Notifier(controller.bus, [controller.can_lister], loop=loop)
+        # 応答はこのループで受信するので、待つのは別スレッドで
+        await loop.run_in_executor(None, controller.resume_from_checkpoint)
+        loop.add_reader(controller.sock, controller.receive_controller_packet, 0)
+        loop.add_reader(controller.sock_for_wheel_controle, controller.receive_wheel_packet, 0)
+        controller.log_system.write("Start AsyncR1Runtime")
+        print("Start AsyncR1Runtime")
+
+        try:
+            periodic = [self.__run_wheel_control()]
+            # periodic="bcm" のときはカーネルが生存確認を送る
+            if controller.periodic != "bcm":
+                periodic.append(self.__run_periodic(controller.send_is_active_message, self.is_active_period))
+            await asyncio.gather(*periodic)
+        finally:
+            loop.remove_reader(controller.sock)
+            loop.remove_reader(controller.sock_for_wheel_controle)
+            notifier.stop()
+
+    # sendWheelDataRegularly と同じ（FixedRateClock で周期を決め、間に合わなかった周期を数える）
+    async def __run_wheel_control(self):
+        loop = asyncio.get_running_loop()
+        clock = self.wheel_clock
+        while True:
+            now = loop.time()
+            clock.begin(now)
+            self.controller.send_wheel_data(now)
+            await asyncio.sleep(clock.end(loop.time()))
+
+    # 処理時間の分だけ周期がずれていかないように、次の送信時刻を基準に待つ
+    async def __run_periodic(self, send: Callable[[], None], period: float):
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+
+        while True:
+            send()
+            next_time += period
+            delay = next_time - loop.time()
+            if delay < 0:
+                # 間に合わなかった分はまとめて送らずに飛ばす
+                next_time = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
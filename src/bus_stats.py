@@ -0,0 +1,191 @@
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import can
+import numpy as np
+
+# CANバスの使用率・IDごとのフレーム数・エラーフレームを bucket 秒ごとに集計し、history 個分を NumPy のリングバッファに残す
+# 受信・送信スレッドからの record() は今の bucket の Python の変数に足すだけで、NumPy の配列に書くのは集計スレッドだけ
+
+# CAN FD のデータ長
+FD_LENGTHS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64)
+
+# SocketCAN のエラーフレームの種類（arbitration_id のビット, linux/can/error.h）
+CAN_ERR_CRTL = 0x00000004
+CAN_ERR_BUSOFF = 0x00000040
+CAN_ERR_RESTARTED = 0x00000100
+# data[1]（CAN_ERR_CRTL のとき）
+CAN_ERR_CRTL_RX_PASSIVE = 0x10
+CAN_ERR_CRTL_TX_PASSIVE = 0x20
+
+# エラーの列
+ERROR_FRAMES = 0
+BUS_OFF = 1
+ERROR_PASSIVE = 2
+RESTARTED = 3
+ERROR_COLUMNS = ("error_frames", "bus_off", "error_passive", "restarted")
+
+# 1フレームがバスを占有する時間（秒）. スタッフビットは最大の数で見積もる
+def frame_time(data_length: int, bitrate: float, data_bitrate: float, is_fd: bool = False, bitrate_switch: bool = False, is_extended_id: bool = False) -> float:
+    if not is_fd:
+        # SOF〜CRC の stuffing 対象部分 + CRC delimiter, ACK, EOF, IFS
+        stuffed = (54 if is_extended_id else 34) + 8 * data_length
+        return (stuffed + (stuffed - 1) // 4 + 13) / bitrate
+
+    length = next(n for n in FD_LENGTHS if n >= data_length) if data_length <= 64 else 64
+    # 調停フェーズ: SOF, ID, RRS/SRR, IDE, FDF, res, BRS（とその stuffing） + CRC delimiter, ACK, EOF, IFS
+    arbitration = (37 if is_extended_id else 17)
+    arbitration_bits = arbitration + (arbitration - 1) // 4 + 13
+    # データフェーズ: ESI, DLC, データ, stuff count, CRC（固定 stuffing 込み）
+    crc = 17 if length <= 16 else 21
+    data_bits = 1 + 4 + 8 * length
+    data_bits += (data_bits - 1) // 4 + 4 + crc + (crc + 4 + 3) // 4
+    return arbitration_bits / bitrate + data_bits / (data_bitrate if bitrate_switch else bitrate)
+
+class BusLoadMonitor:
+    def __init__(
+            self,
+            can_ids: Iterable[int],
+            bitrate: float = 1_000_000,
+            data_bitrate: float = 2_000_000,
+            bucket: float = 1.0,
+            history: int = 600,
+            saturation: float = 0.7
+        ):
+        self.bitrate = bitrate
+        self.data_bitrate = data_bitrate
+        self.bucket = bucket
+        self.history = history
+        # 1 bucket の使用率がこれを超えたら警告する
+        self.saturation = saturation
+
+        # CAN ID -> 列（知らないIDは最後の列にまとめる）
+        self.can_ids: List[int] = sorted(set(can_ids))
+        self.__column: Dict[int, int] = {can_id: i for (i, can_id) in enumerate(self.can_ids)}
+        self.__other = len(self.can_ids)
+
+        # リングバッファ（行 = bucket）
+        self.counts = np.zeros((history, len(self.can_ids) + 1), dtype=np.uint32)
+        self.busy = np.zeros(history, dtype=np.float64)
+        self.errors = np.zeros((history, len(ERROR_COLUMNS)), dtype=np.uint32)
+        # 書いた bucket の数
+        self.filled = 0
+        self.total_errors = np.zeros(len(ERROR_COLUMNS), dtype=np.uint64)
+
+        # 今の bucket
+        self.__lock = threading.Lock()
+        self.__counts = [0] * (len(self.can_ids) + 1)
+        self.__busy = 0.0
+        self.__errors = [0] * len(ERROR_COLUMNS)
+        # (data_length, is_fd, brs, extended) -> 占有時間
+        self.__frame_time: Dict[Tuple[int, bool, bool, bool], float] = {}
+
+        self.__stop_event = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+
+    def record(self, msg: can.Message, is_tx: bool = False):
+        if msg.is_error_frame:
+            self.__record_error(msg)
+            return
+
+        key = (len(msg.data), msg.is_fd, msg.bitrate_switch, msg.is_extended_id)
+        duration = self.__frame_time.get(key)
+        if duration is None:
+            duration = self.__frame_time[key] = frame_time(
+                key[0], self.bitrate, self.data_bitrate, is_fd=key[1], bitrate_switch=key[2], is_extended_id=key[3]
+            )
+        column = self.__column.get(msg.arbitration_id, self.__other)
+        with self.__lock:
+            self.__counts[column] += 1
+            self.__busy += duration
+
+    def __record_error(self, msg: can.Message):
+        error_class = msg.arbitration_id
+        with self.__lock:
+            self.__errors[ERROR_FRAMES] += 1
+            if error_class & CAN_ERR_BUSOFF:
+                self.__errors[BUS_OFF] += 1
+            if error_class & CAN_ERR_RESTARTED:
+                self.__errors[RESTARTED] += 1
+            if error_class & CAN_ERR_CRTL and len(msg.data) > 1 and msg.data[1] & (CAN_ERR_CRTL_RX_PASSIVE | CAN_ERR_CRTL_TX_PASSIVE):
+                self.__errors[ERROR_PASSIVE] += 1
+
+    # 今の bucket をリングバッファに移す（集計スレッドから bucket 秒ごとに呼ぶ）
+    def roll(self):
+        with self.__lock:
+            (counts, busy, errors) = (self.__counts, self.__busy, self.__errors)
+            self.__counts = [0] * len(counts)
+            self.__busy = 0.0
+            self.__errors = [0] * len(errors)
+
+        row = self.filled % self.history
+        self.counts[row] = counts
+        self.busy[row] = busy
+        self.errors[row] = errors
+        self.total_errors += self.errors[row]
+        self.filled += 1
+
+    # 最後に集計した bucket の使用率
+    def last_load(self) -> float:
+        if self.filled == 0:
+            return 0.0
+        return float(self.busy[(self.filled - 1) % self.history] / self.bucket)
+
+    # 直近 seconds 秒の集計
+    def summary(self, seconds: float) -> Dict[str, object]:
+        n = min(max(int(round(seconds / self.bucket)), 1), self.history, self.filled)
+        if n == 0:
+            return {"seconds": 0.0, "load": 0.0, "peak_load": 0.0, "rates": {}, **{name: 0 for name in ERROR_COLUMNS}}
+        rows = np.arange(self.filled - n, self.filled) % self.history
+        duration = n * self.bucket
+        busy = self.busy[rows]
+        counts = self.counts[rows].sum(axis=0)
+        errors = self.errors[rows].sum(axis=0)
+
+        rates = {hex(can_id): float(counts[i] / duration) for (i, can_id) in enumerate(self.can_ids) if counts[i] > 0}
+        if counts[self.__other] > 0:
+            rates["other"] = float(counts[self.__other] / duration)
+        return {
+            "seconds": duration,
+            "load": float(busy.sum() / duration),
+            "peak_load": float(busy.max() / self.bucket),
+            "rates": rates,
+            **{name: int(errors[i]) for (i, name) in enumerate(ERROR_COLUMNS)},
+        }
+
+    def report(self, windows: Tuple[float, ...] = (1, 10, 60)) -> str:
+        lines = [f"CAN bus ({self.bitrate / 1e6:g}M/{self.data_bitrate / 1e6:g}M)"]
+        for seconds in windows:
+            summary = self.summary(seconds)
+            rates = " ".join(f"{can_id}:{rate:.0f}/s" for (can_id, rate) in sorted(summary["rates"].items(), key=lambda item: -item[1]))
+            lines.append(
+                f"  {summary['seconds']:>4g}s load={summary['load'] * 100:5.1f}% peak={summary['peak_load'] * 100:5.1f}%"
+                f" errors={summary['error_frames']} bus_off={summary['bus_off']} passive={summary['error_passive']} {rates}"
+            )
+        totals = " ".join(f"{name}={int(self.total_errors[i])}" for (i, name) in enumerate(ERROR_COLUMNS))
+        lines.append(f"  total {totals}")
+        return "\n".join(lines)
+
+    # bucket 秒ごとに roll し、report_interval 秒ごとに report を write に渡す
+    # 1 bucket の使用率が saturation を超えたら、そのたびに warn に渡す
+    def start(self, write: Callable[[str], None] = print, warn: Optional[Callable[[str], None]] = None, report_interval: float = 10.0):
+        def run():
+            next_roll = time.monotonic() + self.bucket
+            next_report = time.monotonic() + report_interval
+            while not self.__stop_event.wait(max(next_roll - time.monotonic(), 0)):
+                next_roll += self.bucket
+                self.roll()
+                load = self.busy[(self.filled - 1) % self.history] / self.bucket
+                if warn is not None and load > self.saturation:
+                    warn(f"CAN bus load {load * 100:.1f}% (> {self.saturation * 100:.0f}%)")
+                if report_interval > 0 and time.monotonic() >= next_report:
+                    next_report += report_interval
+                    write(self.report())
+
+        self.__thread = threading.Thread(target=run, name="BusLoadMonitor", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout=1)
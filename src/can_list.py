@@ -1,31 +1,141 @@
+import struct
 from enum import Enum
+from typing import Dict, Iterable, List, Optional, Tuple
 
-class CANList(Enum):
+# CANメッセージの定義（ここだけに書く）
+#   fmt: データの struct のフォーマット（リトルエンディアン, "" はデータなし）
+#   values: 1つの値だけを送るメッセージで、取りうる値. データを起動時に作っておく（送るときに pack しない）
+# 同じIDを別の名前で使うときは alias() で書く（書かずに同じIDを使うと import 時にエラー）
+
+# 向き
+TX = "tx" # ラズパイ => マイコン
+RX = "rx" # マイコン => ラズパイ
+
+ON_OFF = (0, 1)
+
+class CANMessage:
+    def __init__(self, can_id: int, fmt: str = "", direction: str = TX, values: Optional[Iterable[int]] = None):
+        self.name = ""
+        self.can_id = can_id
+        self.direction = direction
+        self.struct = struct.Struct("<" + fmt)
+        self.size = self.struct.size
+        self.payloads: Dict[int, bytes] = {value: self.struct.pack(value) for value in values} if values is not None else {}
+        self.empty_payload = self.struct.pack() if fmt == "" else None
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"CANMessage({self.name}, {hex(self.can_id)})"
+
+    def encode(self, *values: int) -> bytes:
+        if len(values) == 1:
+            payload = self.payloads.get(values[0])
+            if payload is not None:
+                return payload
+        elif len(values) == 0 and self.empty_payload is not None:
+            return self.empty_payload
+        return self.struct.pack(*values)
+
+    def decode(self, data: bytes) -> Tuple[int, ...]:
+        return self.struct.unpack_from(data)
+
+    # 起動時に作っておくデータ（FrameTable に入れる）
+    def fixed_payloads(self) -> List[bytes]:
+        if self.empty_payload is not None:
+            return [self.empty_payload]
+        return list(self.payloads.values())
+
+class alias:
+    def __init__(self, message: CANMessage):
+        self.message = message
+
+class CAN:
     # Seedling
-    SEEDLING_ARM_RESET = 0x150
-    SEEDLING_ARM_OPEN = 0x151
-    SEEDLING_ARM_SEEDLING_GET = 0x152
-    SEEDLING_ARM_DOWM = 0x153
-    SEEDLING_HAND_POSITION = 0x108
-    SEEDLING_ARM_ELEVATOR = 0x104
-    SEEDLING_INSIDE_HAND_OPEN = 0x105
-    SEEDLING_OUTSIDE_HAND_OPEN = 0x106
-    
+    SEEDLING_ARM_RESET = CANMessage(0x150, "B")
+    SEEDLING_ARM_OPEN = CANMessage(0x151, "B")
+    SEEDLING_ARM_SEEDLING_GET = CANMessage(0x152, "B")
+    SEEDLING_ARM_DOWM = CANMessage(0x153, "B")
+    SEEDLING_ARM_SET = CANMessage(0x109, "B", values=ON_OFF)
+    # SeedlingHandPosition (PICKUP, PUTOUTSIDE, PUTINSIDE, RESET)
+    SEEDLING_HAND_POSITION = CANMessage(0x108, "B", values=(0, 1, 2, 3))
+    SEEDLING_ARM_ELEVATOR = CANMessage(0x104, "B", values=ON_OFF)
+    SEEDLING_INSIDE_HAND_OPEN = CANMessage(0x105, "B", values=ON_OFF)
+    SEEDLING_OUTSIDE_HAND_OPEN = CANMessage(0x106, "B", values=ON_OFF)
+
     # Ball
-    
-    ARM_EXPANDER = 0x103
-    HAND1 = 0x105
-    HAND2 = 0X106
-    ARM_STATE = 0x107
-    ARM1 = 0x108
-    SHOOT = 0x101
-    BALL_HAND = 0x102
-    ROBOT_VEL = 0x10B
-    
+    BALL_ARM_UNEXPAND = CANMessage(0x103, "B", values=ON_OFF) # アーム収納（地面につける）
+    BALL_BALL_HAND_OPEN = CANMessage(0x102, "B", values=ON_OFF) # ボール回収用のアームを開く
+    BALL_SHOOT = CANMessage(0x101, "B", values=ON_OFF)
+    BALL_MOTOR_ON = CANMessage(0x10A, "B", values=ON_OFF)
+    ARM_STATE = CANMessage(0x107, "B", direction=RX) # 1: アームが上がった
+    ROBOT_VEL = CANMessage(0x10B, "BBB") # v_x, v_y, omega (127 が停止)
+
+    # 古い名前
+    ARM_EXPANDER = alias(BALL_ARM_UNEXPAND)
+    HAND1 = alias(SEEDLING_INSIDE_HAND_OPEN)
+    HAND2 = alias(SEEDLING_OUTSIDE_HAND_OPEN)
+    ARM1 = alias(SEEDLING_HAND_POSITION)
+    SHOOT = alias(BALL_SHOOT)
+    BALL_HAND = alias(BALL_BALL_HAND_OPEN)
+
     # ラズパイ => マイコン
-    CHECK_INJECTION_MECHANISM = 0x300
-    CHECK_SEEDLING_MECHANISM = 0x301
-    
+    CHECK_INJECTION_MECHANISM = CANMessage(0x300)
+    CHECK_SEEDLING_MECHANISM = CANMessage(0x301)
+    CHECK_IS_ACTIVED = CANMessage(0x500)
+
     # マイコン => ラズパイ
-    RESPONSE_INJECTION_MECHANISM = 0x400
-    RESPONSE_SEEDLING_MECHANISM = 0x401
\ No newline at end of file
+    RESPONSE_INJECTION_MECHANISM = CANMessage(0x400, direction=RX)
+    RESPONSE_SEEDLING_MECHANISM = CANMessage(0x401, direction=RX)
+
+def _compile():
+    messages: List[CANMessage] = []
+    aliases: List[Tuple[str, CANMessage]] = []
+    by_id: Dict[int, CANMessage] = {}
+    for (name, value) in vars(CAN).items():
+        if isinstance(value, CANMessage):
+            if not 0 <= value.can_id <= 0x7FF:
+                raise ValueError(f"CAN ID of {name} is not a standard ID: {hex(value.can_id)}")
+            if value.size > 8:
+                raise ValueError(f"Payload of {name} is longer than 8 bytes: {value.size}")
+            if value.can_id in by_id:
+                raise ValueError(f"CAN ID collision: {name} and {by_id[value.can_id].name} use {hex(value.can_id)} (declare one as alias)")
+            by_id[value.can_id] = value
+            messages.append(value)
+        elif isinstance(value, alias):
+            aliases.append((name, value.message))
+            setattr(CAN, name, value.message)
+    return (tuple(messages), by_id, aliases)
+
+(CAN_MESSAGES, CAN_MESSAGE_BY_ID, _ALIASES) = _compile()
+
+# これまでの CANList（CANList.X.value で ID を取る）. 別名は同じ値の Enum の alias になる
+CANList = Enum(
+    "CANList",
+    [(message.name, message.can_id) for message in CAN_MESSAGES] + [(name, message.can_id) for (name, message) in _ALIASES]
+)
+
+# 機構ごとの完了確認
+#   check を送ると、マイコンは actuators に送られた指令の動作が終わってから response を返す
+class Mechanism:
+    def __init__(self, name: str, check: CANMessage, response: CANMessage, actuators: Tuple[CANMessage, ...]):
+        self.name = name
+        self.check = check
+        self.response = response
+        self.actuators = actuators
+        self.actuator_ids = tuple(message.can_id for message in actuators)
+
+INJECTION_MECHANISM = Mechanism(
+    "injection",
+    CAN.CHECK_INJECTION_MECHANISM,
+    CAN.RESPONSE_INJECTION_MECHANISM,
+    (CAN.BALL_SHOOT, CAN.BALL_MOTOR_ON, CAN.BALL_ARM_UNEXPAND, CAN.BALL_BALL_HAND_OPEN)
+)
+SEEDLING_MECHANISM = Mechanism(
+    "seedling",
+    CAN.CHECK_SEEDLING_MECHANISM,
+    CAN.RESPONSE_SEEDLING_MECHANISM,
+    (CAN.SEEDLING_HAND_POSITION, CAN.SEEDLING_ARM_SET, CAN.SEEDLING_ARM_ELEVATOR, CAN.SEEDLING_INSIDE_HAND_OPEN, CAN.SEEDLING_OUTSIDE_HAND_OPEN)
+)
+MECHANISMS = (INJECTION_MECHANISM, SEEDLING_MECHANISM)
@@ -0,0 +1,163 @@
+import os
+import struct
+import sys
+import threading
+import time
+from typing import Iterator, Optional, Tuple
+import can
+
+# 送受信したCANフレームをバイナリで記録する
+# 受信スレッドではメモリ上のリングバッファに書くだけで、ファイルへの書き込みは別スレッドでまとめて行う
+#
+# ファイル形式: FILE_HEADER の後に RECORD が並ぶ
+#   timestamp(f64, 秒) arbitration_id(u32) flags(u8) dlc(u8) padding(2) data(64)
+FILE_HEADER = b"R1CANTR\x01"
+RECORD = struct.Struct("<dIBB2x64s")
+
+FLAG_TX = 1 << 0
+FLAG_ERROR = 1 << 1
+FLAG_FD = 1 << 2
+FLAG_BRS = 1 << 3
+FLAG_EXTENDED = 1 << 4
+FLAG_REMOTE = 1 << 5
+
+class CANTraceRecorder:
+    def __init__(
+            self,
+            path: str,
+            capacity: int = 4096,
+            flush_interval: float = 0.5,
+            max_bytes: int = 8 * 1024 * 1024,
+            backup_count: int = 4
+        ):
+        self.path = path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        # ファイルが max_bytes を超えたら path.1, path.2, ... にずらす（ディスク使用量は最大 max_bytes * (backup_count + 1)）
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self.__buffer = bytearray(capacity * RECORD.size)
+        self.__lock = threading.Lock()
+        self.__written = 0
+        self.__flushed = 0
+        self.overflow = 0
+
+        self.__file = None
+        self.__stop_event = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+
+    def start(self):
+        directory = os.path.dirname(self.path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        self.__open()
+        self.__thread = threading.Thread(target=self.__run, name="CANTraceRecorder", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout=1)
+        self.__flush()
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def record(self, msg: can.Message, is_tx: bool = False):
+        flags = (FLAG_TX if is_tx else 0) \
+            | (FLAG_ERROR if msg.is_error_frame else 0) \
+            | (FLAG_FD if msg.is_fd else 0) \
+            | (FLAG_BRS if msg.bitrate_switch else 0) \
+            | (FLAG_EXTENDED if msg.is_extended_id else 0) \
+            | (FLAG_REMOTE if msg.is_remote_frame else 0)
+        timestamp = msg.timestamp if msg.timestamp else time.time()
+
+        with self.__lock:
+            # 書き出しが追いついていないときは新しい方を捨てる
+            if self.__written - self.__flushed >= self.capacity:
+                self.overflow += 1
+                return
+            offset = (self.__written % self.capacity) * RECORD.size
+            RECORD.pack_into(self.__buffer, offset, timestamp, msg.arbitration_id, flags, len(msg.data), bytes(msg.data))
+            self.__written += 1
+
+    def __run(self):
+        while not self.__stop_event.wait(self.flush_interval):
+            try:
+                self.__flush()
+            except OSError as e:
+                print(f"Error at CANTraceRecorder: {e}")
+
+    def __flush(self):
+        with self.__lock:
+            start = self.__flushed
+            end = self.__written
+        if start == end or self.__file is None:
+            return
+
+        # [flushed, written) はプロデューサが上書きしないので、ロックの外で書き出してよい
+        view = memoryview(self.__buffer)
+        first = start % self.capacity
+        count = end - start
+        if first + count <= self.capacity:
+            self.__file.write(view[first * RECORD.size:(first + count) * RECORD.size])
+        else:
+            self.__file.write(view[first * RECORD.size:])
+            self.__file.write(view[:(first + count - self.capacity) * RECORD.size])
+        self.__file.flush()
+
+        with self.__lock:
+            self.__flushed = end
+
+        if self.__file.tell() >= self.max_bytes:
+            self.__rotate()
+
+    def __open(self):
+        self.__file = open(self.path, "ab")
+        if self.__file.tell() == 0:
+            self.__file.write(FILE_HEADER)
+
+    def __rotate(self):
+        self.__file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.__open()
+
+def read_trace(path: str) -> Iterator[Tuple[float, int, int, bytes]]:
+    with open(path, "rb") as f:
+        if f.read(len(FILE_HEADER)) != FILE_HEADER:
+            raise ValueError(f"{path} is not a CAN trace file")
+        while True:
+            chunk = f.read(RECORD.size)
+            if len(chunk) < RECORD.size:
+                return
+            (timestamp, can_id, flags, dlc, data) = RECORD.unpack(chunk)
+            yield (timestamp, can_id, flags, data[:dlc])
+
+# candump -L 形式で表示する
+#   python src/can_trace.py logs/can_trace.bin [channel]
+def to_candump_line(timestamp: float, can_id: int, flags: int, data: bytes, channel: str = "can0") -> str:
+    if flags & FLAG_ERROR:
+        # CAN_ERR_FLAG
+        id_text = f"{can_id | 0x20000000:08X}"
+    elif flags & FLAG_EXTENDED:
+        id_text = f"{can_id:08X}"
+    else:
+        id_text = f"{can_id:03X}"
+    if flags & FLAG_FD:
+        return f"({timestamp:.6f}) {channel} {id_text}##{1 if flags & FLAG_BRS else 0}{data.hex().upper()}"
+    if flags & FLAG_REMOTE:
+        return f"({timestamp:.6f}) {channel} {id_text}#R"
+    return f"({timestamp:.6f}) {channel} {id_text}#{data.hex().upper()}"
+
+if __name__ == "__main__":
+    channel = sys.argv[2] if len(sys.argv) > 2 else "can0"
+    for (timestamp, can_id, flags, data) in read_trace(sys.argv[1]):
+        direction = "T" if flags & FLAG_TX else "R"
+        print(f"{to_candump_line(timestamp, can_id, flags, data, channel)} {direction}")
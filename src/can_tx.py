@@ -0,0 +1,171 @@
+import ctypes
+import errno
+import heapq
+import multiprocessing
+import queue
+import threading
+import time
+from enum import IntEnum
+from typing import Callable, Dict, List, Optional, Tuple
+import can
+from frame_table import FrameTable
+
+# 値が小さいほど先に送る
+class TxPriority(IntEnum):
+    VELOCITY = 0
+    ACTUATOR = 1
+    HEARTBEAT = 2
+
+# 送信バッファが一杯（ENOBUFS か、socketcan の send が timeout までに書けなかった）
+def is_buffer_full(e: can.CanOperationError) -> bool:
+    return getattr(e, "error_code", None) == errno.ENOBUFS or "Transmit buffer full" in str(e)
+
+# CAN送信はすべてこのキューを通して1本のスレッドから送る
+# 送信キューは multiprocessing.Queue なので、fork した子プロセスからも send() できる
+# 送れずに捨てたフレームは on_dropped に CAN ID を渡す（キューが一杯・送り直しても送れない・溜まりすぎ）
+class CANTransmitter:
+    # counters
+    SENT = 0
+    DROPPED = 1
+    RETRIED = 2
+
+    def __init__(
+            self,
+            bus: can.BusABC,
+            priority_of: Dict[int, TxPriority],
+            default_priority: TxPriority = TxPriority.ACTUATOR,
+            maxsize: int = 256,
+            min_interval: float = 0.0002,
+            max_retries: int = 5,
+            retry_backoff: float = 0.001,
+            send_timeout: float = 0.002,
+            on_sent: Optional[Callable[[can.Message], None]] = None,
+            on_dropped: Optional[Callable[[int], None]] = None,
+            update_error_log: Optional[Callable[[str], None]] = None,
+            frame_table: Optional[FrameTable] = None
+        ):
+        self.bus = bus
+        # 表にあるフレームは作っておいた can.Message をそのまま送る
+        self.frame_table = frame_table if frame_table is not None else FrameTable()
+        self.priority_of = priority_of
+        self.default_priority = default_priority
+        self.maxsize = maxsize
+        # txqueuelen(1000)を溢れさせない送信間隔. 1Mbpsで短いフレーム1つが約0.1ms
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        # ソケットに書けるようになるまで bus.send が待つ秒数（socketcan は待たないとすぐに "Transmit buffer full" になる）
+        self.send_timeout = send_timeout
+        self.on_sent = on_sent
+        self.on_dropped = on_dropped
+        self.update_error_log = update_error_log
+
+        # LatencyProbe を入れると "can_send" とIDごとの受信->送信の時間を記録する
+        self.probe = None
+
+        self.__queue = multiprocessing.Queue(maxsize)
+        self.__counters = multiprocessing.Array(ctypes.c_uint64, 3)
+        self.__thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__run, name="CANTransmitter", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__queue.put(None)
+        if self.__thread is not None:
+            self.__thread.join(timeout=1)
+
+    # origin_ns: このフレームのもとになったUDPパケットの到着時刻（time.monotonic_ns, 測らないときは0）
+    def send(self, can_id: int, data: bytearray, priority: Optional[TxPriority] = None, origin_ns: int = 0) -> bool:
+        if priority is None:
+            priority = self.priority_of.get(can_id, self.default_priority)
+        enqueued_ns = time.monotonic_ns() if self.probe is not None else 0
+        try:
+            self.__queue.put_nowait((int(priority), can_id, bytes(data), origin_ns, enqueued_ns))
+        except queue.Full:
+            self.__drop(can_id)
+            return False
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        with self.__counters.get_lock():
+            return {
+                "sent": self.__counters[self.SENT],
+                "dropped": self.__counters[self.DROPPED],
+                "retried": self.__counters[self.RETRIED],
+            }
+
+    def __drop(self, can_id: int):
+        self.__count(self.DROPPED)
+        if self.on_dropped is not None:
+            self.on_dropped(can_id)
+
+    def __count(self, index: int, n: int = 1):
+        with self.__counters.get_lock():
+            self.__counters[index] += n
+
+    def __run(self):
+        heap: List[Tuple[int, int, int, bytes, int, int]] = []
+        order = 0
+        last_sent = 0.0
+
+        while True:
+            # キューに溜まっている分をまとめて取り出して優先度順に並べる
+            try:
+                item = self.__queue.get(block=len(heap) == 0)
+                while item is not None:
+                    heapq.heappush(heap, (item[0], order, item[1], item[2], item[3], item[4]))
+                    order += 1
+                    item = self.__queue.get_nowait()
+                # stop() が呼ばれた
+                return
+            except queue.Empty:
+                pass
+
+            # 送りきれずに溜まりすぎたら優先度の低いものから捨てる
+            while len(heap) > self.maxsize:
+                dropped = max(heap)
+                heap.remove(dropped)
+                heapq.heapify(heap)
+                self.__drop(dropped[2])
+
+            (_, _, can_id, data, origin_ns, enqueued_ns) = heapq.heappop(heap)
+
+            wait = self.min_interval - (time.monotonic() - last_sent)
+            if wait > 0:
+                time.sleep(wait)
+
+            if self.__transmit(can_id, data) and self.probe is not None:
+                sent_ns = time.monotonic_ns()
+                if enqueued_ns:
+                    self.probe.add_stage("can_send", sent_ns - enqueued_ns)
+                if origin_ns:
+                    self.probe.add_can_id(can_id, sent_ns - origin_ns)
+            last_sent = time.monotonic()
+
+    def __transmit(self, can_id: int, data: bytes) -> bool:
+        msg = self.frame_table.get(can_id, data)
+        if msg is None:
+            msg = can.Message(arbitration_id=can_id, data=data, is_extended_id=False)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.bus.send(msg, timeout=self.send_timeout)
+                break
+            except can.CanOperationError as e:
+                # 送信バッファが一杯のときは少し待って送り直す
+                if is_buffer_full(e) and attempt < self.max_retries:
+                    self.__count(self.RETRIED)
+                    time.sleep(self.retry_backoff * (2 ** attempt))
+                    continue
+                self.__drop(can_id)
+                print(f"Error at CANTransmitter (can_id={hex(can_id)}): {e}")
+                if self.update_error_log is not None:
+                    self.update_error_log(f"Error at CANTransmitter (can_id={hex(can_id)}): {e}")
+                return False
+
+        self.__count(self.SENT)
+        if self.on_sent is not None:
+            self.on_sent(msg)
+        return True
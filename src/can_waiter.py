@@ -0,0 +1,68 @@
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Dict, List
+import can
+
+# 応答フレームを待つための登録表
+# R1CANLister が受信したフレームを dispatch に渡し、arbitration_id が一致する Future を完了させる
+# 要求を送る前に expect で登録するので、すぐに返ってきた応答も取りこぼさない
+# 応答には、どの要求への応答かの情報がない. タイムアウトした要求への応答が後から届いたときに、次の要求への応答として使わないように
+# expect_late で「遅れて届くはずの応答」を登録し、受信したら drop_late で捨てる（window 秒たっても届かなければ忘れる）
+class CANResponseWaiter:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__waiters: Dict[int, List[Future]] = {}
+        # can_id -> 遅れて届くはずの応答ごとの、待つのをやめる時刻（time.monotonic）
+        self.__late: Dict[int, List[float]] = {}
+        self.dropped_late = 0
+
+    def expect(self, can_id: int) -> Future:
+        future: Future = Future()
+        with self.__lock:
+            self.__waiters.setdefault(can_id, []).append(future)
+        return future
+
+    def discard(self, can_id: int, future: Future):
+        with self.__lock:
+            futures = self.__waiters.get(can_id)
+            if futures is None or future not in futures:
+                return
+            futures.remove(future)
+            if len(futures) == 0:
+                del self.__waiters[can_id]
+        future.cancel()
+
+    def expect_late(self, can_id: int, window: float):
+        with self.__lock:
+            self.__late.setdefault(can_id, []).append(time.monotonic() + window)
+
+    # 遅れて届いた応答なら True（dispatch しないこと）
+    def drop_late(self, can_id: int) -> bool:
+        with self.__lock:
+            deadlines = self.__late.get(can_id)
+            if deadlines is None:
+                return False
+            now = time.monotonic()
+            while len(deadlines) > 0 and deadlines[0] < now:
+                deadlines.pop(0)
+            if len(deadlines) == 0:
+                del self.__late[can_id]
+                return False
+            deadlines.pop(0)
+            self.dropped_late += 1
+            return True
+
+    def dispatch(self, msg: can.Message) -> bool:
+        with self.__lock:
+            futures = self.__waiters.pop(msg.arbitration_id, None)
+        if futures is None:
+            return False
+
+        for future in futures:
+            try:
+                future.set_result(msg)
+            except InvalidStateError:
+                # discard 済み
+                pass
+        return True
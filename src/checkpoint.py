@@ -0,0 +1,124 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Optional, Sequence, Tuple
+
+# 再起動したときに初期化のシーケンスをやり直さないための状態の保存（mmap したファイル）
+# 状態が変わるたびに write() で書く. プロセスが落ちてもページキャッシュに残るので、書くたびに fsync はしない
+#
+# ファイル（リトルエンディアン, 固定長）
+#   magic("R1CP") version seq(u32) crc32(u32) | saved_at(f64, time.time()) area in_transition hand_position buttons(4) count (can_id(u16) valid value) * count
+#   crc32 は "|" より後ろ全体. 書き込みの途中で落ちたものは crc が合わないので読まない
+MAGIC = b"R1CP"
+VERSION = 2
+HEADER = struct.Struct("<4sBII")
+BODY = struct.Struct("<dBBB4BB")
+ENTRY = struct.Struct("<HBB")
+# 不明（area, hand_position, buttons, アクチュエータの値）
+UNKNOWN = 255
+
+class CheckpointState:
+    def __init__(
+            self,
+            area: int,
+            in_transition: bool,
+            hand_position: int,
+            buttons: Tuple[int, int, int, int],
+            actuators: Dict[int, Optional[int]],
+            saved_at: float = 0.0
+        ):
+        # 初期化のシーケンスが最後まで終わったエリア. in_transition なら別のエリアへの切り替えの途中（そのエリアの初期化が終わっていない）
+        self.area = area
+        self.in_transition = in_transition
+        self.hand_position = hand_position
+        # btn_a, btn_b, btn_x, btn_y の TwoStateButton の値
+        self.buttons = buttons
+        # CAN ID -> 最後に送った値（1 byte）. None は不明
+        self.actuators = actuators
+        self.saved_at = saved_at
+
+    def key(self) -> Tuple:
+        return (self.area, self.in_transition, self.hand_position, self.buttons, tuple(sorted(self.actuators.items())))
+
+class StateCheckpoint:
+    def __init__(self, path: str, actuator_ids: Sequence[int]):
+        self.path = path
+        self.actuator_ids = tuple(actuator_ids)
+        self.size = HEADER.size + BODY.size + ENTRY.size * len(self.actuator_ids)
+
+        self.__lock = threading.Lock()
+        self.__map: Optional[mmap.mmap] = None
+        self.__buffer = bytearray(self.size)
+        self.__seq = 0
+        self.__last_key: Optional[Tuple] = None
+        self.writes = 0
+
+    # 前回のプロセスが保存した状態. ない・壊れている・アクチュエータの表が違うときは None
+    def load(self) -> Optional[CheckpointState]:
+        try:
+            with open(self.path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None
+        if len(raw) != self.size:
+            return None
+        (magic, version, _, crc) = HEADER.unpack_from(raw)
+        if magic != MAGIC or version != VERSION or zlib.crc32(raw[HEADER.size:]) != crc:
+            return None
+
+        (saved_at, area, in_transition, hand_position, btn_a, btn_b, btn_x, btn_y, count) = BODY.unpack_from(raw, HEADER.size)
+        if count != len(self.actuator_ids):
+            return None
+        actuators: Dict[int, Optional[int]] = {}
+        offset = HEADER.size + BODY.size
+        for expected_id in self.actuator_ids:
+            (can_id, valid, value) = ENTRY.unpack_from(raw, offset)
+            offset += ENTRY.size
+            if can_id != expected_id:
+                return None
+            actuators[can_id] = value if valid else None
+        return CheckpointState(area, in_transition != 0, hand_position, (btn_a, btn_b, btn_x, btn_y), actuators, saved_at=saved_at)
+
+    # load() の後に呼ぶ（ファイルを作り直して mmap する）
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, self.size)
+            self.__map = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+
+    def is_open(self) -> bool:
+        return self.__map is not None
+
+    # 前に書いた内容と同じなら書かない
+    def write(self, state: CheckpointState):
+        key = state.key()
+        with self.__lock:
+            if self.__map is None or key == self.__last_key:
+                return
+            buffer = self.__buffer
+            BODY.pack_into(buffer, HEADER.size, time.time(), state.area, 1 if state.in_transition else 0, state.hand_position, *state.buttons, len(self.actuator_ids))
+            offset = HEADER.size + BODY.size
+            for can_id in self.actuator_ids:
+                value = state.actuators.get(can_id)
+                ENTRY.pack_into(buffer, offset, can_id, 0 if value is None else 1, 0 if value is None else value)
+                offset += ENTRY.size
+            self.__seq = (self.__seq + 1) & 0xFFFFFFFF
+            HEADER.pack_into(buffer, 0, MAGIC, VERSION, self.__seq, zlib.crc32(memoryview(buffer)[HEADER.size:]))
+            self.__map[:] = buffer
+            self.__last_key = key
+            self.writes += 1
+
+    def close(self):
+        with self.__lock:
+            if self.__map is not None:
+                self.__map.flush()
+                self.__map.close()
+                self.__map = None
@@ -0,0 +1,121 @@
+import operator
+from typing import Dict, Optional, Tuple
+from area import SeedlingHandPosition, Area
+
+# Enum(value) より速いので、値 -> Enum の表を先に作っておく
+SEEDLING_HAND_POSITIONS = {pos.value: pos for pos in SeedlingHandPosition}
+AREAS = {area.value: area for area in Area}
+
+# ClientController.snapshot() の順番と、変わったフィールドのビット（ControllerSnapshotDiffer.diff）
+CONTROLLER_FIELDS = ("btn_a", "btn_b", "btn_x", "btn_y", "btn_rb", "seedling_hand_pos", "area_state")
+FIELD_BTN_A = 1 << 0
+FIELD_BTN_B = 1 << 1
+FIELD_BTN_X = 1 << 2
+FIELD_BTN_Y = 1 << 3
+FIELD_BTN_RB = 1 << 4
+FIELD_SEEDLING_HAND_POS = 1 << 5
+FIELD_AREA_STATE = 1 << 6
+ALL_FIELDS = (1 << len(CONTROLLER_FIELDS)) - 1
+_snapshot = operator.attrgetter(*CONTROLLER_FIELDS)
+
+class ClientController:
+    def __init__(self, data: Dict):
+        self.set_from_dict(data)
+
+    # 受信ごとに作り直さずに使い回すための空のオブジェクト
+    @classmethod
+    def empty(cls) -> "ClientController":
+        ctr_data = cls.__new__(cls)
+        ctr_data.set_values(0, 0, 0, 0, 0, SeedlingHandPosition.RESET.value, Area.START.value)
+        return ctr_data
+
+    def set_from_dict(self, data: Dict):
+        try:
+            self.set_values(
+                data["btn_a"],
+                data["btn_b"],
+                data["btn_x"],
+                data["btn_y"],
+                # data["btn_lb"],
+                data["btn_rb"],
+                data["seedling_hand_pos"],
+                data["area_state"]
+               # data["start_btn"]
+            )
+        except KeyError as e:
+            raise KeyError(f"Invalid key is included in the data: {e}")
+
+    # 比較用の値（ControllerPacketDecoder はオブジェクトを使い回すので、前のパケットと比べるときはこれを取っておく）
+    def snapshot(self) -> Tuple:
+        return _snapshot(self)
+
+    def set_values(self, btn_a: int, btn_b: int, btn_x: int, btn_y: int, btn_rb: int, seedling_hand_pos: int, area_state: int):
+        try:
+            self.seedling_hand_pos = SEEDLING_HAND_POSITIONS[seedling_hand_pos]
+            self.area_state = AREAS[area_state]
+        except (KeyError, TypeError):
+            raise ValueError(f"Invalid seedling_hand_pos or area_state: {seedling_hand_pos}, {area_state}")
+        self.btn_a = btn_a
+        self.btn_b = btn_b
+        self.btn_x = btn_x
+        self.btn_y = btn_y
+        self.btn_rb = btn_rb
+
+# 前に処理したパケットと比べて、変わったフィールドだけを処理するためのもの
+# full_interval 秒ごとに（と invalidate() の後は）全フィールドを変わったことにする（取りこぼした変化を直す）
+# commit() するまでは前の値のままなので、処理しなかったパケットの変化は次のパケットで処理される
+class ControllerSnapshotDiffer:
+    def __init__(self, full_interval: float = 1.0):
+        self.full_interval = full_interval
+        self.__applied: Optional[Tuple] = None
+        self.__next_full = 0.0
+        self.full = 0
+        self.skipped = 0
+
+    # 変わったフィールドのビット（FIELD_*）. 0 なら何もしなくてよい
+    def diff(self, snapshot: Tuple, now: float) -> int:
+        applied = self.__applied
+        if applied is None or now >= self.__next_full:
+            return ALL_FIELDS
+        if snapshot == applied:
+            self.skipped += 1
+            return 0
+        changed = 0
+        for i in range(len(snapshot)):
+            if snapshot[i] != applied[i]:
+                changed |= 1 << i
+        return changed
+
+    def commit(self, snapshot: Tuple, now: float, changed: int):
+        self.__applied = snapshot
+        if changed == ALL_FIELDS:
+            self.full += 1
+            self.__next_full = now + self.full_interval
+
+    # 状態がパケット以外で変わったとき（シーケンスなど）に呼ぶ. 次のパケットは全フィールドを処理する
+    def invalidate(self):
+        self.__applied = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"full": self.full, "skipped": self.skipped}
+
+class WheelDataFromClient:
+    def __init__(self, data: Dict):
+        self.set_from_dict(data)
+
+    @classmethod
+    def empty(cls) -> "WheelDataFromClient":
+        wheel_data = cls.__new__(cls)
+        wheel_data.set_values(127, 127, 127)
+        return wheel_data
+
+    def set_from_dict(self, data: Dict):
+        try:
+            self.set_values(data["v_x"], data["v_y"], data["omega"])
+        except KeyError as e:
+            raise KeyError(f"Invalid key is included in the data: {e}")
+
+    def set_values(self, v_x: int, v_y: int, omega: int):
+        self.v_x = v_x
+        self.v_y = v_y
+        self.omega = omega
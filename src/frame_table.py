@@ -0,0 +1,24 @@
+from typing import Dict, Iterable, Optional, Tuple
+import can
+
+# (can_id, data) -> 送信用の can.Message を起動時に作っておく表
+# 表にあるフレームは送信のたびに can.Message を作らない（中身は書き換えないこと）
+class FrameTable:
+    def __init__(self, frames: Iterable[Tuple[int, bytes]] = ()):
+        self.__messages: Dict[Tuple[int, bytes], can.Message] = {}
+        for (can_id, data) in frames:
+            self.add(can_id, data)
+
+    def add(self, can_id: int, data: bytes) -> can.Message:
+        key = (can_id, bytes(data))
+        msg = self.__messages.get(key)
+        if msg is None:
+            msg = can.Message(arbitration_id=can_id, data=key[1], is_extended_id=False)
+            self.__messages[key] = msg
+        return msg
+
+    def get(self, can_id: int, data: bytes) -> Optional[can.Message]:
+        return self.__messages.get((can_id, data))
+
+    def __len__(self) -> int:
+        return len(self.__messages)
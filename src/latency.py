@@ -0,0 +1,107 @@
+import os
+import signal
+import socket
+import threading
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional
+
+# 1オクターブ（2倍）を 2**SUB_BITS 個に分けた対数ヒストグラム（誤差は最大 1/8 ≒ 12%）
+SUB_BITS = 3
+SUB_COUNT = 1 << SUB_BITS
+BUCKET_COUNT = 64 * SUB_COUNT
+
+def bucket_index(ns: int) -> int:
+    if ns < SUB_COUNT:
+        return max(ns, 0)
+    shift = ns.bit_length() - 1 - SUB_BITS
+    return ((shift + 1) << SUB_BITS) + (ns >> shift) - SUB_COUNT
+
+def bucket_upper_bound(index: int) -> int:
+    if index < SUB_COUNT:
+        return index
+    shift = (index >> SUB_BITS) - 1
+    return ((index & (SUB_COUNT - 1)) + SUB_COUNT + 1) << shift
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * BUCKET_COUNT))
+        self.count = 0
+        self.max = 0
+
+    def add(self, ns: int):
+        self.counts[bucket_index(ns)] += 1
+        self.count += 1
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, p: float) -> int:
+        if self.count == 0:
+            return 0
+        target = self.count * p / 100
+        total = 0
+        for (index, count) in enumerate(self.counts):
+            total += count
+            if count > 0 and total >= target:
+                return min(bucket_upper_bound(index), self.max)
+        return self.max
+
+    def summary(self) -> str:
+        return f"n={self.count} p50={self.percentile(50) / 1000:.1f}us p99={self.percentile(99) / 1000:.1f}us max={self.max / 1000:.1f}us"
+
+# 受信 -> CAN送信 の時間と、その内訳を測る（enabled=False のときは何もしない）
+#   stage: "decode"（JSON/バイナリの解析）, "client_controller"（ClientController を作る）,
+#          "area_state"（AreaState.set_state）, "buttons"（ボタンの処理）, "can_send"（送信キューに積んでから送るまで）
+#   can_id: UDPパケットが届いてから、そのパケットで送ったCANフレームの bus.send が終わるまで
+class LatencyProbe:
+    STAGES = ("decode", "client_controller", "area_state", "buttons", "can_send")
+
+    def __init__(self, enabled: bool = False, can_ids: Iterable[int] = ()):
+        self.enabled = enabled
+        self.stages: Dict[str, LatencyHistogram] = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.can_ids: Dict[int, LatencyHistogram] = {can_id: LatencyHistogram() for can_id in can_ids}
+        # 今処理しているUDPパケットの到着時刻（スレッドごと）
+        self.__origin = threading.local()
+
+    def add_stage(self, stage: str, ns: int):
+        self.stages[stage].add(ns)
+
+    def add_can_id(self, can_id: int, ns: int):
+        histogram = self.can_ids.get(can_id)
+        if histogram is None:
+            histogram = self.can_ids[can_id] = LatencyHistogram()
+        histogram.add(ns)
+
+    def set_origin(self, origin_ns: int):
+        self.__origin.ns = origin_ns
+
+    def get_origin(self) -> int:
+        return getattr(self.__origin, "ns", 0)
+
+    def report(self) -> str:
+        lines = [f"latency (pid={os.getpid()})"]
+        for (stage, histogram) in self.stages.items():
+            lines.append(f"  {stage:<18} {histogram.summary()}")
+        for (can_id, histogram) in sorted(self.can_ids.items()):
+            if histogram.count > 0:
+                lines.append(f"  {hex(can_id):<18} {histogram.summary()}")
+        return "\n".join(lines)
+
+    # kill -USR1 <pid> で report を出力する（fork した子プロセスにも引き継がれる）
+    def install_signal_handler(self, write: Callable[[str], None] = print, signum: int = signal.SIGUSR1):
+        signal.signal(signum, lambda signum, frame: write(self.report()))
+
+    # 127.0.0.1:port に何か送ると report を返す
+    #   echo | nc -u -w1 127.0.0.1 12399
+    def start_stats_server(self, port: int, host: str = "127.0.0.1", extra: Optional[Callable[[], List[str]]] = None):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, port))
+
+        def serve():
+            while True:
+                (_, addr) = sock.recvfrom(64)
+                text = self.report()
+                if extra is not None:
+                    text += "\n" + "\n".join(extra())
+                sock.sendto(text.encode()[:65000], addr)
+
+        threading.Thread(target=serve, name="LatencyStatsServer", daemon=True).start()
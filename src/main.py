@@ -1,103 +1,114 @@
 from NHK2024_Raspi_Library import MainController, TwoStateButton, TwoStateButtonHandler, ThreeStateButton, ThreeStateButtonHandler, OneStateButton, OneStateButtonHandler
-import json
-import sys
-from typing import Dict, Callable, Optional
-from enum import Enum
+from typing import Dict, Callable, Optional, List
 import can
 import time
 from area import SeedlingHandState, AreaState, SeedlingHandPosition, Area
-from can_list import CANList
+from frame_table import FrameTable
+from can_list import CAN, CANMessage, CAN_MESSAGES, CAN_MESSAGE_BY_ID, TX, Mechanism, MECHANISMS, INJECTION_MECHANISM, SEEDLING_MECHANISM
+from sequence import SequenceRunner, SequenceFactory, WaitFor, DONE, PREEMPTED, COALESCED, CANCELLED, FAILED
+from can_waiter import CANResponseWaiter
+from can_tx import CANTransmitter, TxPriority
+from udp_ingest import LatestDatagramReceiver
+from client_data import ClientController, ControllerSnapshotDiffer, ALL_FIELDS, FIELD_AREA_STATE, FIELD_BTN_A, FIELD_BTN_B, FIELD_BTN_X, FIELD_BTN_Y, FIELD_BTN_RB, FIELD_SEEDLING_HAND_POS
+from wire_format import ControllerPacketDecoder, WheelPacketDecoder, TELEMETRY_UNKNOWN
+from async_runtime import AsyncR1Runtime
+from wheel_state import WheelDataSharedMemory, NEUTRAL_WHEEL_DATA
+from periodic_tx import BCMPeriodicFrame
+from velocity_tx import VelocityTransmitter
+from wheel_control import WheelController, FixedRateClock
+from can_trace import CANTraceRecorder
+from traffic_record import DatagramRecorder, record_paths
+from latency import LatencyProbe
+from actuator_shadow import ActuatorShadow
+from bus_stats import BusLoadMonitor, ERROR_FRAMES, BUS_OFF, ERROR_PASSIVE
+from telemetry import TelemetryUplink
+from checkpoint import StateCheckpoint, CheckpointState, UNKNOWN as CHECKPOINT_UNKNOWN
+from rt_sched import RealtimeScheduler, parse_layout, GC_DEFAULT, GC_MODES
 import multiprocessing
+import asyncio
+import argparse
 import threading
-from multiprocessing import Value, Lock
-import ctypes
+from concurrent.futures import TimeoutError
+import functools
+import operator
 from typing import Tuple
 
-class CANList(Enum):
-    # Seedling
-    SEEDLING_ARM_SET = 0x109
-    SEEDLING_ARM_OPEN = 0x151
-    SEEDLING_ARM_SEEDLING_GET = 0x152
-    SEEDLING_ARM_DOWM = 0x153
-    SEEDLING_HAND_POSITION = 0x108
-    SEEDLING_ARM_ELEVATOR = 0x104
-    SEEDLING_INSIDE_HAND_OPEN = 0x105
-    SEEDLING_OUTSIDE_HAND_OPEN = 0x106
-    
-    # Ball
-    BALL_ARM_UNEXPAND = 0x103 # アーム収納（地面につける）
-    BALL_BALL_HAND_OPEN = 0x102 # ボール回収用のアームを開く
-    BALL_SHOOT = 0x101
-    BALL_MOTOR_ON = 0x10A
-    
-    ARM_EXPANDER = 0x103
-    HAND1 = 0x105
-    HAND2 = 0X106
-    ARM_STATE = 0x107
-    ARM1 = 0x108
-    SHOOT = 0x101
-    BALL_HAND = 0x102
-    ROBOT_VEL = 0x10B
-    
-    # ラズパイ => マイコン
-    CHECK_INJECTION_MECHANISM = 0x300
-    CHECK_SEEDLING_MECHANISM = 0x301
-    CHECK_IS_ACTIVED = 0x500
-    
-    # マイコン => ラズパイ
-    RESPONSE_INJECTION_MECHANISM = 0x400
-    RESPONSE_SEEDLING_MECHANISM = 0x401
-
-class ClientController:
-    def __init__(self, data: Dict):
-        try:
-            self.btn_a = data["btn_a"]
-            self.btn_b = data["btn_b"]
-            self.btn_x = data["btn_x"]
-            self.btn_y = data["btn_y"]
-            # self.btn_lb = data["btn_lb"]
-            self.btn_rb = data["btn_rb"]
-            self.seedling_hand_pos = SeedlingHandPosition(data["seedling_hand_pos"])
-            self.area_state = Area(data["area_state"])
-           # self.start_btn = data["start_btn"]
-        except KeyError as e:
-            raise KeyError(f"Invalid key is included in the data: {e}")
+# can_init.sh の設定と合わせる（バスの使用率の見積もりに使う）
+CAN_BITRATE = 1_000_000
+CAN_DATA_BITRATE = 2_000_000
 
-class WheelDataSharedMemory:
-    def __init__(self):
-        self.__vx_buf = Value(ctypes.c_int, 127)
-        self.__vy_buf = Value(ctypes.c_int, 127)
-        self.__omega_buf = Value(ctypes.c_int, 127)
-
-        self.lock = Lock()
-
-    def read(self) -> Tuple[int, int, int]:
-        with self.lock:
-            vx = self.__vx_buf
-            vy = self.__vy_buf
-            omega = self.__omega_buf
-            return (vx.value, vy.value, omega.value)
-    
-    def write(self, vx, vy, omega):
-        with self.lock:
-            self.__vx_buf.value = vx
-            self.__vy_buf.value = vy
-            self.__omega_buf.value = omega
-
-class WheelDataFromClient:
-    def __init__(self, data: Dict):
-        try:
-            self.v_x = data["v_x"]
-            self.v_y = data["v_y"]
-            self.omega = data["omega"]
-        except KeyError as e:
-            raise KeyError(f"Invalid key is included in the data: {e}")
+# 生存確認(CHECK_IS_ACTIVED)の周期と、periodic="bcm" のときの ROBOT_VEL の周期
+IS_ACTIVE_PERIOD = 0.1
+BCM_VELOCITY_PERIOD = 0.02
+
+# 送信キューの優先度（ここにないIDはアクチュエータ指令として扱う）
+CAN_TX_PRIORITY = {
+    CAN.ROBOT_VEL.can_id: TxPriority.VELOCITY,
+    CAN.CHECK_IS_ACTIVED.can_id: TxPriority.HEARTBEAT,
+}
+
+# エリアの切り替えのシーケンスの group（SequenceRunner）
+AREA_TRANSITION = "area_transition"
+# エリアの初期化のシーケンスの名前 -> 初期化が終わったときのエリア
+AREA_SEQUENCES = {
+    "initialize_start_state": Area.START,
+    "initialize_seedling_state": Area.SEEDLING,
+    "initialize_ball_state": Area.BALL,
+}
+
+# 0/1 で動かすアクチュエータ
+BINARY_ACTUATORS = (
+    CAN.SEEDLING_ARM_SET,
+    CAN.SEEDLING_ARM_ELEVATOR,
+    CAN.SEEDLING_INSIDE_HAND_OPEN,
+    CAN.SEEDLING_OUTSIDE_HAND_OPEN,
+    CAN.BALL_ARM_UNEXPAND,
+    CAN.BALL_BALL_HAND_OPEN,
+    CAN.BALL_SHOOT,
+    CAN.BALL_MOTOR_ON,
+)
+
+# 最後に送った値を覚えておくアクチュエータ（ActuatorShadow, 再起動用の保存）
+SHADOW_ACTUATORS = tuple(message.can_id for message in BINARY_ACTUATORS) + (CAN.SEEDLING_HAND_POSITION.can_id,)
+
+# RESPONSE_* が届いたら、その機構のIDに送った値がマイコンで反映されたとみなす（ActuatorShadow）
+MECHANISM_ACTUATORS = {mechanism.response.can_id: mechanism.actuator_ids for mechanism in MECHANISMS}
+# タイムアウトしたあと、この秒数までに届いた RESPONSE_* は遅れて届いた応答として1つ捨てる
+# （届かなかったときは次の応答を1つ捨てることになり、そのステップはタイムアウトまで待つ = これまでの固定の待ち時間）
+LATE_RESPONSE_WINDOW = 5.0
+
+# ロボットが送るフレーム（ROBOT_VEL 以外）。送信用の can.Message は起動時にすべて作っておく
+def build_frame_table() -> FrameTable:
+    frame_table = FrameTable()
+    for message in CAN_MESSAGES:
+        if message.direction == TX:
+            for data in message.fixed_payloads():
+                frame_table.add(message.can_id, data)
+    return frame_table
+
+# 受信したフレームのデータ（コピーしない）と can.Message を受け取る
+CANHandler = Callable[[bytearray, can.Message], None]
+
+# TwoStateButtonHandler の状態の値（保存用. 1 byte に入らなければ不明）
+def button_state_value(handler: TwoStateButtonHandler) -> int:
+    value = getattr(handler.state, "value", None)
+    return value if isinstance(value, int) and 0 <= value < CHECKPOINT_UNKNOWN else CHECKPOINT_UNKNOWN
 
 class R1CANLister(can.Listener):
     def __init__(self):
         super().__init__()
         self.write = None
         self.write_with_can_id = None
+        
+        # arbitration_id -> handler
+        self.handlers: Dict[int, List[CANHandler]] = {}
+        # 受信数（IDごと）
+        self.received_count: Dict[int, int] = {}
+        self.unhandled_count = 0
+        self.error_frame_count = 0
+        
+        self.can_trace = None
+        self.bus_monitor = None
     
     def init_write_fnc(self, write: Callable[[str], None], update_received_can_log: Callable[[can.Message], None], update_send_can_log: Callable[[can.Message], None], update_error_log: Callable[[str], None]):
         self.write = write
@@ -107,37 +118,148 @@ class R1CANLister(can.Listener):
         
     def init_write_can_bus_func(self, write_can_bus: Callable[[int, bytearray], None]):
         self.write_can_bus = write_can_bus
+    
+    def register_handler(self, can_id: int, handler: CANHandler):
+        self.handlers.setdefault(can_id, []).append(handler)
+    
+    # handler が登録されているIDだけを通す SocketCAN のフィルタ（エラーフレームはフィルタと関係なく届く）
+    def can_filters(self) -> List[Dict]:
+        return [{"can_id": can_id, "can_mask": 0x7FF, "extended": False} for can_id in self.handlers]
+    
+    def stats(self) -> Dict[str, int]:
+        result = {hex(can_id): count for (can_id, count) in sorted(self.received_count.items())}
+        result["unhandled"] = self.unhandled_count
+        result["error_frames"] = self.error_frame_count
+        return result
         
-    def on_message_received(self, msg):
-        can_id: int = int(msg.arbitration_id)
-        data: str = msg.data.hex()
-        is_error: bool = msg.is_error_frame
-
-        if can_id == CANList.ARM_STATE.value and data == bytearray([1]): # ARM is up state
-            self.write_can_bus(CANList.BALL_HAND.value, bytearray([1]))
+    def init_can_trace(self, can_trace: CANTraceRecorder):
+        self.can_trace = can_trace
+    
+    def init_bus_monitor(self, bus_monitor: BusLoadMonitor):
+        self.bus_monitor = bus_monitor
         
-        if is_error is True:
+    def on_message_received(self, msg):
+        if msg.is_error_frame:
+            self.error_frame_count += 1
+            if self.bus_monitor is not None:
+                self.bus_monitor.record(msg)
+            if self.can_trace is not None:
+                self.can_trace.record(msg)
             self.update_error_log(msg.__str__())
             print(f"Get Error Frame: {msg.__str__()}")
+            return
         
-        # write log file
-        if self.write is None or self.update_send_can_log is None or self.update_received_can_log is None:
-            print("write function is not initialized")
+        can_id: int = msg.arbitration_id
+        if self.bus_monitor is not None:
+            self.bus_monitor.record(msg)
+        self.received_count[can_id] = self.received_count.get(can_id, 0) + 1
+        
+        handlers = self.handlers.get(can_id)
+        if handlers is None:
+            self.unhandled_count += 1
             return
         
-        self.write(f"Received: {msg.__str__()}")
-        self.update_received_can_log(msg)
-        # print(f"Received: {msg.__str__()}")
+        for handler in handlers:
+            handler(msg.data, msg)
+        
+        # ログは文字列にせず、リングバッファに入れるだけ（ファイルへは CANTraceRecorder のスレッドが書く）
+        if self.can_trace is not None:
+            self.can_trace.record(msg)
 
 class R1MainController(MainController):
-    def __init__(self, host_name, port, port_for_wheel_controle):
+    # runtime="process": 足回り・定期送信を別プロセスで動かす（従来通り）
+    # runtime="asyncio": 1プロセスの asyncio イベントループですべて動かす（async_runtime.py）
+    # wheel_deadline: この秒数以上足回りのパケットが来なければ、定期送信は停止指令(127, 127, 127)を送る
+    # record_dir: 指定すると、受信したUDPパケットとCANフレームをこのディレクトリに記録する（replay.py で再生できる）
+    # latency: True なら受信からCAN送信までの時間を測る（kill -USR1 <pid> か stats_port への問い合わせで表示）
+    # periodic="python": 生存確認・ROBOT_VEL を Python のループから送る（従来通り）
+    # periodic="bcm": カーネルの周期送信（SocketCAN BCM）に任せ、ROBOT_VEL は値が変わったときに中身だけ差し替える（periodic_tx.py）
+    #   bcm_lease 秒以上 Python から更新がなければ、カーネルは送るのをやめる（0 なら送り続ける）
+    # bus_report_interval: この秒数ごとにCANバスの使用率・エラーフレームの集計をログに出す（0 なら出さない）
+    # wheel_rate: 足回りの指令値を作る周期（Hz）. 間に合わなかった周期はエラーログに書く
+    # wheel_slew: vx, vy, omega の1秒あたりの変化量の上限（0 なら制限しない）
+    # wheel_interpolation_delay, wheel_extrapolation: スマホのパケットの間を補間・外挿する秒数（wheel_control.py）
+    # telemetry_rate: ロボットの状態をスマホに送る頻度（Hz, 0 なら送らない）. telemetry_full_interval 秒ごとに全フィールドを送る
+    # rt_layout: ワーカーごとのCPU・スケジューリング（rt_sched.py, "default" でラズパイ4用の設定. None なら何もしない）
+    # gc_mode: "default" / "freeze"（起動後に gc.freeze()）/ "off"（freeze に加えて足回り・生存確認のプロセスでは GC を止める）
+    # input_full_interval: ボタンのパケットは前のパケットから変わったフィールドだけを処理し、この秒数ごとに全部を処理し直す
+    # checkpoint_path: 状態を保存するファイル（"" なら保存しない）. checkpoint_max_age 秒より古いものは使わない
+    #   再起動したときは、マイコンが resume_timeout 秒以内に CHECK_* に応答したら保存した状態から続ける
+    def __init__(self, host_name, port, port_for_wheel_controle, runtime="process", wheel_deadline=0.5, can_trace_path="logs/can_trace.bin", record_dir=None, latency=False, stats_port=None, bus_report_interval=10.0, periodic="python", bcm_lease=0.5, wheel_rate=100.0, wheel_slew=(1000.0, 1000.0, 1000.0), wheel_interpolation_delay=0.0, wheel_extrapolation=0.02, telemetry_rate=10.0, telemetry_full_interval=1.0, rt_layout=None, gc_mode=GC_DEFAULT, input_full_interval=1.0, checkpoint_path="logs/state_checkpoint.bin", checkpoint_max_age=600.0, resume_timeout=0.3):
         super().__init__(host_name=host_name, port=port, port_for_wheel_controle=port_for_wheel_controle)
+        self.runtime = runtime
+        self.periodic = periodic
+        self.bus_report_interval = bus_report_interval
+        # 子プロセスは自分で設定するので、最初に作っておく
+        self.rt = RealtimeScheduler(parse_layout(rt_layout) if rt_layout is not None else {}, gc_mode=gc_mode, write=self.write_rt_report)
+        
+        # CANバスの使用率（送受信したフレームの長さから見積もる）とエラーフレームの集計
+        self.bus_monitor = BusLoadMonitor(
+            can_ids=[message.can_id for message in CAN_MESSAGES],
+            bitrate=CAN_BITRATE,
+            data_bitrate=CAN_DATA_BITRATE
+        )
+        
+        self.latency = LatencyProbe(enabled=latency, can_ids=[message.can_id for message in CAN_MESSAGES])
+        self.last_wheel_timestamp = 0.0
+        if latency:
+            self.latency.install_signal_handler(write=self.write_latency_report)
+            if stats_port is not None:
+                self.latency.start_stats_server(stats_port, extra=lambda: [self.bus_monitor.report()])
+        
+        self.controller_recorder = None
+        self.wheel_recorder = None
+        if record_dir is not None:
+            (controller_record_path, wheel_record_path, can_trace_path) = record_paths(record_dir)
+            self.controller_recorder = DatagramRecorder(controller_record_path)
+            self.wheel_recorder = DatagramRecorder(wheel_record_path)
+        
+        # 送受信したCANフレームの記録（logs/can_trace.bin, 大きくなったらローテーションする）
+        # 中身は python src/can_trace.py logs/can_trace.bin で candump 形式にして見られる
+        self.can_trace = CANTraceRecorder(can_trace_path)
+        
+        # 全プロセスのCAN送信はこのキューを通す（送信スレッドは子プロセスを起動した後に開始する）
+        self.can_transmitter = CANTransmitter(
+            bus=self.bus,
+            priority_of=CAN_TX_PRIORITY,
+            on_sent=self.on_can_sent,
+            on_dropped=self.on_can_dropped,
+            update_error_log=self.log_system.update_error_log,
+            frame_table=build_frame_table()
+        )
+        if latency:
+            self.can_transmitter.probe = self.latency
+        
+        # アクチュエータごとに最後に送った値を覚えておき、同じ値は送らない
+        self.actuator_shadow = ActuatorShadow(SHADOW_ACTUATORS)
+        
+        # エリア・苗ハンドの位置・ボタン・アクチュエータの値を状態が変わるたびに保存し、再起動したらそこから続ける（resume_from_checkpoint）
+        self.checkpoint: Optional[StateCheckpoint] = None
+        self.saved_state: Optional[CheckpointState] = None
+        self.checkpoint_max_age = checkpoint_max_age
+        self.resume_timeout = resume_timeout
+        if checkpoint_path:
+            self.checkpoint = StateCheckpoint(checkpoint_path, SHADOW_ACTUATORS)
+            self.saved_state = self.checkpoint.load()
+        
+        # CANの応答待ち（request_ack）はlisterの受信をそのまま使う. R1CANLister で handler を登録したID（RESPONSE_*）だけ待てる
+        self.response_waiter = CANResponseWaiter()
         
         # init can lister
         lister = R1CANLister()
         lister.init_write_fnc(self.log_system.write, self.log_system.update_received_can_log, self.log_system.update_send_can_log, self.log_system.update_error_log)
         lister.init_write_can_bus_func(self.write_can_bus)
-        self.init_can_notifier(lister=lister)
+        lister.init_can_trace(self.can_trace)
+        lister.init_bus_monitor(self.bus_monitor)
+        lister.register_handler(CAN.ARM_STATE.can_id, self.on_arm_state)
+        for response_id in MECHANISM_ACTUATORS:
+            lister.register_handler(response_id, self.on_mechanism_response)
+        # 使わないフレームはカーネルで捨てる
+        self.bus.set_filters(lister.can_filters())
+        self.can_lister = lister
+        # asyncio のときは AsyncR1Runtime がイベントループ上で notifier を作る
+        if self.runtime != "asyncio":
+            self.init_can_notifier(lister=lister)
         
         # init button state
         self.btn_a_state = TwoStateButtonHandler(state=TwoStateButton.WAIT_1)
@@ -153,19 +275,82 @@ class R1MainController(MainController):
         
         # init hand state
         self.seedling_hand_state = SeedlingHandState()
+        
+        # エリアごとの TwoStateButton の表 (handler, ボタンの値の取り出し, action_send_0, action_send_1)
+        # パケットごとに関数やデータを作らないように、起動時に1回だけ作る
+        self.two_state_button_table = self.build_two_state_button_table()
+        # 同じ内容のパケットは比べるだけで終わる
+        self.input_differ = ControllerSnapshotDiffer(full_interval=input_full_interval)
+
+        # UDPは溜まっている中で最新のパケットだけを使う
+        # パケットはバイナリ形式とJSONのどちらでもよい（wire_format.py）
+        controller_decoder = ControllerPacketDecoder()
+        wheel_decoder = WheelPacketDecoder()
+        self.controller_receiver = LatestDatagramReceiver(self.sock, parse=controller_decoder.parse, build=controller_decoder.build)
+        self.wheel_receiver = LatestDatagramReceiver(self.sock_for_wheel_controle, parse=wheel_decoder.parse, build=wheel_decoder.build)
+        if latency:
+            self.controller_receiver.probe = self.latency
+        if self.controller_recorder is not None:
+            self.controller_receiver.on_datagram = self.controller_recorder.record
+            self.wheel_receiver.on_datagram = self.wheel_recorder.record
+
+        # エリアの初期化が最後まで終わったエリアと、start() してまだ終わっていないエリアの初期化の数（保存用）
+        # 切り替えの途中で落ちたら、再起動しても保存した状態を使わない
+        self.area_lock = threading.Lock()
+        self.settled_area = Area.START
+        self.area_transitions = 0
+
+        # 初期化・射出のシーケンスはメインループとは別スレッドで実行する
+        self.sequence_runner = SequenceRunner(update_error_log=self.log_system.update_error_log, on_finished=self.on_sequence_finished)
 
         # shared memory
         self.shared_wheel_data = WheelDataSharedMemory()
         
-        # start manageWheelControl at sub thread
-        self.process_for_wheel = multiprocessing.Process(target=self.manageWheelControl)
-        self.process_for_wheel.start()
-        self.log_system.write("Start manageWheelControl")
-        print("Start manageWheelControl")
-       
-        # ラズパイとの生存確認用メッセージ
-        self.process_for_is_active = multiprocessing.Process(target=self.sendIsActiveMessage)
-        self.process_for_is_active.start()
+        # 足回りの制御ループ（sendWheelDataRegularly）
+        # wheel_rate の周期で、届いたパケットの間を補間し、変化量を制限した指令値を作る
+        self.wheel_controller = WheelController(
+            self.shared_wheel_data.read_with_timestamp,
+            deadline=wheel_deadline,
+            slew=wheel_slew,
+            interpolation_delay=wheel_interpolation_delay,
+            max_extrapolation=wheel_extrapolation,
+            min_interval=1 / wheel_rate
+        )
+        self.wheel_clock = FixedRateClock(1 / wheel_rate, on_overrun=self.write_wheel_overrun, name="Wheel control")
+        
+        self.bcm_frames: List[BCMPeriodicFrame] = []
+        if self.periodic == "bcm":
+            # 子プロセスを作る前に登録しておく（子プロセスからも同じBCMソケットで更新できる）
+            # カーネルが送るフレームは CANTransmitter を通らないので、can_trace には記録されない
+            self.bcm_is_active = BCMPeriodicFrame(self.bus, CAN.CHECK_IS_ACTIVED.can_id, CAN.CHECK_IS_ACTIVED.encode(), period=IS_ACTIVE_PERIOD, lease=bcm_lease)
+            self.bcm_velocity = BCMPeriodicFrame(self.bus, CAN.ROBOT_VEL.can_id, CAN.ROBOT_VEL.encode(*NEUTRAL_WHEEL_DATA), period=BCM_VELOCITY_PERIOD, lease=bcm_lease)
+            self.bcm_frames = [self.bcm_is_active, self.bcm_velocity]
+            for frame in self.bcm_frames:
+                frame.start()
+            # 変わっていない値はカーネルが送り続けるので、変わったときだけ差し替える
+            self.velocity_transmitter = VelocityTransmitter(
+                send=lambda values: self.bcm_velocity.update(CAN.ROBOT_VEL.encode(*values)),
+                tick_period=self.wheel_clock.period,
+                refresh_interval=float("inf")
+            )
+        else:
+            # ROBOT_VEL はここからだけ送る（値が変わったらすぐ、変わらなければ低い頻度で）
+            self.velocity_transmitter = VelocityTransmitter(
+                send=lambda values: self.send_can_message(CAN.ROBOT_VEL, *values),
+                tick_period=self.wheel_clock.period
+            )
+        
+        if self.runtime != "asyncio":
+            # start manageWheelControl at sub thread
+            self.process_for_wheel = multiprocessing.Process(target=self.manageWheelControl)
+            self.process_for_wheel.start()
+            self.log_system.write("Start manageWheelControl")
+            print("Start manageWheelControl")
+
+        if self.runtime != "asyncio" and self.periodic != "bcm":
+            # ラズパイとの生存確認用メッセージ
+            self.process_for_is_active = multiprocessing.Process(target=self.sendIsActiveMessage)
+            self.process_for_is_active.start()
         
         # init area state
         self.area_state = AreaState(
@@ -174,9 +359,40 @@ class R1MainController(MainController):
             initialize_start_state=self.initialize_start_state
         )
 
-        # delete wheel data
-        self.process_for_wheel_priod = multiprocessing.Process(target=self.sendWheelDataRegularly)
-        self.process_for_wheel_priod.start()
+        if self.runtime != "asyncio":
+            # delete wheel data
+            self.process_for_wheel_priod = multiprocessing.Process(target=self.sendWheelDataRegularly)
+            self.process_for_wheel_priod.start()
+
+        # スマホへの状態通知（ボタンのパケットが届いたアドレスに、ボタンのソケットから送る）
+        self.telemetry: Optional[TelemetryUplink] = None
+        if telemetry_rate > 0:
+            self.telemetry = TelemetryUplink(
+                self.sock,
+                get_addr=lambda: self.controller_receiver.last_addr,
+                collect=self.telemetry_values,
+                rate=telemetry_rate,
+                full_interval=telemetry_full_interval,
+                update_error_log=self.log_system.update_error_log
+            )
+
+        self.can_trace.start()
+        self.can_transmitter.start()
+        self.bus_monitor.start(
+            write=self.write_bus_report,
+            warn=self.log_system.update_error_log,
+            report_interval=self.bus_report_interval
+        )
+        if self.telemetry is not None:
+            self.telemetry.start()
+
+        # asyncio のときは AsyncR1Runtime が notifier を作ってから行う（応答を受信するため）
+        if self.runtime != "asyncio":
+            self.resume_from_checkpoint()
+
+        # 起動が終わってから、このプロセスと送受信のスレッドに設定する（GC の freeze もここ）
+        self.rt.apply_process("main")
+        self.rt.apply_threads()
 
         print("Initialize Controller")
         
@@ -184,285 +400,642 @@ class R1MainController(MainController):
         self.log_system.write(f"Start R1Controller main")
         print(f"Start R1Controller main")
 
+        if self.runtime == "asyncio":
+            try:
+                asyncio.run(AsyncR1Runtime(self).run())
+            except KeyboardInterrupt as e:
+                self.stop()
+            return
         
         try:
             while True:
-                raw_ctr_data = json.loads(self.read_udp())
-                
-                try:
-                    ctr_data = ClientController(raw_ctr_data)
-                    self.parse_to_can_message(ctr_data)
-                except KeyError as e:
-                    self.log_system.write(f"Invalid key is included in the data: {e}")
-                    self.log_system.update_error_log(f"Invalid key is included in the data: {e}")
-                    print(f"Invalid key is included in the data: {e}")
-                    continue
+                self.receive_controller_packet()
                 
         except KeyboardInterrupt as e:
+            self.stop()
+    
+    def stop(self):
+        self.cancel_sequence()
+
+        if self.runtime != "asyncio":
             self.process_for_wheel.terminate()
             self.process_for_wheel.join()
             self.log_system.write("manageWheelControl stopped")
             self.log_system.update_error_log("manageWheelControl stopped")
             print("manageWheelControl stopped")
+
+            self.process_for_wheel_priod.terminate()
+            self.process_for_wheel_priod.join()
+
+        if self.runtime != "asyncio" and self.periodic != "bcm":
             self.process_for_is_active.terminate()
             self.process_for_is_active.join()
             self.log_system.write("isCheckActived stop")
             self.log_system.update_error_log("isCheckActived stop")
             print("isCheckActived stop")
 
-            self.process_for_wheel_priod.terminate()
-            self.process_for_wheel_priod.join()
+        for frame in self.bcm_frames:
+            frame.stop()
+
+        self.can_transmitter.stop()
+        self.log_system.write(f"CANTransmitter stopped: {self.can_transmitter.stats()}")
+        print(f"CANTransmitter stopped: {self.can_transmitter.stats()}")
+
+        self.bus_monitor.stop()
+        self.write_bus_report(self.bus_monitor.report())
+
+        self.can_trace.stop()
+        self.log_system.write(f"CANTraceRecorder stopped: overflow={self.can_trace.overflow}")
+        print(f"CANTraceRecorder stopped: overflow={self.can_trace.overflow}")
+
+        self.log_system.write(f"CAN received: {self.can_lister.stats()}")
+        print(f"CAN received: {self.can_lister.stats()}")
+
+        self.log_system.write(f"Actuator commands: {self.actuator_shadow.stats()} {self.actuator_shadow.snapshot()}")
+        print(f"Actuator commands: {self.actuator_shadow.stats()} {self.actuator_shadow.snapshot()}")
+
+        self.log_system.write(f"ROBOT_VEL: {self.velocity_transmitter.stats()}")
+        print(f"ROBOT_VEL: {self.velocity_transmitter.stats()}")
+
+        self.log_system.write(f"Wheel control: {self.wheel_clock.stats()}")
+        print(f"Wheel control: {self.wheel_clock.stats()}")
 
-            self.log_system.write(f"R1Controller main stopped")
-            self.log_system.update_error_log(f"R1Controller main stopped")
-            print(f"R1Controller main stopped")
+        if self.telemetry is not None:
+            self.telemetry.stop()
+            self.log_system.write(f"Telemetry: {self.telemetry.stats()}")
+            print(f"Telemetry: {self.telemetry.stats()}")
+
+        self.log_system.write(f"UDP controller packets: {self.controller_receiver.stats()}")
+        print(f"UDP controller packets: {self.controller_receiver.stats()}")
+
+        self.log_system.write(f"Controller input: {self.input_differ.stats()}")
+        print(f"Controller input: {self.input_differ.stats()}")
+
+        if self.checkpoint is not None:
+            self.save_checkpoint()
+            self.checkpoint.close()
+            self.log_system.write(f"StateCheckpoint closed: writes={self.checkpoint.writes}")
+            print(f"StateCheckpoint closed: writes={self.checkpoint.writes}")
+
+        if self.controller_recorder is not None:
+            self.controller_recorder.close()
+            self.wheel_recorder.close()
+
+        self.log_system.write(f"R1Controller main stopped")
+        self.log_system.update_error_log(f"R1Controller main stopped")
+        print(f"R1Controller main stopped")
+    
+    # コントローラのパケットを1つ受け取って処理する
+    # timeout=0 なら届いていなければすぐに戻る（asyncio のとき）
+    def receive_controller_packet(self, timeout: Optional[float] = None):
+        try:
+            ctr_data = self.controller_receiver.receive(timeout=timeout)
+            if ctr_data is None:
+                return
+            if self.latency.enabled:
+                self.latency.set_origin(self.controller_receiver.last_arrival_ns)
+            self.parse_to_can_message(ctr_data)
+            if self.latency.enabled:
+                self.latency.set_origin(0)
+        except KeyError as e:
+            self.log_system.write(f"Invalid key is included in the data: {e}")
+            self.log_system.update_error_log(f"Invalid key is included in the data: {e}")
+            print(f"Invalid key is included in the data: {e}")
+        except ValueError as e:
+            self.log_system.write(f"Invalid value is included in the data: {e}")
+            self.log_system.update_error_log(f"Invalid value is included in the data: {e}")
+            print(f"Invalid value is included in the data: {e}")
     
     # ロボットの足回りの制御をする
     # mainスレッドとは別のスレッドで非同期に実行する
     def manageWheelControl(self):
         self.log_system.write("Start Wheel Control")
         print("Start Wheel Control")
+        self.rt.apply_process("wheel_rx")
 
         while True:
-            raw_wheel_data = json.loads(self.read_udp_for_wheel_controle())
-            try:
-                wheel_data = WheelDataFromClient(raw_wheel_data)
-                self.write_can_bus(CANList.ROBOT_VEL.value, bytearray([wheel_data.v_x, wheel_data.v_y, wheel_data.omega]))
-                self.shared_wheel_data.write(wheel_data.v_x, wheel_data.v_y, wheel_data.omega)
-            except KeyError as e:
-                self.log_system.write(f"Invalid key is included in the data: {e}")
-                self.log_system.update_error_log(f"Invalid key is included in the data: {e}")
-                print(f"Invalid key is included in the data: {e}")
-                continue
-            except Exception as e:
-                print(e)
-                self.log_system.write("Unknown Error")
-                self.log_system.update_error_log("Unknown Error")
-                print("Unknown Error")
-                continue
+            self.receive_wheel_packet()
+    
+    def receive_wheel_packet(self, timeout: Optional[float] = None):
+        try:
+            wheel_data = self.wheel_receiver.receive(timeout=timeout)
+            if wheel_data is None:
+                return
+            # CANへの送信は sendWheelDataRegularly が行う
+            self.shared_wheel_data.write(wheel_data.v_x, wheel_data.v_y, wheel_data.omega)
+        except KeyError as e:
+            self.log_system.write(f"Invalid key is included in the data: {e}")
+            self.log_system.update_error_log(f"Invalid key is included in the data: {e}")
+            print(f"Invalid key is included in the data: {e}")
+        except Exception as e:
+            print(e)
+            self.log_system.write("Unknown Error")
+            self.log_system.update_error_log("Unknown Error")
+            print("Unknown Error")
     
     def sendWheelDataRegularly(self):
+        self.rt.apply_process("wheel_control")
+        clock = self.wheel_clock
         while True:
-            (vx, vy, omega) = self.shared_wheel_data.read()
-            self.write_can_bus(CANList.ROBOT_VEL.value, bytearray([vx, vy, omega]))
-            time.sleep(0.05)
+            now = time.monotonic()
+            clock.begin(now)
+            self.send_wheel_data(now)
+            time.sleep(clock.end(time.monotonic()))
+    
+    # 最後のパケットから wheel_deadline 以上経っていたら停止指令になる
+    def send_wheel_data(self, now: Optional[float] = None):
+        if self.latency.enabled:
+            # 新しいパケットが来ていれば、その受信時刻を起点に ROBOT_VEL までの時間を測る
+            timestamp = self.shared_wheel_data.read_with_timestamp()[3]
+            self.latency.set_origin(int(timestamp * 1e9) if timestamp != self.last_wheel_timestamp else 0)
+            self.last_wheel_timestamp = timestamp
+        self.velocity_transmitter.update(self.wheel_controller.step(now), now)
+        # periodic="bcm": Python が動いている間はカーネルの周期送信を続けさせる
+        for frame in self.bcm_frames:
+            frame.renew()
 
     def sendIsActiveMessage(self):
         self.log_system.write("Start sendIsActiveMessage")
         print("Start sendIsActiveMessage")
+        self.rt.apply_process("is_active")
 
         while True:
-            self.write_can_bus(CANList.CHECK_IS_ACTIVED.value, bytearray([]))
-            time.sleep(0.1)
+            self.send_is_active_message()
+            time.sleep(IS_ACTIVE_PERIOD)
+    
+    def send_is_active_message(self):
+        self.send_can_message(CAN.CHECK_IS_ACTIVED)
 
+    # 前に処理したパケットから変わったフィールドの処理だけを行う（ControllerSnapshotDiffer）
+    # --latency のときは段階ごとの時間（area_state, buttons）も測る
     def parse_to_can_message(self, data: ClientController):
-        
+        probe = self.latency.enabled
+        start = time.monotonic_ns() if probe else 0
+        now = time.monotonic()
+        snapshot = data.snapshot()
+        changed = self.input_differ.diff(snapshot, now)
+        if changed == 0:
+            if probe:
+                self.latency.add_stage("area_state", time.monotonic_ns() - start)
+            return
+        if changed & FIELD_AREA_STATE:
+            self.update_area_state(data)
+            # エリアが変わるとボタンの意味が変わるので全部処理する
+            changed = ALL_FIELDS
+        area_state_done = time.monotonic_ns() if probe else 0
+        if self.handle_buttons(data, changed):
+            self.input_differ.commit(snapshot, now, changed)
+        self.save_checkpoint()
+        if probe:
+            self.latency.add_stage("area_state", area_state_done - start)
+            self.latency.add_stage("buttons", time.monotonic_ns() - area_state_done)
+    
+    def update_area_state(self, data: ClientController):
         # area_stateの状態変更はここで
         self.area_state.set_state(data.area_state)
+    
+    # (handler, ボタンの値の取り出し, フィールドのビット, action_send_0, action_send_1)
+    def build_two_state_button_table(self) -> Dict[Area, Tuple[Tuple[TwoStateButtonHandler, Callable[[ClientController], int], int, Callable[[], None], Callable[[], None]], ...]]:
+        def send(message: CANMessage, value: int) -> Callable[[], None]:
+            return functools.partial(self.write_can_bus, message.can_id, message.encode(value))
         
-        print(self.area_state.is_start())
+        return {
+            Area.SEEDLING: (
+                # 苗アームの上下（ボタンA）
+                (self.btn_a_state, operator.attrgetter("btn_a"), FIELD_BTN_A, send(CAN.SEEDLING_ARM_ELEVATOR, 0), send(CAN.SEEDLING_ARM_ELEVATOR, 1)),
+            ),
+            Area.BALL: (
+                # ボール回収用のアームの開閉（ボタンB）
+                (self.btn_b_state, operator.attrgetter("btn_b"), FIELD_BTN_B, send(CAN.BALL_BALL_HAND_OPEN, 0), send(CAN.BALL_BALL_HAND_OPEN, 1)),
+                # ボール回収用のアームを地面につける（ボタンX）
+                (self.btn_x_state, operator.attrgetter("btn_x"), FIELD_BTN_X, send(CAN.BALL_ARM_UNEXPAND, 0), send(CAN.BALL_ARM_UNEXPAND, 1)),
+            ),
+            Area.START: (),
+        }
+    
+    # changed: 処理するフィールド（FIELD_*）. 処理しなかったら（シーケンス実行中）False
+    def handle_buttons(self, data: ClientController, changed: int = ALL_FIELDS) -> bool:
+        # シーケンス実行中はボタン入力を反映しない（入力の読み取りは止めない）
+        if self.sequence_runner.is_running():
+            return False
         
         if self.area_state.is_seedling():
             # 苗ハンドの位置設定
-            self.seedling_hand_state.update_state(data.seedling_hand_pos, self.write_can_bus)
+            if changed & FIELD_SEEDLING_HAND_POS:
+                self.seedling_hand_state.update_state(data.seedling_hand_pos, self.write_can_bus, start_sequence=self.sequence_runner.start)
             
-            (seedling_hand_action_send_0, seedling_hand_action_send_1) = \
-                self.seedling_hand_state.set_btn_y_handler(self.write_can_bus)
-                
-            # 苗ハンドの開閉（ボタンY）
-            self.btn_y_state.handle_button(
-                is_pressed=data.btn_y,
-                action_send_0=seedling_hand_action_send_0,
-                action_send_1=seedling_hand_action_send_1
-            )
-            
-            # 苗アームの上下
-            self.btn_a_state.handle_button(
-                is_pressed=data.btn_a,
-                action_send_0=lambda: self.write_can_bus(CANList.SEEDLING_ARM_ELEVATOR.value, bytearray([0])),
-                action_send_1=lambda: self.write_can_bus(CANList.SEEDLING_ARM_ELEVATOR.value, bytearray([1]))
-            )
+            # 苗ハンドの開閉（ボタンY）. 送る内容はハンドの位置で変わる
+            if changed & (FIELD_BTN_Y | FIELD_SEEDLING_HAND_POS):
+                (seedling_hand_action_send_0, seedling_hand_action_send_1) = \
+                    self.seedling_hand_state.set_btn_y_handler(self.write_can_bus)
+                self.btn_y_state.handle_button(
+                    is_pressed=data.btn_y,
+                    action_send_0=seedling_hand_action_send_0,
+                    action_send_1=seedling_hand_action_send_1
+                )
         
-        if self.area_state.is_ball():
-            # ボール回収用のアームの開閉（ボタンB）
-            self.btn_b_state.handle_button(
-                is_pressed=data.btn_b,
-                action_send_0=lambda: self.write_can_bus(CANList.BALL_BALL_HAND_OPEN.value, bytearray([0])),
-                action_send_1=lambda: self.write_can_bus(CANList.BALL_BALL_HAND_OPEN.value, bytearray([1]))
-            )
-            
-            # ボール回収用のアームを地面につける（ボタンX）
-            self.btn_x_state.handle_button(
-                is_pressed=data.btn_x,
-                action_send_0=lambda: self.write_can_bus(CANList.BALL_ARM_UNEXPAND.value, bytearray([0])),
-                action_send_1=lambda: self.write_can_bus(CANList.BALL_ARM_UNEXPAND.value, bytearray([1]))
-            )
-            
+        for (button_state, is_pressed, field, action_send_0, action_send_1) in self.two_state_button_table[self.area_state.get_state()]:
+            if changed & field:
+                button_state.handle_button(
+                    is_pressed=is_pressed(data),
+                    action_send_0=action_send_0,
+                    action_send_1=action_send_1
+                )
+        
+        if self.area_state.is_ball() and changed & FIELD_BTN_RB:
             # ボールの発射 (ボタンrb)
             self.btn_rb_state.handle_button(
                 is_pressed=data.btn_rb,
                 action_send=self.shoot_ball
             )
-            
-        # mainのUDPバッファを空にする
-        self.clear_udp_socket(self.sock)
+        return True
+    
+    # 送信スレッド（CANTransmitter）から、送り終わったフレームごとに呼ばれる
+    def on_can_sent(self, msg: can.Message):
+        self.can_trace.record(msg, is_tx=True)
+        self.bus_monitor.record(msg, is_tx=True)
+    
+    # 送れなかったアクチュエータ指令は、次に同じ値が来ても送るようにする（ActuatorShadow は送る前に記録している）
+    def on_can_dropped(self, can_id: int):
+        if self.actuator_shadow.tracks(can_id):
+            self.actuator_shadow.invalidate([can_id])
+            self.save_checkpoint()
+    
+    def write_bus_report(self, report: str):
+        self.log_system.write(report)
+        print(report)
+    
+    # wire_format.TELEMETRY_FIELDS の順（TelemetryUplink のスレッドから呼ばれる）
+    def telemetry_values(self) -> Tuple[int, ...]:
+        hand_position = self.seedling_hand_state.state
+        errors = self.bus_monitor.total_errors
+        return (
+            self.area_state.get_state().value,
+            hand_position.value if hand_position is not None else TELEMETRY_UNKNOWN,
+            1 if self.sequence_runner.is_running() else 0,
+            min(int(self.bus_monitor.last_load() * 1000), 0xFFFF),
+            int(errors[ERROR_FRAMES]),
+            int(errors[BUS_OFF]),
+            int(errors[ERROR_PASSIVE]),
+            self.wheel_clock.overruns(),
+        )
+    
+    def write_rt_report(self, text: str):
+        self.log_system.write(text)
+        print(text)
+    
+    def write_wheel_overrun(self, text: str):
+        self.log_system.write(text)
+        self.log_system.update_error_log(text)
+        print(text)
+    
+    def write_latency_report(self, report: str):
+        self.log_system.write(report)
+        print(report)
+    
+    # シーケンスが終わったとき（エリアの切り替えにかかった時間の記録）
+    def on_sequence_finished(self, name: str, result: str, waited: float, elapsed: float):
+        area = AREA_SEQUENCES.get(name)
+        if area is not None:
+            with self.area_lock:
+                self.area_transitions -= 1
+                if result == DONE:
+                    self.settled_area = area
+        # シーケンスがハンドやボタンの状態を変えたので、次のパケットは全部処理する
+        self.input_differ.invalidate()
+        self.save_checkpoint()
+        text = f"Sequence {name}: {result} (waited {waited:.3f} s, ran {elapsed:.3f} s)"
+        self.log_system.write(text)
+        # PREEMPTED・COALESCED はエリアの切り替えが続いたときの普通の結果なので、ログにだけ残す
+        if result in (FAILED, CANCELLED):
+            self.log_system.update_error_log(text)
+        if result not in (PREEMPTED, COALESCED):
+            print(text)
+    
+    def is_sequence_running(self) -> bool:
+        return self.sequence_runner.is_running()
+    
+    def cancel_sequence(self):
+        self.sequence_runner.cancel()
+    
+    # エリアの切り替え（initialize_*_state）は同じ group のシーケンスにする
+    # 切り替えが続いたときは途中のエリアの初期化を飛ばし、実行中のものは次のステップの前で止めて、最後に指定されたエリアの初期化だけを行う
+    # （各 initialize_*_state_sequence はどの状態からでもそのエリアの状態にする）
+    def start_area_transition(self, name: str, factory: SequenceFactory):
+        with self.area_lock:
+            self.area_transitions += 1
+        self.sequence_runner.start(name, factory, group=AREA_TRANSITION, replace=True)
     
     def initialize_start_state(self):
+        self.start_area_transition("initialize_start_state", self.initialize_start_state_sequence)
+    
+    def initialize_start_state_sequence(self):
         print("initialize start state")
         
         # 射出部分の掴むところを格納
-        self.write_can_bus(CANList.BALL_ARM_UNEXPAND.value, bytearray([1]))
-        self.write_can_bus(CANList.BALL_HAND.value, bytearray([0]))
+        self.send_can_message(CAN.BALL_ARM_UNEXPAND, 1)
+        self.send_can_message(CAN.BALL_HAND, 0)
         
-        time.sleep(0.5)
+        # 格納が終わるまで待つ（応答がなければ 0.5 秒で続行）
+        yield self.request_ack(INJECTION_MECHANISM, timeout=0.5)
         
         # 苗アームをup
-        self.write_can_bus(CANList.SEEDLING_ARM_ELEVATOR.value, bytearray([0]))
+        self.send_can_message(CAN.SEEDLING_ARM_ELEVATOR, 0)
         self.btn_a_state.transision_next_state(1)
         
-        time.sleep(1)
-        
-        # 安全のため1秒停止, TODO: どれぐらいの秒数が必要なのか確認
+        # 苗アームが上がるまで待つ（応答がなければ 1 秒で続行）
+        yield self.request_ack(SEEDLING_MECHANISM, timeout=1)
         
         # 射出部分をdown
-        self.write_can_bus(CANList.SHOOT.value, bytearray([1]))
+        self.send_can_message(CAN.SHOOT, 1)
         
         # アームの制御を止める
-        self.write_can_bus(CANList.SEEDLING_HAND_POSITION.value, bytearray([SeedlingHandPosition.RESET.value]))
-        
-        # mainのUDPバッファを空にする
-        self.clear_udp_socket(self.sock)
+        self.send_can_message(CAN.SEEDLING_HAND_POSITION, SeedlingHandPosition.RESET.value)
     
     def initialize_seedling_state(self):
+        self.start_area_transition("initialize_seedling_state", self.initialize_seedling_state_sequence)
+    
+    def initialize_seedling_state_sequence(self):
         print("initialize seddling state")
         # 射出部分の掴むところを格納
-        self.write_can_bus(CANList.BALL_ARM_UNEXPAND.value, bytearray([1]))
-        self.write_can_bus(CANList.BALL_HAND.value, bytearray([0]))
+        self.send_can_message(CAN.BALL_ARM_UNEXPAND, 1)
+        self.send_can_message(CAN.BALL_HAND, 0)
         
-        # 安全のため1秒停止, TODO: どれぐらいの秒数が必要なのか確認
-        time.sleep(1)
+        # 格納が終わるまで待つ（応答がなければ 1 秒で続行）
+        yield self.request_ack(INJECTION_MECHANISM, timeout=1)
         
         # 射出部分を上に上げる
-        self.write_can_bus(CANList.SHOOT.value, bytearray([0]))
+        self.send_can_message(CAN.SHOOT, 0)
         
-        # 完了メッセージが届くまで待つ
-        # self.write_can_bus(CANList.CHECK_INJECTION_MECHANISM.value, bytearray([]))
-        # if self.wait_can_message(CANList.RESPONSE_INJECTION_MECHANISM.value, timeout=5) is None:
-        #     self.log_system.update_error_log("Error: Cannot recive RESPONSE_INJECTION_MECHANISM")
-        #     self.log_system.write("Error: Cannot recive RESPONSE_INJECTION_MECHANISM")
-        #     print("Error: Cannot recive RESPONSE_INJECTION_MECHANISM")
-        #     return
-        
-        time.sleep(1.5)
+        # 射出部分が上がるまで待つ（応答がなければ 1.5 秒で続行）
+        yield self.request_ack(INJECTION_MECHANISM, timeout=1.5)
         
         # 完了後に次の動作を行う
         # TODO: もしかしたら逆かもしれないので、チェックする
         # アームを下ろす
-        self.write_can_bus(CANList.SEEDLING_ARM_ELEVATOR.value, bytearray([1]))
+        self.send_can_message(CAN.SEEDLING_ARM_ELEVATOR, 1)
         self.btn_a_state.transision_next_state(1)
         # ハンドの腕を下ろす
-        self.write_can_bus(CANList.SEEDLING_ARM_SET.value, bytearray([1]))
+        self.send_can_message(CAN.SEEDLING_ARM_SET, 1)
         # ハンドを開く
-        self.write_can_bus(CANList.SEEDLING_HAND_POSITION.value, bytearray([SeedlingHandPosition.PICKUP.value]))
-        self.write_can_bus(CANList.SEEDLING_INSIDE_HAND_OPEN.value, bytearray([1]))
-        self.write_can_bus(CANList.SEEDLING_OUTSIDE_HAND_OPEN.value, bytearray([1]))
+        self.send_can_message(CAN.SEEDLING_HAND_POSITION, SeedlingHandPosition.PICKUP.value)
+        self.send_can_message(CAN.SEEDLING_INSIDE_HAND_OPEN, 1)
+        self.send_can_message(CAN.SEEDLING_OUTSIDE_HAND_OPEN, 1)
         self.seedling_hand_state.reset_state(SeedlingHandPosition.PICKUP.value)
         self.btn_a_state.transision_next_state(1)
         self.btn_y_state.transision_next_state(1)
-        
-        # mainのUDPバッファを空にする
-        self.clear_udp_socket(self.sock)
-
-        return
     
     # TODO: test
     def initialize_ball_state(self):
+        self.start_area_transition("initialize_ball_state", self.initialize_ball_state_sequence)
+    
+    def initialize_ball_state_sequence(self):
         
         print("Initialize ball state")
-        self.write_can_bus(CANList.SEEDLING_HAND_POSITION.value, bytearray([SeedlingHandPosition.PUTINSIDE.value]))
-        time.sleep(1)
-        self.write_can_bus(CANList.SEEDLING_ARM_ELEVATOR.value, bytearray([0]))
-        self.write_can_bus(CANList.SEEDLING_ARM_SET.value, bytearray([0]))
-        self.write_can_bus(CANList.SEEDLING_INSIDE_HAND_OPEN.value, bytearray([0]))
-        self.write_can_bus(CANList.SEEDLING_OUTSIDE_HAND_OPEN.value, bytearray([0]))
+        self.send_can_message(CAN.SEEDLING_HAND_POSITION, SeedlingHandPosition.PUTINSIDE.value)
+        # ハンドが中に入るまで待つ（応答がなければ 1 秒で続行）
+        yield self.request_ack(SEEDLING_MECHANISM, timeout=1)
+        self.send_can_message(CAN.SEEDLING_ARM_ELEVATOR, 0)
+        self.send_can_message(CAN.SEEDLING_ARM_SET, 0)
+        self.send_can_message(CAN.SEEDLING_INSIDE_HAND_OPEN, 0)
+        self.send_can_message(CAN.SEEDLING_OUTSIDE_HAND_OPEN, 0)
         
         self.btn_a_state.transision_next_state(0)
         self.btn_y_state.transision_next_state(0)
         self.seedling_hand_state.reset_state(SeedlingHandPosition.PUTINSIDE.value)
         
-        # self.write_can_bus(CANList.CHECK_SEEDLING_MECHANISM.value, bytearray([]))
-        # if self.wait_can_message(CANList.RESPONSE_SEEDLING_MECHANISM.value, timeout=5) is None:
-        #     self.log_system.update_error_log("Error: Cannot recive RESPONSE_SEEDLING_MECHANISM")
-        #     self.log_system.write("Error: Cannot recive RESPONSE_SEEDLING_MECHANISM")
-        #     print("Error: Cannot recive RESPONSE_SEEDLING_MECHANISM")
-        #     return
-        
-        time.sleep(2)
+        # 苗の機構が格納されるまで待つ（応答がなければ 2 秒で続行）
+        yield self.request_ack(SEEDLING_MECHANISM, timeout=2)
         
-        self.write_can_bus(CANList.SHOOT.value, bytearray([1]))
+        self.send_can_message(CAN.SHOOT, 1)
         
         # ボタンの状態を更新する
         self.btn_x_state.transision_next_state(1)
         self.btn_b_state.transision_next_state(0)
-        
-        # mainのUDPバッファを空にする
-        self.clear_udp_socket(self.sock)
-        
-        return
     
     def shoot_ball(self):
-        # モータ回す
-        self.write_can_bus(CANList.BALL_MOTOR_ON.value, bytearray([1]))
-        # 1秒停止
-        time.sleep(2)
-        # ボール発射
-        # マイコン側で、ボールのアームを格納するようにする
-        self.write_can_bus(CANList.BALL_SHOOT.value, bytearray([0]))
-        # 一秒停止
-        time.sleep(2)
-        # 射出機構を元に戻す
-        self.write_can_bus(CANList.BALL_MOTOR_ON.value, bytearray([0]))
-        self.write_can_bus(CANList.BALL_SHOOT.value, bytearray([1]))
-        
-        # ボタンの状態を更新する
-        self.btn_x_state.transision_next_state(1)
-        self.btn_b_state.transision_next_state(0)
-        
-        # mainのUDPバッファを空にする
-        self.clear_udp_socket(self.sock)
+        self.sequence_runner.start("shoot_ball", self.shoot_ball_sequence)
     
-    def wait_can_message(self, can_id: int, timeout=0.5) -> Optional[can.Message]:
-        filters = [{
-            "can_id": can_id,
-            "can_mask": 0x7FF
-        }]
-        
-        with can.interface.Bus(channel='can0', bustype='socketcan', bitrate=1000000, fd=True, data_bitrate=2000000) as bus:
-            bus.set_filters(filters=filters)
-            msg = bus.recv(timeout=timeout)
+    def shoot_ball_sequence(self):
+        try:
+            # モータ回す
+            self.send_can_message(CAN.BALL_MOTOR_ON, 1)
+            # モータの回転が上がるまで待つ（応答がなければ 2 秒で続行）
+            yield self.request_ack(INJECTION_MECHANISM, timeout=2)
+            # ボール発射
+            # マイコン側で、ボールのアームを格納するようにする
+            self.send_can_message(CAN.BALL_SHOOT, 0)
+            # 発射が終わるまで待つ（応答がなければ 2 秒で続行）
+            yield self.request_ack(INJECTION_MECHANISM, timeout=2)
+            # 射出機構を元に戻す
+            self.send_can_message(CAN.BALL_MOTOR_ON, 0)
+            self.send_can_message(CAN.BALL_SHOOT, 1)
             
-        return msg
+            # ボタンの状態を更新する
+            self.btn_x_state.transision_next_state(1)
+            self.btn_b_state.transision_next_state(0)
+        finally:
+            # アーム・ハンドはマイコンが動かしたので、次のボタン操作は同じ値でも送る（途中で止められたときも）
+            self.invalidate_mechanism(INJECTION_MECHANISM)
+    
+    # 定義（can_list.py）にあるメッセージを送る. ROBOT_VEL なら send_can_message(CAN.ROBOT_VEL, v_x, v_y, omega)
+    def send_can_message(self, message: CANMessage, *values: int, priority: Optional[TxPriority] = None, force: bool = False):
+        self.write_can_bus(message.can_id, message.encode(*values), priority=priority, force=force)
+    
+    # CANの送信は送信キューに積むだけ（実際の送信は CANTransmitter のスレッド）
+    # アクチュエータ指令は最後に送った値と同じなら送らない（force=True なら送る）
+    def write_can_bus(self, can_id: int, data: bytearray, priority: Optional[TxPriority] = None, force: bool = False):
+        if not self.actuator_shadow.should_send(can_id, data, force):
+            return
+        if self.actuator_shadow.tracks(can_id):
+            self.save_checkpoint()
+        if self.latency.enabled:
+            self.can_transmitter.send(can_id, data, priority=priority, origin_ns=self.latency.get_origin())
+        else:
+            self.can_transmitter.send(can_id, data, priority=priority)
+    
+    def on_arm_state(self, data: bytearray, msg: can.Message):
+        if len(data) < CAN.ARM_STATE.size:
+            return
+        (arm_state,) = CAN.ARM_STATE.decode(data)
+        if arm_state == 1: # ARM is up state
+            # アームはマイコンが動かしたので、送った値の記録は使えない
+            self.invalidate_mechanism(INJECTION_MECHANISM)
+            self.send_can_message(CAN.BALL_HAND, 1)
+    
+    def on_mechanism_response(self, data: bytearray, msg: can.Message):
+        # タイムアウトした CHECK_* への応答は、次の CHECK_* への応答にしない（前の動作が終わっただけ）
+        if self.response_waiter.drop_late(msg.arbitration_id):
+            text = f"Late {CAN_MESSAGE_BY_ID[msg.arbitration_id].name} is ignored"
+            self.log_system.write(text)
+            print(text)
+            return
+        self.response_waiter.dispatch(msg)
+        self.actuator_shadow.acknowledge(MECHANISM_ACTUATORS[msg.arbitration_id])
+    
+    # シーケンスの中で yield する. mechanism.check を送り、mechanism.response が届いたら次のステップへ進む
+    # timeout 秒以内に届かなければ、ログに残して進む（timeout はこれまでの固定の待ち時間にする）
+    def request_ack(self, mechanism: Mechanism, timeout: float) -> WaitFor:
+        response_id = mechanism.response.can_id
+        future = self.response_waiter.expect(response_id)
+        self.send_can_message(mechanism.check)
+        return WaitFor(
+            future,
+            timeout,
+            on_timeout=lambda: self.on_ack_timeout(mechanism, timeout),
+            cleanup=lambda: self.response_waiter.discard(response_id, future)
+        )
+    
+    def on_ack_timeout(self, mechanism: Mechanism, timeout: float):
+        self.response_waiter.expect_late(mechanism.response.can_id, LATE_RESPONSE_WINDOW)
+        text = f"Error: Cannot recive {mechanism.response.name} in {timeout:g} s"
+        self.log_system.update_error_log(text)
+        self.log_system.write(text)
+        print(text)
+        # マイコンの状態がわからないので、次は同じ値でも送る
+        self.invalidate_mechanism(mechanism)
+    
+    # ラズパイ以外（マイコン）がその機構のアクチュエータを動かしたとき・状態がわからないときに呼ぶ
+    def invalidate_mechanism(self, mechanism: Mechanism):
+        self.actuator_shadow.invalidate(mechanism.actuator_ids)
+        self.save_checkpoint()
+    
+    # 状態を保存する（前に保存した内容と同じなら書かない）. 状態が変わりうる所から呼ぶ
+    # 保存しないとき・resume_from_checkpoint の前（__init__ の途中など）は何もしない
+    def save_checkpoint(self):
+        checkpoint = getattr(self, "checkpoint", None)
+        if checkpoint is None or not checkpoint.is_open():
+            return
+        with self.area_lock:
+            area = self.settled_area
+            in_transition = self.area_transitions > 0 or area != self.area_state.get_state()
+        hand_position = self.seedling_hand_state.state
+        actuators = {}
+        for can_id in SHADOW_ACTUATORS:
+            data = self.actuator_shadow.commanded(can_id)
+            actuators[can_id] = data[0] if data else None
+        checkpoint.write(CheckpointState(
+            area.value,
+            in_transition,
+            hand_position.value if hand_position is not None else CHECKPOINT_UNKNOWN,
+            tuple(button_state_value(handler) for handler in self.checkpoint_buttons()),
+            actuators
+        ))
+    
+    def checkpoint_buttons(self) -> Tuple[TwoStateButtonHandler, ...]:
+        return (self.btn_a_state, self.btn_b_state, self.btn_x_state, self.btn_y_state)
+    
+    # 起動時に1回だけ呼ぶ. 保存した状態があり、両方のマイコンが CHECK_* に応答したら、初期化のシーケンスをせずにその状態から続ける
+    # 応答がなければ（マイコンが動いていない・再起動中）これまで通り START から始める
+    def resume_from_checkpoint(self):
+        if self.checkpoint is None:
+            return
+        state = self.saved_state
+        self.saved_state = None
+        self.checkpoint.open()
+        try:
+            if state is None:
+                return
+            age = time.time() - state.saved_at
+            if not 0 <= age <= self.checkpoint_max_age:
+                self.write_checkpoint_report(f"Checkpoint not used: saved {age:.0f} s ago")
+                return
+            # エリアの初期化が終わっていない（途中まで動いた機構の状態がわからない）ので、START から初期化し直す
+            if state.in_transition:
+                self.write_checkpoint_report(f"Checkpoint not used: saved while leaving {Area(state.area).name} (area transition not finished)")
+                return
+
+            started = time.monotonic()
+            futures = [(mechanism, self.response_waiter.expect(mechanism.response.can_id)) for mechanism in MECHANISMS]
+            for mechanism in MECHANISMS:
+                self.send_can_message(mechanism.check)
+            missing = []
+            for (mechanism, future) in futures:
+                try:
+                    future.result(timeout=max(started + self.resume_timeout - time.monotonic(), 0))
+                except TimeoutError:
+                    missing.append(mechanism.response.name)
+                    self.response_waiter.expect_late(mechanism.response.can_id, LATE_RESPONSE_WINDOW)
+                finally:
+                    self.response_waiter.discard(mechanism.response.can_id, future)
+            if len(missing) > 0:
+                self.write_checkpoint_report(f"Checkpoint not used: no {', '.join(missing)} in {self.resume_timeout:g} s")
+                return
+            handshake = time.monotonic() - started
+
+            # AreaState.set_state は初期化のシーケンスを始めるので、値だけを戻す
+            with self.area_lock:
+                self.settled_area = Area(state.area)
+                self.area_state.state = self.settled_area
+            if state.hand_position != CHECKPOINT_UNKNOWN:
+                self.seedling_hand_state.state = SeedlingHandPosition(state.hand_position)
+            for (handler, value) in zip(self.checkpoint_buttons(), state.buttons):
+                if value != CHECKPOINT_UNKNOWN:
+                    handler.state = TwoStateButton(value)
+            self.actuator_shadow.restore({
+                can_id: bytes([value]) if value is not None else None
+                for (can_id, value) in state.actuators.items()
+            })
+            self.input_differ.invalidate()
+            self.write_checkpoint_report(
+                f"Resumed from checkpoint: area={self.area_state.get_state().name} hand={self.seedling_hand_state.state} "
+                f"(saved {age:.1f} s ago, handshake {handshake * 1000:.1f} ms)"
+            )
+        except ValueError as e:
+            self.write_checkpoint_report(f"Checkpoint not used: {e}")
+        finally:
+            self.save_checkpoint()
+    
+    def write_checkpoint_report(self, text: str):
+        self.log_system.write(text)
+        print(text)
     
     def test(self):
         # self.btn_a_state.handle_button(
         #     is_pressed=1,
         #     action_send = self.get_seedling_with_arm
         # )
-        # self.write_can_bus(CANList.ROBOT_VEL.value, bytearray([160, 127, 127]))
-        # self.write_can_bus(CANList.SEEDLING_HAND_POSITION.value, bytearray([SeedlingHandPosition.RESET.value]))
-        self.write_can_bus(CANList.SEEDLING_HAND_POSITION.value, bytearray([SeedlingHandPosition.RESET.value]))
+        # self.write_can_bus(CAN.ROBOT_VEL.can_id, bytearray([160, 127, 127]))
+        # self.send_can_message(CAN.SEEDLING_HAND_POSITION, SeedlingHandPosition.RESET.value)
+        self.send_can_message(CAN.SEEDLING_HAND_POSITION, SeedlingHandPosition.RESET.value)
         time.sleep(1)
-        self.write_can_bus(CANList.SEEDLING_HAND_POSITION.value, bytearray([SeedlingHandPosition.PUTOUTSIDE.value]))
+        self.send_can_message(CAN.SEEDLING_HAND_POSITION, SeedlingHandPosition.PUTOUTSIDE.value)
         time.sleep(2)
-        self.write_can_bus(CANList.SEEDLING_HAND_POSITION.value, bytearray([SeedlingHandPosition.RESET.value]))
+        self.send_can_message(CAN.SEEDLING_HAND_POSITION, SeedlingHandPosition.RESET.value)
         time.sleep(1)
-        self.write_can_bus(CANList.SEEDLING_HAND_POSITION.value, bytearray([SeedlingHandPosition.PUTINSIDE.value]))
+        self.send_can_message(CAN.SEEDLING_HAND_POSITION, SeedlingHandPosition.PUTINSIDE.value)
     
 if __name__ == "__main__":
-    host_name = "tsemiR1.local"
-    port = 12345
-    port_for_wheel_controle = 12346
-    r2_main_controller = R1MainController(host_name=host_name, port=port, port_for_wheel_controle=port_for_wheel_controle)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="tsemiR1.local")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--port-for-wheel", type=int, default=12346)
+    parser.add_argument("--runtime", choices=["process", "asyncio"], default="process")
+    parser.add_argument("--wheel-deadline", type=float, default=0.5)
+    parser.add_argument("--record", default=None, help="受信したUDPパケットとCANフレームを記録するディレクトリ")
+    parser.add_argument("--latency", action="store_true", help="受信からCAN送信までの時間を測る")
+    parser.add_argument("--stats-port", type=int, default=None, help="--latency の結果を 127.0.0.1 のこのポートで返す")
+    parser.add_argument("--periodic", choices=["python", "bcm"], default="python", help="生存確認・ROBOT_VEL の周期送信を Python で行うか、カーネル(BCM)に任せるか")
+    parser.add_argument("--bcm-lease", type=float, default=0.5, help="--periodic bcm のとき、この秒数更新がなければ周期送信を止める（0 なら止めない）")
+    parser.add_argument("--wheel-rate", type=float, default=100.0, help="足回りの制御ループの周波数（Hz）")
+    parser.add_argument("--wheel-slew", type=float, nargs=3, default=[1000.0, 1000.0, 1000.0], metavar=("VX", "VY", "OMEGA"), help="指令値（0〜255）の1秒あたりの変化量の上限（0 なら制限しない）")
+    parser.add_argument("--wheel-interpolation-delay", type=float, default=0.0, help="この秒数前の時刻の指令値をパケットの間から補間して使う")
+    parser.add_argument("--wheel-extrapolation", type=float, default=0.02, help="最後のパケットからこの秒数までは直前の傾きで外挿する")
+    parser.add_argument("--telemetry-rate", type=float, default=10.0, help="ロボットの状態をスマホに送る頻度（Hz, 0 なら送らない）")
+    parser.add_argument("--telemetry-full-interval", type=float, default=1.0, help="この秒数ごとに変わっていないフィールドも送る")
+    parser.add_argument("--rt", default=None, help="ワーカーごとのCPU・スケジューリング（例: wheel_control=3:fifo=50,main=1:nice=-5. default でラズパイ4用の設定）")
+    parser.add_argument("--gc", choices=GC_MODES, default=GC_DEFAULT, help="起動後の GC の設定")
+    parser.add_argument("--input-full-interval", type=float, default=1.0, help="ボタンのパケットを変わっていないフィールドも含めて処理し直す間隔（秒）")
+    parser.add_argument("--checkpoint", default="logs/state_checkpoint.bin", help="状態を保存するファイル（空文字なら保存しない）")
+    parser.add_argument("--checkpoint-max-age", type=float, default=600.0, help="これより古い（秒）保存した状態は使わない")
+    parser.add_argument("--resume-timeout", type=float, default=0.3, help="再起動したときにマイコンの応答を待つ秒数")
+    parser.add_argument("--bus-report-interval", type=float, default=10.0, help="CANバスの使用率を表示する間隔（秒, 0 なら表示しない）")
+    args = parser.parse_args()
+
+    host_name = args.host
+    port = args.port
+    port_for_wheel_controle = args.port_for_wheel
+    r2_main_controller = R1MainController(host_name=host_name, port=port, port_for_wheel_controle=port_for_wheel_controle, runtime=args.runtime, wheel_deadline=args.wheel_deadline, record_dir=args.record, latency=args.latency, stats_port=args.stats_port, bus_report_interval=args.bus_report_interval, periodic=args.periodic, bcm_lease=args.bcm_lease, wheel_rate=args.wheel_rate, wheel_slew=tuple(args.wheel_slew), wheel_interpolation_delay=args.wheel_interpolation_delay, wheel_extrapolation=args.wheel_extrapolation, telemetry_rate=args.telemetry_rate, telemetry_full_interval=args.telemetry_full_interval, rt_layout=args.rt, gc_mode=args.gc, input_full_interval=args.input_full_interval, checkpoint_path=args.checkpoint, checkpoint_max_age=args.checkpoint_max_age, resume_timeout=args.resume_timeout)
     r2_main_controller.main()
     # r2_main_controller.test()
    # time.sleep(5)
@@ -0,0 +1,119 @@
+# マイコンの代わり（ロボットなしで main.py のシーケンスを動かす）
+# 機構のアクチュエータへの指令を受けたら、latency 秒後にその動作が終わったことにする
+# CHECK_* を受けたら、動作が終わってから RESPONSE_* を返す（drop の確率で返さない）
+#
+#   sudo ip link add dev can0 type vcan && sudo ip link set can0 up
+#   python src/mcu_stub.py --injection-latency 0.3 --seedling-latency 0.6 --jitter 0.05 &
+#   python src/main.py --host 127.0.0.1
+import argparse
+import heapq
+import random
+import threading
+import time
+from typing import Dict, List, Tuple
+import can
+from can_list import CAN_MESSAGE_BY_ID, MECHANISMS, Mechanism
+
+class MicrocontrollerStub(can.Listener):
+    def __init__(self, bus: can.BusABC, latencies: Dict[str, float], jitter: float = 0.0, response_latency: float = 0.001, drop: float = 0.0, seed=None):
+        super().__init__()
+        self.bus = bus
+        self.latencies = latencies
+        self.jitter = jitter
+        self.response_latency = response_latency
+        self.drop = drop
+        self.random = random.Random(seed)
+
+        self.__by_actuator: Dict[int, Mechanism] = {can_id: mechanism for mechanism in MECHANISMS for can_id in mechanism.actuator_ids}
+        self.__by_check: Dict[int, Mechanism] = {mechanism.check.can_id: mechanism for mechanism in MECHANISMS}
+        # 機構の動作が終わる時刻
+        self.__busy_until: Dict[str, float] = {mechanism.name: 0.0 for mechanism in MECHANISMS}
+
+        # (送る時刻, 順番, 応答)
+        self.__schedule: List[Tuple[float, int, can.Message]] = []
+        self.__count = 0
+        self.__cond = threading.Condition()
+        self.__stopped = False
+        self.stats = {"commands": 0, "checks": 0, "responses": 0, "dropped": 0}
+        self.__thread = threading.Thread(target=self.__run, name="MicrocontrollerStub", daemon=True)
+        self.__thread.start()
+
+    def on_message_received(self, msg: can.Message):
+        if msg.is_error_frame:
+            return
+        now = time.monotonic()
+        mechanism = self.__by_actuator.get(msg.arbitration_id)
+        if mechanism is not None:
+            latency = max(self.latencies[mechanism.name] + self.random.uniform(-self.jitter, self.jitter), 0.0)
+            with self.__cond:
+                self.__busy_until[mechanism.name] = max(self.__busy_until[mechanism.name], now + latency)
+                self.stats["commands"] += 1
+            self.__print(now, msg, f"{mechanism.name} busy for {latency * 1000:.0f} ms")
+            return
+
+        mechanism = self.__by_check.get(msg.arbitration_id)
+        if mechanism is None:
+            return
+        with self.__cond:
+            self.stats["checks"] += 1
+            if self.random.random() < self.drop:
+                self.stats["dropped"] += 1
+                self.__print(now, msg, "dropped")
+                return
+            send_at = max(now, self.__busy_until[mechanism.name]) + self.response_latency
+            response = can.Message(arbitration_id=mechanism.response.can_id, data=mechanism.response.encode(), is_extended_id=False)
+            heapq.heappush(self.__schedule, (send_at, self.__count, response))
+            self.__count += 1
+            self.__cond.notify()
+        self.__print(now, msg, f"{mechanism.response.name} in {(send_at - now) * 1000:.0f} ms")
+
+    def stop(self):
+        with self.__cond:
+            self.__stopped = True
+            self.__cond.notify()
+        self.__thread.join(timeout=1)
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                while not self.__stopped and (len(self.__schedule) == 0 or self.__schedule[0][0] > time.monotonic()):
+                    self.__cond.wait(None if len(self.__schedule) == 0 else self.__schedule[0][0] - time.monotonic())
+                if self.__stopped:
+                    return
+                (_, _, response) = heapq.heappop(self.__schedule)
+                self.stats["responses"] += 1
+            self.bus.send(response)
+
+    def __print(self, now: float, msg: can.Message, text: str):
+        message = CAN_MESSAGE_BY_ID.get(msg.arbitration_id)
+        name = message.name if message is not None else hex(msg.arbitration_id)
+        print(f"{now:.3f} {name} {bytes(msg.data).hex()} -> {text}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--interface", default="socketcan")
+    parser.add_argument("--channel", default="can0")
+    parser.add_argument("--injection-latency", type=float, default=0.3, help="射出機構の動作にかかる秒数")
+    parser.add_argument("--seedling-latency", type=float, default=0.5, help="苗の機構の動作にかかる秒数")
+    parser.add_argument("--jitter", type=float, default=0.0, help="動作時間を ±jitter 秒ばらつかせる")
+    parser.add_argument("--response-latency", type=float, default=0.001, help="動作が終わってから RESPONSE_* を返すまでの秒数")
+    parser.add_argument("--drop", type=float, default=0.0, help="CHECK_* に応答しない確率")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    latencies = {"injection": args.injection_latency, "seedling": args.seedling_latency}
+    with can.Bus(channel=args.channel, interface=args.interface) as bus:
+        stub = MicrocontrollerStub(bus, latencies, jitter=args.jitter, response_latency=args.response_latency, drop=args.drop, seed=args.seed)
+        notifier = can.Notifier(bus, [stub])
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            notifier.stop()
+            stub.stop()
+    print(" ".join(f"{key}={value}" for (key, value) in stub.stats.items()))
+
+if __name__ == "__main__":
+    main()
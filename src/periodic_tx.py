@@ -0,0 +1,52 @@
+import time
+from typing import Optional
+import can
+
+# 周期送信をカーネル（SocketCAN の broadcast manager, BCM）に任せる
+# Python が止まっても period ごとに送られ続け、データを変えるときは modify_data で中身だけ差し替える（タイマーはそのまま）
+#
+# lease > 0 なら、lease 秒 renew() されないとカーネルは送るのをやめる
+# （プログラムが固まったときに、最後の速度指令や生存確認を送り続けないように）
+# renew はタイマーを掛け直すので、その直後の1回だけ間隔が period + (renew の遅れ) になる. 遅れを小さくするため、送信時刻の直後に renew する
+class BCMPeriodicFrame:
+    def __init__(self, bus: can.BusABC, can_id: int, data: bytes, period: float, lease: float = 0.0):
+        self.bus = bus
+        self.can_id = can_id
+        self.period = period
+        self.lease = lease
+        self.message = can.Message(arbitration_id=can_id, data=data, is_extended_id=False)
+        self.task: Optional[can.broadcastmanager.CyclicSendTaskABC] = None
+        self.renew_count = 0
+        self.__renew_at = float("inf")
+
+    def start(self):
+        self.task = self.bus.send_periodic(self.message, self.period, duration=self.lease if self.lease > 0 else None)
+        self.__arm(time.monotonic())
+
+    def update(self, data: bytes):
+        if bytes(self.message.data) == data:
+            return
+        self.message = can.Message(arbitration_id=self.can_id, data=data, is_extended_id=False)
+        self.task.modify_data(self.message)
+
+    # 定期的に（period より短い間隔で）呼ぶ. lease の半分が過ぎたら、次の送信時刻の直後にタイマーを掛け直す
+    def renew(self, now: Optional[float] = None):
+        if self.lease <= 0:
+            return
+        if now is None:
+            now = time.monotonic()
+        if now < self.__renew_at:
+            return
+        self.task.start()
+        self.renew_count += 1
+        self.__arm(now)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.stop()
+            self.task = None
+
+    def __arm(self, now: float):
+        if self.lease > 0:
+            # カーネルは now + k * period に送る
+            self.__renew_at = now + max(int(self.lease / 2 / self.period), 1) * self.period
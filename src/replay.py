@@ -0,0 +1,116 @@
+# main.py --record で記録した試合のUDPパケットを、ループバックで main.py に送り直す
+# main.py が送ったCANフレームを受信して、順番と時刻をファイルに書き出す（コミット間で diff して比べる）
+#
+# ロボットなしで動かす手順（仮想CAN. main.py は can0 を開くので、vcan を can0 という名前で作る）
+#   sudo ip link add dev can0 type vcan && sudo ip link set can0 up
+#   python src/main.py --host 127.0.0.1 &
+#   python src/replay.py logs/record --speed 1 --output replay.txt
+#   python src/replay.py logs/record --afap --output replay_afap.txt
+import argparse
+import heapq
+import os
+import socket
+import threading
+import time
+from typing import Dict, Iterator, List, Tuple
+import can
+from can_trace import FLAG_TX, read_trace
+from traffic_record import read_datagrams, record_paths
+
+# (timestamp, 種類, データ)
+#   種類: 0=ボタン, 1=足回り, 2=マイコンから受信したCANフレーム
+CONTROLLER = 0
+WHEEL = 1
+CAN_RX = 2
+
+def load_events(record_dir: str, inject_rx: bool) -> List[Tuple[float, int, object]]:
+    (controller_path, wheel_path, can_trace_path) = record_paths(record_dir)
+    streams: List[Iterator[Tuple[float, int, object]]] = []
+    if os.path.exists(controller_path):
+        streams.append((t, CONTROLLER, raw) for (t, raw) in read_datagrams(controller_path))
+    if os.path.exists(wheel_path):
+        streams.append((t, WHEEL, raw) for (t, raw) in read_datagrams(wheel_path))
+    if inject_rx and os.path.exists(can_trace_path):
+        streams.append(
+            (t, CAN_RX, (can_id, data))
+            for (t, can_id, flags, data) in read_trace(can_trace_path)
+            if not flags & FLAG_TX
+        )
+    return list(heapq.merge(*streams, key=lambda event: event[0]))
+
+class FrameCapture(can.Listener):
+    def __init__(self):
+        super().__init__()
+        self.frames: List[Tuple[float, int, bytes]] = []
+        self.lock = threading.Lock()
+
+    def on_message_received(self, msg: can.Message):
+        if msg.is_error_frame:
+            return
+        with self.lock:
+            self.frames.append((time.monotonic(), msg.arbitration_id, bytes(msg.data)))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("record_dir")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--port-for-wheel", type=int, default=12346)
+    parser.add_argument("--speed", type=float, default=1.0, help="再生速度（1.0 = 記録したときと同じ）")
+    parser.add_argument("--afap", action="store_true", help="待たずにできるだけ速く送る")
+    parser.add_argument("--inject-rx", action="store_true", help="記録したマイコンからのフレーム（RESPONSE_* など）もCANに流す")
+    parser.add_argument("--interface", default="socketcan")
+    parser.add_argument("--channel", default="can0")
+    parser.add_argument("--settle", type=float, default=1.0, help="送り終わってからCANを待つ秒数")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    events = load_events(args.record_dir, args.inject_rx)
+    if len(events) == 0:
+        print(f"No recorded packets in {args.record_dir}")
+        return
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    addresses = {CONTROLLER: (args.host, args.port), WHEEL: (args.host, args.port_for_wheel)}
+
+    capture = FrameCapture()
+    with can.Bus(channel=args.channel, interface=args.interface) as bus:
+        notifier = can.Notifier(bus, [capture])
+
+        first_time = events[0][0]
+        started = time.monotonic()
+        for (timestamp, kind, payload) in events:
+            if not args.afap:
+                delay = started + (timestamp - first_time) / args.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            if kind == CAN_RX:
+                (can_id, data) = payload
+                bus.send(can.Message(arbitration_id=can_id, data=data, is_extended_id=False))
+            else:
+                sock.sendto(payload, addresses[kind])
+        sent_duration = time.monotonic() - started
+
+        time.sleep(args.settle)
+        notifier.stop()
+
+    with capture.lock:
+        frames = list(capture.frames)
+
+    counts: Dict[int, int] = {}
+    lines = []
+    for (t, can_id, data) in frames:
+        counts[can_id] = counts.get(can_id, 0) + 1
+        lines.append(f"{(t - started) * 1000:10.3f} {can_id:03X}#{data.hex().upper()}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    print(f"replayed {len(events)} events in {sent_duration:.3f} s")
+    print(f"captured {len(frames)} CAN frames")
+    for (can_id, count) in sorted(counts.items()):
+        print(f"  {can_id:03X}: {count}")
+
+if __name__ == "__main__":
+    main()
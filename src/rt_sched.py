@@ -0,0 +1,129 @@
+import gc
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Set
+
+# ワーカー（プロセス・スレッド）ごとに、使うCPUとスケジューリングを決める
+#   "wheel_control=3:fifo=50,can_rx=2:fifo=40,main=1:nice=-5"
+#   CPU は "3" か "2+3"（省略するとそのまま）, スケジューリングは fifo=優先度 / rr=優先度 / nice=値（省略するとそのまま）
+# SCHED_FIFO・負の nice は root か CAP_SYS_NICE が必要. 許可されないときは nice、それもだめならそのままで続ける
+#
+# ワーカーの名前
+#   main:          main() のループ（ボタンのパケット）のプロセス. 後から作るスレッドもこれを引き継ぐ
+#   wheel_rx:      manageWheelControl（足回りのパケットの受信）のプロセス
+#   wheel_control: sendWheelDataRegularly（足回りの制御ループ）のプロセス
+#   is_active:     sendIsActiveMessage のプロセス
+#   can_tx:        CANTransmitter のスレッド
+#   can_rx:        python-can の Notifier のスレッド
+WORKERS = ("main", "wheel_rx", "wheel_control", "is_active", "can_tx", "can_rx")
+
+# --rt default（ラズパイ4: CPU 0 はOSと他のプロセスに残す）
+DEFAULT_LAYOUT = "main=1:nice=-5,wheel_rx=2:fifo=40,wheel_control=3:fifo=50,is_active=3:fifo=45,can_tx=2:fifo=45,can_rx=2:fifo=40"
+
+# スレッドの名前（threading.Thread の name の先頭）
+THREAD_NAMES = {
+    "can_tx": "CANTransmitter",
+    "can_rx": "can.notifier",
+}
+
+# GC
+GC_DEFAULT = "default" # 何もしない
+GC_FREEZE = "freeze" # 起動後に gc.freeze() する（起動までに作ったオブジェクトを GC で調べなくなり、1回の GC が短くなる）
+GC_OFF = "off" # freeze に加えて、制御ループのプロセス（HOT_WORKERS）では GC を止める（参照カウントでは消えない循環参照は溜まる）
+GC_MODES = (GC_DEFAULT, GC_FREEZE, GC_OFF)
+HOT_WORKERS = ("wheel_rx", "wheel_control", "is_active")
+
+class WorkerSetting:
+    def __init__(self, cpus: Optional[Set[int]] = None, policy: Optional[str] = None, priority: int = 0):
+        self.cpus = cpus
+        # "fifo", "rr", "nice" か None
+        self.policy = policy
+        self.priority = priority
+
+def parse_layout(spec: str) -> Dict[str, WorkerSetting]:
+    if spec == "default":
+        spec = DEFAULT_LAYOUT
+    layout: Dict[str, WorkerSetting] = {}
+    for item in spec.split(","):
+        if item.strip() == "":
+            continue
+        (name, _, value) = item.strip().partition("=")
+        if name not in WORKERS:
+            raise ValueError(f"Unknown worker: {name} (one of {', '.join(WORKERS)})")
+        setting = WorkerSetting()
+        for token in value.split(":"):
+            if token == "":
+                continue
+            (key, _, number) = token.partition("=")
+            if key in ("fifo", "rr", "nice"):
+                setting.policy = key
+                setting.priority = int(number)
+            else:
+                setting.cpus = {int(cpu) for cpu in token.split("+")}
+        layout[name] = setting
+    return layout
+
+class RealtimeScheduler:
+    def __init__(self, layout: Dict[str, WorkerSetting], gc_mode: str = GC_DEFAULT, write: Callable[[str], None] = print):
+        if gc_mode not in GC_MODES:
+            raise ValueError(f"Unknown gc mode: {gc_mode}")
+        self.layout = layout
+        self.gc_mode = gc_mode
+        self.write = write
+
+    # プロセスのワーカーの最初に呼ぶ（このプロセスの呼んだスレッドに設定する）
+    def apply_process(self, name: str):
+        setting = self.layout.get(name)
+        if setting is not None:
+            self.__apply(name, threading.get_native_id(), setting)
+        self.__configure_gc(name)
+
+    # スレッドのワーカー（THREAD_NAMES）に設定する. 起動済みのスレッドだけが対象
+    def apply_threads(self):
+        for (name, thread_name) in THREAD_NAMES.items():
+            setting = self.layout.get(name)
+            if setting is None:
+                continue
+            threads = [thread for thread in threading.enumerate() if thread.name.startswith(thread_name)]
+            if len(threads) == 0:
+                self.write(f"RT {name}: no thread named {thread_name}")
+            for thread in threads:
+                self.__apply(name, thread.native_id, setting)
+
+    def __apply(self, name: str, tid: int, setting: WorkerSetting):
+        results: List[str] = []
+        if setting.cpus is not None:
+            try:
+                os.sched_setaffinity(tid, setting.cpus)
+                results.append("cpu=" + "+".join(str(cpu) for cpu in sorted(setting.cpus)))
+            except (OSError, ValueError) as e:
+                results.append(f"cpu failed ({e})")
+        if setting.policy in ("fifo", "rr"):
+            policy = os.SCHED_FIFO if setting.policy == "fifo" else os.SCHED_RR
+            try:
+                os.sched_setscheduler(tid, policy, os.sched_param(setting.priority))
+                results.append(f"{setting.policy}={setting.priority}")
+            except (OSError, ValueError) as e:
+                # 許可されないときは nice で少しでも優先させる
+                results.append(f"{setting.policy} failed ({e})")
+                results.append(self.__nice(tid, -10))
+        elif setting.policy == "nice":
+            results.append(self.__nice(tid, setting.priority))
+        self.write(f"RT {name} (tid {tid}): {', '.join(results)}")
+
+    def __nice(self, tid: int, value: int) -> str:
+        try:
+            # Linux では nice はスレッドごと
+            os.setpriority(os.PRIO_PROCESS, tid, value)
+            return f"nice={value}"
+        except OSError as e:
+            return f"nice={value} failed ({e})"
+
+    def __configure_gc(self, name: str):
+        if self.gc_mode == GC_DEFAULT:
+            return
+        # 起動までに作ったオブジェクトは GC の対象から外す（fork した子プロセスのページも書き換えなくなる）
+        # 世代0の閾値を上げると回数は減るが1回が長くなり、周期の遅れの最大値は大きくなるのでそのままにする
+        gc.freeze()
+        if self.gc_mode == GC_OFF and name in HOT_WORKERS:
+            gc.disable()
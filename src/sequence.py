@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Generator, List, Optional, Tuple, Union
+
+# 応答（Future の完了）を待つステップ
+#   timeout 秒以内に完了すればすぐに次のステップへ進み、yield の値は Future の結果になる
+#   完了しなければ on_timeout を呼び、さらに fallback 秒待ってから進む（yield の値は None）
+#   どちらの場合も最後に cleanup を呼ぶ
+class WaitFor:
+    def __init__(
+            self,
+            future: Future,
+            timeout: float,
+            fallback: float = 0.0,
+            on_timeout: Optional[Callable[[], None]] = None,
+            cleanup: Optional[Callable[[], None]] = None
+        ):
+        self.future = future
+        self.timeout = timeout
+        self.fallback = fallback
+        self.on_timeout = on_timeout
+        self.cleanup = cleanup
+
+# シーケンスは generator 関数で書く
+# yield した秒数だけ待ってから次のステップを実行する（待ち時間中もメインループは止まらない）
+# WaitFor を yield すると応答を待つ（response = yield WaitFor(...)）
+Sequence = Generator[Union[float, WaitFor], Any, None]
+SequenceFactory = Callable[[], Sequence]
+
+# 結果
+DONE = "done"
+PREEMPTED = "preempted" # 同じ group の新しいシーケンスに途中で止められた
+COALESCED = "coalesced" # 始まる前に同じ group の新しいシーケンスに置き換えられた
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+# (name, 結果, start() されてから始まるまでの秒数, 実行していた秒数)
+SequenceReport = Callable[[str, str, float, float], None]
+
+class SequenceRunner:
+    def __init__(self, update_error_log: Optional[Callable[[str], None]] = None, on_finished: Optional[SequenceReport] = None):
+        self.update_error_log = update_error_log
+        self.on_finished = on_finished
+
+        # (name, factory, group, start() された時刻)
+        self.__queue: Deque[Tuple[str, SequenceFactory, Optional[str], float]] = deque()
+        self.__cond = threading.Condition()
+        self.__cancel_event = threading.Event()
+        self.__current: Optional[str] = None
+        self.__current_group: Optional[str] = None
+        self.__cancel_reason = CANCELLED
+        # WaitFor で待っているときに起こすためのイベント
+        self.__wake: Optional[threading.Event] = None
+
+        self.__thread = threading.Thread(target=self.__run, name="SequenceRunner", daemon=True)
+        self.__thread.start()
+
+    # replace=True なら、同じ group のまだ始まっていないシーケンスを捨て、実行中のものは次のステップの前で止めてから始める
+    def start(self, name: str, factory: SequenceFactory, group: Optional[str] = None, replace: bool = False):
+        reports: List[Tuple[str, str, float, float]] = []
+        now = time.monotonic()
+        with self.__cond:
+            if replace and group is not None:
+                for item in [item for item in self.__queue if item[2] == group]:
+                    self.__queue.remove(item)
+                    reports.append((item[0], COALESCED, now - item[3], 0.0))
+                if self.__current is not None and self.__current_group == group:
+                    self.__cancel_reason = PREEMPTED
+                    self.__interrupt()
+            self.__queue.append((name, factory, group, now))
+            self.__cond.notify_all()
+        self.__report(reports)
+
+    def is_running(self) -> bool:
+        with self.__cond:
+            return self.__current is not None or len(self.__queue) > 0
+
+    def current_name(self) -> Optional[str]:
+        with self.__cond:
+            return self.__current
+
+    # 実行中のシーケンスを次のステップの前で止め、待ち行列も空にする
+    def cancel(self):
+        now = time.monotonic()
+        with self.__cond:
+            reports = [(item[0], CANCELLED, now - item[3], 0.0) for item in self.__queue]
+            self.__queue.clear()
+            if self.__current is not None:
+                self.__cancel_reason = CANCELLED
+                self.__interrupt()
+        self.__report(reports)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        with self.__cond:
+            return self.__cond.wait_for(lambda: self.__current is None and len(self.__queue) == 0, timeout=timeout)
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                while len(self.__queue) == 0:
+                    self.__cond.wait()
+                (name, factory, group, requested_at) = self.__queue.popleft()
+                self.__current = name
+                self.__current_group = group
+                self.__cancel_event.clear()
+
+            started_at = time.monotonic()
+            result = FAILED
+            try:
+                result = DONE if self.__execute(factory()) else self.__cancel_reason
+            except Exception as e:
+                print(f"Error at SequenceRunner ({name}): {e}")
+                if self.update_error_log is not None:
+                    self.update_error_log(f"Error at SequenceRunner ({name}): {e}")
+            finally:
+                finished_at = time.monotonic()
+                with self.__cond:
+                    self.__current = None
+                    self.__current_group = None
+                    self.__cond.notify_all()
+                self.__report([(name, result, started_at - requested_at, finished_at - started_at)])
+
+    # self.__cond を取って呼ぶ
+    def __interrupt(self):
+        self.__cancel_event.set()
+        if self.__wake is not None:
+            self.__wake.set()
+
+    # 最後まで実行したら True
+    def __execute(self, sequence: Sequence) -> bool:
+        try:
+            value = None
+            while True:
+                try:
+                    step = sequence.send(value)
+                except StopIteration:
+                    return True
+                if self.__cancel_event.is_set():
+                    return False
+                value = None
+                if isinstance(step, WaitFor):
+                    (cancelled, value) = self.__wait_for(step)
+                    if cancelled:
+                        return False
+                elif step > 0 and self.__cancel_event.wait(step):
+                    return False
+        finally:
+            sequence.close()
+
+    # (止められたか, 応答)
+    def __wait_for(self, step: WaitFor) -> Tuple[bool, Any]:
+        wake = threading.Event()
+        with self.__cond:
+            self.__wake = wake
+        try:
+            step.future.add_done_callback(lambda future: wake.set())
+            if not self.__cancel_event.is_set():
+                wake.wait(step.timeout)
+            if self.__cancel_event.is_set():
+                return (True, None)
+            if step.future.done() and not step.future.cancelled():
+                return (False, step.future.result())
+        finally:
+            with self.__cond:
+                self.__wake = None
+            if step.cleanup is not None:
+                step.cleanup()
+
+        if step.on_timeout is not None:
+            step.on_timeout()
+        if step.fallback > 0 and self.__cancel_event.wait(step.fallback):
+            return (True, None)
+        return (False, None)
+
+    def __report(self, reports: List[Tuple[str, str, float, float]]):
+        if self.on_finished is None:
+            return
+        for report in reports:
+            self.on_finished(*report)
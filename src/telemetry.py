@@ -0,0 +1,74 @@
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+from wire_format import TelemetryEncoder
+
+# ロボットの状態をスマホ（最後にボタンのパケットが届いたアドレス）に rate Hz で送る
+# 作るのも送るのもこのスレッドだけで、main() のループは何もしない
+#   - collect() で今の値を集め、変わったフィールドだけを送る（wire_format.TelemetryEncoder）
+#   - full_interval 秒ごとと、送り先が変わったときは全フィールドを送る
+class TelemetryUplink:
+    def __init__(
+            self,
+            sock: socket.socket,
+            get_addr: Callable[[], Optional[Tuple[str, int]]],
+            collect: Callable[[], Sequence[int]],
+            rate: float = 10.0,
+            full_interval: float = 1.0,
+            update_error_log: Optional[Callable[[str], None]] = None
+        ):
+        self.sock = sock
+        self.get_addr = get_addr
+        self.collect = collect
+        self.period = 1 / rate
+        self.full_interval = full_interval
+        self.update_error_log = update_error_log
+        self.encoder = TelemetryEncoder()
+
+        self.sent = 0
+        self.sent_bytes = 0
+        self.errors = 0
+        self.__stop_event = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__run, name="TelemetryUplink", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout=1)
+
+    def stats(self) -> Dict[str, int]:
+        return {"sent": self.sent, "bytes": self.sent_bytes, "errors": self.errors}
+
+    def __run(self):
+        last_addr = None
+        next_full = 0.0
+        next_time = time.monotonic()
+        while not self.__stop_event.wait(max(next_time - time.monotonic(), 0)):
+            now = time.monotonic()
+            next_time = max(next_time + self.period, now)
+            addr = self.get_addr()
+            if addr is None:
+                continue
+            full = addr != last_addr or now >= next_full
+            if full:
+                next_full = now + self.full_interval
+            last_addr = addr
+
+            packet = self.encoder.encode(self.collect(), full=full)
+            if packet is None:
+                continue
+            try:
+                self.sock.sendto(packet, addr)
+            except OSError as e:
+                self.errors += 1
+                # スマホが切断されている間は送れないので、最初の1回だけ記録する
+                if self.errors == 1 and self.update_error_log is not None:
+                    self.update_error_log(f"Error at TelemetryUplink: {e}")
+                continue
+            self.sent += 1
+            self.sent_bytes += len(packet)
@@ -0,0 +1,63 @@
+import os
+import struct
+import time
+from typing import Iterator, Tuple
+
+# コントローラから届いたUDPパケットを、受信時刻付きでそのまま記録する（replay.py で再生する）
+#
+# ファイル形式: FILE_HEADER の後に RECORD + パケット本体 が並ぶ
+#   timestamp(f64, time.time()) length(u16)
+FILE_HEADER = b"R1UDPRC\x01"
+RECORD = struct.Struct("<dH")
+
+CONTROLLER_FILE = "udp_controller.bin"
+WHEEL_FILE = "udp_wheel.bin"
+CAN_TRACE_FILE = "can_trace.bin"
+
+class DatagramRecorder:
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        # fork した子プロセスで使うこともあるので、最初に書くときに開く
+        self.__file = None
+
+    def record(self, raw: bytes, addr: Tuple[str, int]):
+        if self.__file is None:
+            directory = os.path.dirname(self.path)
+            if directory != "":
+                os.makedirs(directory, exist_ok=True)
+            self.__file = open(self.path, "ab")
+            if self.__file.tell() == 0:
+                self.__file.write(FILE_HEADER)
+
+        self.__file.write(RECORD.pack(time.time(), len(raw)))
+        self.__file.write(raw)
+        # 子プロセスは terminate() で止めるので、毎回書き出しておく
+        self.__file.flush()
+        self.count += 1
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+def read_datagrams(path: str) -> Iterator[Tuple[float, bytes]]:
+    with open(path, "rb") as f:
+        if f.read(len(FILE_HEADER)) != FILE_HEADER:
+            raise ValueError(f"{path} is not a UDP record file")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            (timestamp, length) = RECORD.unpack(header)
+            raw = f.read(length)
+            if len(raw) < length:
+                return
+            yield (timestamp, raw)
+
+def record_paths(record_dir: str) -> Tuple[str, str, str]:
+    return (
+        os.path.join(record_dir, CONTROLLER_FILE),
+        os.path.join(record_dir, WHEEL_FILE),
+        os.path.join(record_dir, CAN_TRACE_FILE),
+    )
@@ -0,0 +1,119 @@
+import json
+import select
+import socket
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# datagram -> (順序を表す値 or None, 中身)
+DatagramParser = Callable[[bytes], Tuple[Optional[int], Any]]
+# 採用した中身 -> 返す値（捨てるパケットまで変換しないように分けている）
+DatagramBuilder = Callable[[Any], Any]
+
+# JSONのパケットの順序を表す値: "seq"（連番）か "timestamp"
+# 数値でなければ（"7" など）比べられないので、連番のないパケットとして扱う（None）
+def sequence_key(data: Dict) -> Optional[int]:
+    key = data.get("seq", data.get("timestamp"))
+    if not isinstance(key, (int, float)) or isinstance(key, bool):
+        return None
+    return key
+
+# "seq"（連番）か "timestamp" があれば、それを使って古いパケットを捨てる
+def parse_json_datagram(raw: bytes) -> Tuple[Optional[int], Dict]:
+    data = json.loads(raw)
+    if not isinstance(data, dict):
+        raise ValueError(f"Invalid packet: {raw[:32]}")
+    return (sequence_key(data), data)
+
+# ソケットに溜まっているパケットを全部読み、最新の1つだけを返す
+class LatestDatagramReceiver:
+    def __init__(self, sock: socket.socket, parse: DatagramParser = parse_json_datagram, build: Optional[DatagramBuilder] = None, bufsize: int = 1024, reset_after: float = 1.0):
+        self.sock = sock
+        self.parse = parse
+        self.build = build
+        # 受信したパケットを（捨てるものも含めて）そのまま渡す先. 記録用（traffic_record.py）
+        self.on_datagram: Optional[Callable[[bytes, Tuple[str, int]], None]] = None
+        # LatencyProbe を入れると "decode"/"client_controller" の時間と到着時刻（last_arrival_ns）を記録する
+        self.probe = None
+        self.last_arrival_ns = 0
+        self.bufsize = bufsize
+        # この時間パケットが来なかったら、コントローラが再起動したとみなして連番をリセットする
+        self.reset_after = reset_after
+
+        self.last_addr: Optional[Tuple[str, int]] = None
+        self.__last_key: Optional[int] = None
+        self.__last_accepted = 0.0
+
+        self.received = 0
+        self.dropped = 0
+        self.stale = 0
+        self.invalid = 0
+
+    def receive(self, timeout: Optional[float] = None) -> Optional[Any]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            (readable, _, _) = select.select([self.sock], [], [], wait)
+            if not readable:
+                return None
+            if self.probe is not None:
+                self.last_arrival_ns = time.monotonic_ns()
+
+            latest = self.__drain()
+            if latest is None:
+                continue
+            if self.build is None:
+                return latest
+            if self.probe is None:
+                return self.build(latest)
+
+            start = time.monotonic_ns()
+            result = self.build(latest)
+            self.probe.add_stage("client_controller", time.monotonic_ns() - start)
+            return result
+
+    def __drain(self) -> Optional[Any]:
+        latest = None
+
+        while True:
+            try:
+                (raw, addr) = self.sock.recvfrom(self.bufsize, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return latest
+            self.received += 1
+            if self.on_datagram is not None:
+                self.on_datagram(raw, addr)
+
+            try:
+                if self.probe is None:
+                    (key, payload) = self.parse(raw)
+                else:
+                    start = time.monotonic_ns()
+                    (key, payload) = self.parse(raw)
+                    self.probe.add_stage("decode", time.monotonic_ns() - start)
+            except ValueError as e:
+                self.invalid += 1
+                print(f"Invalid packet is received: {e}")
+                continue
+
+            now = time.monotonic()
+            if key is not None and self.__last_key is not None \
+                    and key <= self.__last_key and now - self.__last_accepted < self.reset_after:
+                # 順番が入れ替わった or 遅れて届いたパケット
+                self.stale += 1
+                continue
+
+            if latest is not None:
+                self.dropped += 1
+            latest = payload
+            self.last_addr = addr
+            self.__last_key = key
+            self.__last_accepted = now
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "stale": self.stale,
+            "invalid": self.invalid,
+        }
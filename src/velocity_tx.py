@@ -0,0 +1,64 @@
+import ctypes
+import multiprocessing
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+WheelValues = Tuple[int, int, int]
+
+# ROBOT_VEL の送信をまとめる
+# tick_period ごとに update() を呼ぶと
+#   - 前回送った値から threshold 以上変わっていればすぐ送る
+#   - 変わっていなくても refresh_interval ごとに送る
+#   - どちらでも min_interval より短い間隔では送らない（送信数の上限 = 1 / min_interval）
+class VelocityTransmitter:
+    # counters
+    SENT = 0
+    SUPPRESSED = 1
+
+    def __init__(
+            self,
+            send: Callable[[WheelValues], None],
+            tick_period: float = 0.01,
+            min_interval: float = 0.02,
+            refresh_interval: float = 0.1,
+            threshold: int = 1
+        ):
+        self.send = send
+        self.tick_period = tick_period
+        self.min_interval = min_interval
+        self.refresh_interval = refresh_interval
+        self.threshold = threshold
+
+        self.__last_sent: Optional[WheelValues] = None
+        self.__last_sent_time = float("-inf")
+        # 送信は子プロセスで行うので、カウンタは共有メモリに置く
+        self.__counters = multiprocessing.RawArray(ctypes.c_uint64, 2)
+
+    def update(self, values: WheelValues, now: Optional[float] = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        elapsed = now - self.__last_sent_time
+
+        if elapsed >= self.min_interval and (elapsed >= self.refresh_interval or self.__is_changed(values)):
+            self.send(values)
+            self.__last_sent = values
+            self.__last_sent_time = now
+            self.__counters[self.SENT] += 1
+            return True
+
+        self.__counters[self.SUPPRESSED] += 1
+        return False
+
+    def __is_changed(self, values: WheelValues) -> bool:
+        last = self.__last_sent
+        if last is None:
+            return True
+        return abs(values[0] - last[0]) >= self.threshold \
+            or abs(values[1] - last[1]) >= self.threshold \
+            or abs(values[2] - last[2]) >= self.threshold
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sent": self.__counters[self.SENT],
+            "suppressed": self.__counters[self.SUPPRESSED],
+        }
@@ -0,0 +1,183 @@
+import ctypes
+import multiprocessing
+import time
+from typing import Callable, Dict, Optional, Tuple
+from wheel_state import NEUTRAL_WHEEL_DATA
+
+WheelValues = Tuple[int, int, int]
+# (vx, vy, omega, time.monotonic() の受信時刻)
+WheelSample = Tuple[int, int, int, float]
+
+# 足回りの指令値を一定周期で作る
+# スマホのパケットは Wi-Fi の都合で固まって届いたり途切れたりするので、届いた値をそのまま送らずに
+#   - interpolation_delay 秒前の時刻の値を、前後2つのパケットから直線で補間する
+#   - 最後のパケットより新しい時刻は、最後の2つの傾きで max_extrapolation 秒まで外挿する（それ以降は最後の値のまま）
+#     ただし外挿で停止(127)をまたいで逆向きの指令にはしない
+#     固まって届いたパケットの間隔は短すぎるので、傾きは間隔を min_interval 秒（tick の周期）以上として求め、
+#     外挿で動かす量は最後の2つの差までにする
+#   - 1秒あたりの変化量を軸ごとに slew 以下にする（急な加速・減速をしない. 0 なら制限しない）
+# deadline 秒以上パケットがなければ、slew に関係なくすぐに止まる指令値にする（これまで通り）
+class WheelController:
+    def __init__(
+            self,
+            read: Callable[[], WheelSample],
+            deadline: float = 0.5,
+            slew: Tuple[float, float, float] = (1000.0, 1000.0, 1000.0),
+            interpolation_delay: float = 0.0,
+            max_extrapolation: float = 0.02,
+            min_interval: float = 0.01
+        ):
+        self.read = read
+        self.deadline = deadline
+        self.slew = slew
+        self.interpolation_delay = interpolation_delay
+        self.max_extrapolation = max_extrapolation
+        self.min_interval = min_interval
+
+        # 最後の2つのパケット (値, 受信時刻)
+        self.__previous: Optional[Tuple[Tuple[float, float, float], float]] = None
+        self.__last: Optional[Tuple[Tuple[float, float, float], float]] = None
+        # 前回の出力（slew をかける前の float のまま持つ）
+        self.__output = [float(value) for value in NEUTRAL_WHEEL_DATA]
+        self.__output_time: Optional[float] = None
+
+    # tick ごとに呼ぶ
+    def step(self, now: Optional[float] = None) -> WheelValues:
+        if now is None:
+            now = time.monotonic()
+        (vx, vy, omega, timestamp) = self.read()
+        if self.__last is None or timestamp != self.__last[1]:
+            self.__previous = self.__last
+            self.__last = ((float(vx), float(vy), float(omega)), timestamp)
+
+        output = self.__output
+        if now - self.__last[1] > self.deadline:
+            output[0] = output[1] = output[2] = 127.0
+            self.__output_time = now
+            return NEUTRAL_WHEEL_DATA
+
+        target = self.__target(now)
+        elapsed = now - self.__output_time if self.__output_time is not None else None
+        self.__output_time = now
+        for axis in range(3):
+            limit = self.slew[axis]
+            if elapsed is None or limit <= 0:
+                output[axis] = target[axis]
+                continue
+            delta = target[axis] - output[axis]
+            max_delta = limit * elapsed
+            if delta > max_delta:
+                delta = max_delta
+            elif delta < -max_delta:
+                delta = -max_delta
+            output[axis] += delta
+        return (clamp_byte(output[0]), clamp_byte(output[1]), clamp_byte(output[2]))
+
+    def __target(self, now: float) -> Tuple[float, float, float]:
+        (last, last_time) = self.__last
+        previous = self.__previous
+        if previous is None:
+            return last
+        (previous_values, previous_time) = previous
+        interval = last_time - previous_time
+        # 間が空いたパケットの傾きは使わない
+        if interval <= 0 or interval > self.deadline:
+            return last
+
+        t = now - self.interpolation_delay
+        if t <= last_time:
+            ratio = max((t - previous_time) / interval, 0.0)
+            return (
+                previous_values[0] + (last[0] - previous_values[0]) * ratio,
+                previous_values[1] + (last[1] - previous_values[1]) * ratio,
+                previous_values[2] + (last[2] - previous_values[2]) * ratio,
+            )
+        ratio = min(min(t - last_time, self.max_extrapolation) / max(interval, self.min_interval), 1.0)
+        return (
+            extrapolate(previous_values[0], last[0], ratio),
+            extrapolate(previous_values[1], last[1], ratio),
+            extrapolate(previous_values[2], last[2], ratio),
+        )
+
+def extrapolate(previous: float, last: float, ratio: float) -> float:
+    value = last + (last - previous) * ratio
+    if last >= 127.0 and value < 127.0 or last <= 127.0 and value > 127.0:
+        return 127.0
+    return value
+
+def clamp_byte(value: float) -> int:
+    value = int(round(value))
+    return 0 if value < 0 else 255 if value > 255 else value
+
+# 一定周期のループの時刻を決め、間に合わなかった周期（overrun）を数える
+#   start = clock.begin(now)  # tick の処理の前
+#   delay = clock.end(now)    # tick の処理の後. delay 秒待ってから次の tick
+# 次の tick の予定時刻を過ぎてから処理が終わったら overrun. 遅れた分はまとめて取り戻さずに、今から周期をやり直す
+# ループは子プロセスで動くので、カウンタは共有メモリに置く
+class FixedRateClock:
+    # counters
+    TICKS = 0
+    OVERRUNS = 1
+    SKIPPED = 2
+    # maxima（秒）
+    MAX_LATENESS = 0
+    MAX_WORK = 1
+
+    def __init__(self, period: float, on_overrun: Optional[Callable[[str], None]] = None, report_interval: float = 1.0, name: str = "loop"):
+        self.period = period
+        self.on_overrun = on_overrun
+        self.report_interval = report_interval
+        self.name = name
+
+        self.__counters = multiprocessing.RawArray(ctypes.c_uint64, 3)
+        self.__maxima = multiprocessing.RawArray(ctypes.c_double, 2)
+        self.__next: Optional[float] = None
+        self.__started = 0.0
+        # 前回 on_overrun に渡してからの overrun
+        self.__unreported = 0
+        self.__reported_at = float("-inf")
+
+    def begin(self, now: float) -> float:
+        if self.__next is None:
+            self.__next = now
+        lateness = now - self.__next
+        if lateness > self.__maxima[self.MAX_LATENESS]:
+            self.__maxima[self.MAX_LATENESS] = lateness
+        self.__started = now
+        self.__counters[self.TICKS] += 1
+        return lateness
+
+    def end(self, now: float) -> float:
+        work = now - self.__started
+        if work > self.__maxima[self.MAX_WORK]:
+            self.__maxima[self.MAX_WORK] = work
+
+        self.__next += self.period
+        if now <= self.__next:
+            return self.__next - now
+
+        skipped = int((now - self.__next) / self.period)
+        self.__counters[self.OVERRUNS] += 1
+        self.__counters[self.SKIPPED] += skipped
+        self.__unreported += 1
+        if self.on_overrun is not None and now - self.__reported_at >= self.report_interval:
+            self.on_overrun(
+                f"{self.name}: {self.__unreported} overrun(s) (period {self.period * 1000:g} ms, "
+                f"{(now - self.__next) * 1000:.1f} ms past the next tick, work {work * 1000:.1f} ms)"
+            )
+            self.__unreported = 0
+            self.__reported_at = now
+        self.__next = now
+        return 0.0
+
+    def overruns(self) -> int:
+        return self.__counters[self.OVERRUNS]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "ticks": self.__counters[self.TICKS],
+            "overruns": self.__counters[self.OVERRUNS],
+            "skipped": self.__counters[self.SKIPPED],
+            "max_lateness_ms": self.__maxima[self.MAX_LATENESS] * 1000,
+            "max_work_ms": self.__maxima[self.MAX_WORK] * 1000,
+        }
@@ -0,0 +1,49 @@
+import ctypes
+import os
+import time
+from multiprocessing.sharedctypes import RawValue
+from typing import Tuple
+
+# 止まっているときの指令値
+NEUTRAL_WHEEL_DATA = (127, 127, 127)
+
+class WheelRecord(ctypes.Structure):
+    _fields_ = [
+        ("seq", ctypes.c_uint32),
+        ("vx", ctypes.c_int),
+        ("vy", ctypes.c_int),
+        ("omega", ctypes.c_int),
+        # time.monotonic()（プロセス間で共通の時計）
+        ("timestamp", ctypes.c_double),
+    ]
+
+# 足回りの指令値をプロセス間で共有する
+# 1つの共有メモリ上の構造体に seqlock で読み書きする（書き込みは manageWheelControl の1か所だけ）
+# 古い値で止める（deadline）のは読む側の WheelController が行う
+#   write: seq を奇数にする -> 値を書く -> seq を偶数に戻す
+#   read:  seq が偶数で、読んでいる間に変わっていなければ成功
+class WheelDataSharedMemory:
+    def __init__(self):
+        self.__record = RawValue(WheelRecord)
+        (self.__record.vx, self.__record.vy, self.__record.omega) = NEUTRAL_WHEEL_DATA
+
+    def write(self, vx: int, vy: int, omega: int):
+        record = self.__record
+        record.seq += 1
+        record.vx = vx
+        record.vy = vy
+        record.omega = omega
+        record.timestamp = time.monotonic()
+        record.seq += 1
+
+    def read_with_timestamp(self) -> Tuple[int, int, int, float]:
+        record = self.__record
+        while True:
+            seq = record.seq
+            if seq & 1:
+                # 書き込み中
+                os.sched_yield()
+                continue
+            values = (record.vx, record.vy, record.omega, record.timestamp)
+            if record.seq == seq:
+                return values
@@ -0,0 +1,144 @@
+import json
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from client_data import ClientController, WheelDataFromClient
+from udp_ingest import sequence_key
+
+# スマホ -> ラズパイのバイナリ形式（リトルエンディアン, 9 byte）
+#   controller: magic(0xA1) version seq(u32) buttons(bit0:a bit1:b bit2:x bit3:y bit4:rb) seedling_hand_pos area_state
+#   wheel:      magic(0xA2) version seq(u32) v_x v_y omega
+# JSONは必ず '{' から始まるので、先頭1byteで形式を判別する（古いアプリはJSONのままで動く）
+CONTROLLER_MAGIC = 0xA1
+WHEEL_MAGIC = 0xA2
+WIRE_VERSION = 1
+
+CONTROLLER_PACKET = struct.Struct("<BBIBBB")
+WHEEL_PACKET = struct.Struct("<BBIBBB")
+PACKET_HEADER = struct.Struct("<BBI")
+
+BTN_A = 1 << 0
+BTN_B = 1 << 1
+BTN_X = 1 << 2
+BTN_Y = 1 << 3
+BTN_RB = 1 << 4
+
+def encode_controller_packet(seq: int, btn_a: int, btn_b: int, btn_x: int, btn_y: int, btn_rb: int, seedling_hand_pos: int, area_state: int) -> bytes:
+    buttons = (BTN_A if btn_a else 0) | (BTN_B if btn_b else 0) | (BTN_X if btn_x else 0) | (BTN_Y if btn_y else 0) | (BTN_RB if btn_rb else 0)
+    return CONTROLLER_PACKET.pack(CONTROLLER_MAGIC, WIRE_VERSION, seq & 0xFFFFFFFF, buttons, seedling_hand_pos, area_state)
+
+def encode_wheel_packet(seq: int, v_x: int, v_y: int, omega: int) -> bytes:
+    return WHEEL_PACKET.pack(WHEEL_MAGIC, WIRE_VERSION, seq & 0xFFFFFFFF, v_x, v_y, omega)
+
+def _parse(raw: bytes, magic: int, packet: struct.Struct) -> Tuple[Optional[int], Union[bytes, Dict]]:
+    if len(raw) > 0 and raw[0] == magic:
+        if len(raw) != packet.size:
+            raise ValueError(f"Invalid binary packet length: {len(raw)}")
+        (_, version, seq) = PACKET_HEADER.unpack_from(raw)
+        if version != WIRE_VERSION:
+            raise ValueError(f"Unsupported wire version: {version}")
+        return (seq, raw)
+
+    data = json.loads(raw)
+    if not isinstance(data, dict):
+        raise ValueError(f"Invalid packet: {raw[:32]}")
+    return (sequence_key(data), data)
+
+# LatestDatagramReceiver 用: parse は順序判定に必要な所だけ読み、build は採用した1パケットだけを変換する
+# build は毎回同じオブジェクトを書き換えて返すので、次の受信までに使い終わること
+class ControllerPacketDecoder:
+    def __init__(self):
+        self.ctr_data = ClientController.empty()
+
+    def parse(self, raw: bytes) -> Tuple[Optional[int], Union[bytes, Dict]]:
+        return _parse(raw, CONTROLLER_MAGIC, CONTROLLER_PACKET)
+
+    def build(self, parsed: Union[bytes, Dict]) -> ClientController:
+        if isinstance(parsed, dict):
+            self.ctr_data.set_from_dict(parsed)
+            return self.ctr_data
+
+        (_, _, _, buttons, seedling_hand_pos, area_state) = CONTROLLER_PACKET.unpack(parsed)
+        self.ctr_data.set_values(
+            buttons & BTN_A and 1,
+            buttons & BTN_B and 1,
+            buttons & BTN_X and 1,
+            buttons & BTN_Y and 1,
+            buttons & BTN_RB and 1,
+            seedling_hand_pos,
+            area_state
+        )
+        return self.ctr_data
+
+class WheelPacketDecoder:
+    def __init__(self):
+        self.wheel_data = WheelDataFromClient.empty()
+
+    def parse(self, raw: bytes) -> Tuple[Optional[int], Union[bytes, Dict]]:
+        return _parse(raw, WHEEL_MAGIC, WHEEL_PACKET)
+
+    def build(self, parsed: Union[bytes, Dict]) -> WheelDataFromClient:
+        if isinstance(parsed, dict):
+            self.wheel_data.set_from_dict(parsed)
+            return self.wheel_data
+
+        (_, _, _, v_x, v_y, omega) = WHEEL_PACKET.unpack(parsed)
+        self.wheel_data.set_values(v_x, v_y, omega)
+        return self.wheel_data
+
+# ラズパイ -> スマホの状態通知（リトルエンディアン）
+#   magic(0xA3) version seq(u32) mask(u16) + mask のビットが立っているフィールドだけを順番に並べる
+#   変わったフィールドだけを送り、ときどき全フィールド（mask が全部 1）を送る（途中のパケットが落ちても戻る）
+TELEMETRY_MAGIC = 0xA3
+TELEMETRY_HEADER = struct.Struct("<BBIH")
+# (名前, struct のフォーマット)
+TELEMETRY_FIELDS = (
+    ("area", "B"), # Area.value
+    ("seedling_hand_pos", "B"), # SeedlingHandPosition.value, 255 はまだ決まっていない
+    ("sequence_running", "B"), # 1: 初期化・射出のシーケンスの実行中
+    ("bus_load", "H"), # 直近1秒のCANバスの使用率（0.1%単位）
+    ("error_frames", "I"), # 起動してからのCANのエラーフレームの数
+    ("bus_off", "I"),
+    ("error_passive", "I"),
+    ("wheel_overruns", "I"), # 足回りの制御ループが周期に間に合わなかった回数
+)
+TELEMETRY_STRUCTS = tuple(struct.Struct("<" + fmt) for (_, fmt) in TELEMETRY_FIELDS)
+TELEMETRY_FULL_MASK = (1 << len(TELEMETRY_FIELDS)) - 1
+TELEMETRY_UNKNOWN = 255
+
+# 前回送った値を覚えておき、変わったフィールドだけのパケットを作る
+class TelemetryEncoder:
+    def __init__(self):
+        self.seq = 0
+        self.__last: Optional[List[int]] = None
+
+    # 何も変わっていなければ None
+    def encode(self, values: Sequence[int], full: bool = False) -> Optional[bytes]:
+        last = self.__last
+        if last is None:
+            full = True
+        mask = 0
+        for i in range(len(TELEMETRY_STRUCTS)):
+            if full or values[i] != last[i]:
+                mask |= 1 << i
+        if mask == 0:
+            return None
+
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        packet = bytearray(TELEMETRY_HEADER.pack(TELEMETRY_MAGIC, WIRE_VERSION, self.seq, mask))
+        for i in range(len(TELEMETRY_STRUCTS)):
+            if mask >> i & 1:
+                packet += TELEMETRY_STRUCTS[i].pack(values[i])
+        self.__last = list(values)
+        return bytes(packet)
+
+# スマホ側の参考実装（bench とデバッグ用）. state に上書きし、全フィールドのパケットなら True
+def decode_telemetry_packet(raw: bytes, state: Dict[str, int]) -> bool:
+    (magic, version, _, mask) = TELEMETRY_HEADER.unpack_from(raw)
+    if magic != TELEMETRY_MAGIC or version != WIRE_VERSION:
+        raise ValueError(f"Invalid telemetry packet: {raw[:8]}")
+    offset = TELEMETRY_HEADER.size
+    for (i, (name, _)) in enumerate(TELEMETRY_FIELDS):
+        if mask >> i & 1:
+            (state[name],) = TELEMETRY_STRUCTS[i].unpack_from(raw, offset)
+            offset += TELEMETRY_STRUCTS[i].size
+    return mask == TELEMETRY_FULL_MASK